@@ -0,0 +1,340 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, func, delete, update, insert, tuple_, exists
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import CrystalState, CrystalStatus, CurrentCrystalState, Crystal, CrystalRead, \
+    TestSuite, TestSuiteResult, TestSuiteResultInfo, CrystalStateTestsuiteresult, ResultMetric, ResultMetricRead
+
+
+def resolve_assemblies_composition(session: Session,
+                                   assembly_names: list[str],
+                                   timestamp: datetime) -> dict[str, list[Optional[str]]]:
+    """Crystals placed in every given assembly at `timestamp`, resolved with a single query.
+
+    For each (assembly, place) the latest crystal state at or before `timestamp` is picked
+    with a window function; the number of places is taken from the highest place that is
+    still used, exactly as `Assembly.crystal_quantity` does.
+    """
+    compositions: dict[str, list[Optional[str]]] = {name: [] for name in assembly_names}
+    if not assembly_names:
+        return compositions
+
+    latest = (select(CrystalState.assembly_name,
+                     CrystalState.place,
+                     CrystalState.crystal_name,
+                     CrystalState.status,
+                     func.row_number().over(partition_by=(CrystalState.assembly_name, CrystalState.place),
+                                            order_by=(CrystalState.timestamp.desc(), CrystalState.idx.desc())
+                                            ).label("rank"))
+              .where(CrystalState.assembly_name.in_(assembly_names))
+              .where(CrystalState.timestamp <= timestamp)
+              .subquery())
+
+    quantity = (select(CrystalState.assembly_name,
+                       func.max(CrystalState.place).label("max_place"))
+                .where(CrystalState.assembly_name.in_(assembly_names))
+                .where(CrystalState.status == CrystalStatus.USED)
+                .group_by(CrystalState.assembly_name)
+                .subquery())
+
+    rows = session.exec(select(quantity.c.assembly_name,
+                               quantity.c.max_place,
+                               latest.c.place,
+                               latest.c.crystal_name,
+                               latest.c.status)
+                        .select_from(quantity)
+                        .outerjoin(latest, and_(latest.c.assembly_name == quantity.c.assembly_name,
+                                                latest.c.place <= quantity.c.max_place,
+                                                latest.c.rank == 1))
+                        ).all()
+
+    for assembly_name, max_place, place, crystal_name, status in rows:
+        crystals = compositions[assembly_name]
+        if not crystals:
+            crystals.extend([None] * (max_place + 1))
+        if place is not None and status == CrystalStatus.USED:
+            crystals[place] = crystal_name
+    return compositions
+
+
+def current_assemblies_composition(session: Session, assembly_names: list[str]) -> dict[str, list[Optional[str]]]:
+    """Crystals currently placed in every given assembly, read from the current-state table."""
+    compositions: dict[str, list[Optional[str]]] = {name: [] for name in assembly_names}
+    if not assembly_names:
+        return compositions
+
+    rows = session.exec(select(CurrentCrystalState.assembly_name,
+                               CurrentCrystalState.place,
+                               CurrentCrystalState.crystal_name)
+                        .where(CurrentCrystalState.assembly_name.in_(assembly_names))
+                        .where(CurrentCrystalState.status == CrystalStatus.USED)
+                        ).all()
+
+    for assembly_name, place, crystal_name in rows:
+        crystals = compositions[assembly_name]
+        if place >= len(crystals):
+            crystals.extend([None] * (place + 1 - len(crystals)))
+        crystals[place] = crystal_name
+    return compositions
+
+
+def current_crystal_states_of_assembly(session: Session, assembly_name: str) -> list[CrystalState]:
+    """Latest history row of every crystal whose latest state belongs to `assembly_name`.
+
+    Resolved through the current-state table and its (assembly_name, place) index, so the
+    cost grows with the size of the assembly rather than with the length of the history.
+    """
+    return session.exec(select(CrystalState)
+                        .join(CurrentCrystalState, CurrentCrystalState.crystalstate_idx == CrystalState.idx)
+                        .where(CurrentCrystalState.assembly_name == assembly_name)
+                        .order_by(CurrentCrystalState.place, CurrentCrystalState.crystal_name)).all()
+
+
+def current_crystal_states_of_assemblies(session: Session, assembly_names: list[str]) -> dict[str, list[CrystalState]]:
+    """current_crystal_states_of_assembly for several assemblies, resolved with a single query."""
+    crystal_states: dict[str, list[CrystalState]] = {name: [] for name in assembly_names}
+    if not assembly_names:
+        return crystal_states
+
+    rows = session.exec(select(CrystalState, CurrentCrystalState.assembly_name)
+                        .join(CurrentCrystalState, CurrentCrystalState.crystalstate_idx == CrystalState.idx)
+                        .where(CurrentCrystalState.assembly_name.in_(assembly_names))
+                        .order_by(CurrentCrystalState.assembly_name, CurrentCrystalState.place,
+                                  CurrentCrystalState.crystal_name)).all()
+    for crystal_state, assembly_name in rows:
+        crystal_states[assembly_name].append(crystal_state)
+    return crystal_states
+
+
+def insert_testsuiteresults(session: Session,
+                            rows: list[tuple[int, datetime, list[CrystalState]]]) -> list[TestSuiteResult]:
+    """Inserts results given as (test suite id, timestamp, crystal states) and their link rows.
+
+    The results are inserted with one statement returning them and the link rows of all of
+    them with another, instead of flushing a crystal_states collection per result.
+    """
+    testsuiteresults = session.scalars(insert(TestSuiteResult)
+                                       .returning(TestSuiteResult, sort_by_parameter_order=True),
+                                       [{"testsuite_idx": testsuite_idx, "timestamp": timestamp}
+                                        for testsuite_idx, timestamp, _ in rows]).all()
+    link_rows = [{"crystalstate_idx": crystal_state.idx, "testsuiteresult_idx": testsuiteresult.idx}
+                 for testsuiteresult, (_, _, crystal_states) in zip(testsuiteresults, rows)
+                 for crystal_state in crystal_states]
+    if link_rows:
+        session.execute(insert(CrystalStateTestsuiteresult.__table__), link_rows)
+    return testsuiteresults
+
+
+def read_crystals(session: Session, *criteria) -> list[CrystalRead]:
+    """CrystalRead for every crystal matching `criteria`, joined with current states in one query."""
+    return to_crystal_reads(session.exec(crystals_read_query().where(*criteria)).all())
+
+
+def crystals_read_query():
+    return (select(Crystal.name, CurrentCrystalState.assembly_name, CurrentCrystalState.status)
+            .outerjoin(CurrentCrystalState, CurrentCrystalState.crystal_name == Crystal.name))
+
+
+def to_crystal_reads(rows) -> list[CrystalRead]:
+    return [CrystalRead(name=name,
+                        current_assembly=assembly_name if status == CrystalStatus.USED else None,
+                        current_status=status)
+            for name, assembly_name, status in rows]
+
+
+def read_testsuiteresult_infos(session: Session, *criteria) -> list[TestSuiteResultInfo]:
+    """TestSuiteResultInfo for every result matching `criteria`, built from one projection query."""
+    return to_testsuiteresult_infos(session.exec(testsuiteresult_infos_query().where(*criteria)).all())
+
+
+def testsuiteresult_infos_query():
+    """Result columns with the test suite name and the assembly name of the first linked crystal state.
+
+    Every endpoint listing test suite results should select through this query instead of
+    touching TestSuiteResult.testsuite and TestSuiteResult.crystal_states per row.
+    """
+    assembly_name = (select(CrystalState.assembly_name)
+                     .join(CrystalStateTestsuiteresult,
+                           CrystalStateTestsuiteresult.crystalstate_idx == CrystalState.idx)
+                     .where(CrystalStateTestsuiteresult.testsuiteresult_idx == TestSuiteResult.idx)
+                     .order_by(CrystalStateTestsuiteresult.idx)
+                     .limit(1)
+                     .correlate(TestSuiteResult)
+                     .scalar_subquery())
+    return (select(TestSuiteResult.idx,
+                   TestSuiteResult.timestamp,
+                   TestSuiteResult.testsuite_idx,
+                   TestSuite.name,
+                   assembly_name)
+            .join(TestSuite, TestSuite.idx == TestSuiteResult.testsuite_idx))
+
+
+def to_testsuiteresult_infos(rows) -> list[TestSuiteResultInfo]:
+    return [TestSuiteResultInfo(idx=idx,
+                                assembly_name=assembly_name,
+                                timestamp=timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                                testsuite_idx=testsuite_idx,
+                                testsuite_name=testsuite_name)
+            for idx, timestamp, testsuite_idx, testsuite_name, assembly_name in rows]
+
+
+def result_metric_values(session: Session, *criteria) -> list[tuple[str, str, datetime, float]]:
+    """(crystal name, metric, timestamp, value) of every indexed result metric matching `criteria`."""
+    return session.exec(select(ResultMetric.crystal_name, ResultMetric.metric, ResultMetric.timestamp, ResultMetric.value)
+                        .where(*criteria)).all()
+
+
+def result_metrics_in_assembly(assembly_name: str):
+    """Criterion on ResultMetric: the crystal was in `assembly_name` when the result was taken."""
+    return exists(select(CrystalStateTestsuiteresult.idx)
+                  .join(CrystalState, CrystalState.idx == CrystalStateTestsuiteresult.crystalstate_idx)
+                  .where(CrystalStateTestsuiteresult.testsuiteresult_idx == ResultMetric.testsuiteresult_idx)
+                  .where(CrystalState.crystal_name == ResultMetric.crystal_name)
+                  .where(CrystalState.assembly_name == assembly_name))
+
+
+def testsuiteresults_with_crystal_state(*criteria):
+    """Criterion on TestSuiteResult: one of its linked crystal states matches `criteria`."""
+    return exists(select(CrystalStateTestsuiteresult.idx)
+                  .join(CrystalState, CrystalState.idx == CrystalStateTestsuiteresult.crystalstate_idx)
+                  .where(CrystalStateTestsuiteresult.testsuiteresult_idx == TestSuiteResult.idx)
+                  .where(*criteria))
+
+
+def result_crystal_states(session: Session, testsuiteresult_idxs: list[int]) -> dict[int, list[CrystalState]]:
+    """Crystal states linked to each of the given results, read with a single query."""
+    crystal_states: dict[int, list[CrystalState]] = {idx: [] for idx in testsuiteresult_idxs}
+    rows = session.exec(select(CrystalStateTestsuiteresult.testsuiteresult_idx, CrystalState)
+                        .join(CrystalState, CrystalState.idx == CrystalStateTestsuiteresult.crystalstate_idx)
+                        .where(CrystalStateTestsuiteresult.testsuiteresult_idx.in_(testsuiteresult_idxs))
+                        .order_by(CrystalStateTestsuiteresult.idx)).all()
+    for testsuiteresult_idx, crystal_state in rows:
+        crystal_states[testsuiteresult_idx].append(crystal_state)
+    return crystal_states
+
+
+def to_result_metric_reads(result_metrics: list[ResultMetric]) -> list[ResultMetricRead]:
+    return [ResultMetricRead(testsuiteresult_idx=result_metric.testsuiteresult_idx,
+                             testsuite_idx=result_metric.testsuite_idx,
+                             crystal_name=result_metric.crystal_name,
+                             metric=result_metric.metric,
+                             timestamp=result_metric.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                             value=result_metric.value)
+            for result_metric in result_metrics]
+
+
+def apply_crystal_state(session: Session, crystal_state: CrystalState):
+    """Makes a freshly flushed crystal state current unless the crystal already has a later one."""
+    current_state = session.get(CurrentCrystalState, crystal_state.crystal_name)
+    if current_state is None:
+        session.add(current_state_from(crystal_state))
+    elif (current_state.timestamp, current_state.crystalstate_idx) <= (crystal_state.timestamp, crystal_state.idx):
+        current_state.crystalstate_idx = crystal_state.idx
+        current_state.assembly_name = crystal_state.assembly_name
+        current_state.place = crystal_state.place
+        current_state.status = crystal_state.status
+        current_state.timestamp = crystal_state.timestamp
+
+
+def sync_crystal_state_status(session: Session, crystal_state: CrystalState):
+    """Mirrors a status change of a history row into the current-state table."""
+    session.exec(update(CurrentCrystalState)
+                 .where(CurrentCrystalState.crystalstate_idx == crystal_state.idx)
+                 .values(status=crystal_state.status))
+
+
+def pull_out_displaced_crystals(session: Session,
+                                assembly_name: str,
+                                placements: list[tuple[int, str]],
+                                new_status: CrystalStatus) -> list[str]:
+    """Set-based pull_out_some_crystal_from_this_assembly for many (place, crystal_name) placements.
+
+    Returns names of the crystals whose states were changed.
+    """
+    if not placements:
+        return []
+    latest = (select(CrystalState.idx,
+                     CrystalState.place,
+                     CrystalState.crystal_name,
+                     func.row_number().over(partition_by=CrystalState.place,
+                                            order_by=(CrystalState.timestamp.desc(), CrystalState.idx.desc())
+                                            ).label("rank"))
+              .where(CrystalState.assembly_name == assembly_name)
+              .where(CrystalState.place.in_([place for place, _ in placements]))
+              .subquery())
+    displaced = (select(latest.c.idx)
+                 .where(latest.c.rank == 1)
+                 .where(tuple_(latest.c.place, latest.c.crystal_name).not_in(placements)))
+    return list(session.execute(update(CrystalState)
+                                .where(CrystalState.idx.in_(displaced))
+                                .values(status=new_status)
+                                .returning(CrystalState.crystal_name)
+                                .execution_options(synchronize_session=False)).scalars())
+
+
+def pull_out_placed_crystals(session: Session, crystal_names: list[str], new_status: CrystalStatus) -> list[str]:
+    """Set-based pull_out_this_crystal_from_some_assembly for many crystals."""
+    if not crystal_names:
+        return []
+    return list(session.execute(update(CrystalState)
+                                .where(CrystalState.crystal_name.in_(crystal_names))
+                                .where(CrystalState.status == CrystalStatus.USED)
+                                .values(status=new_status)
+                                .returning(CrystalState.crystal_name)
+                                .execution_options(synchronize_session=False)).scalars())
+
+
+def refresh_current_crystal_states(session: Session, crystal_names: Optional[list[str]] = None):
+    """Recomputes current states from history for the given crystals, or for all of them."""
+    current_states = delete(CurrentCrystalState)
+    latest = latest_crystal_states_query()
+    if crystal_names is not None:
+        if not crystal_names:
+            return
+        current_states = current_states.where(CurrentCrystalState.crystal_name.in_(crystal_names))
+        latest = latest.where(CrystalState.crystal_name.in_(crystal_names))
+    session.exec(current_states)
+
+    latest = latest.subquery()
+    session.exec(insert(CurrentCrystalState).from_select(
+        ["crystal_name", "crystalstate_idx", "assembly_name", "place", "status", "timestamp"],
+        select(latest.c.crystal_name, latest.c.idx, latest.c.assembly_name,
+               latest.c.place, latest.c.status, latest.c.timestamp).where(latest.c.rank == 1)
+    ))
+
+
+def find_inconsistent_crystals(session: Session) -> list[str]:
+    """Names of crystals whose current-state row does not match the latest row of their history."""
+    latest = latest_crystal_states_query().subquery()
+    expected = {crystal_name: tuple(state) for crystal_name, *state in
+                session.exec(select(latest.c.crystal_name, latest.c.idx, latest.c.assembly_name,
+                                    latest.c.place, latest.c.status, latest.c.timestamp)
+                             .where(latest.c.rank == 1))}
+    actual = {crystal_name: tuple(state) for crystal_name, *state in
+              session.exec(select(CurrentCrystalState.crystal_name, CurrentCrystalState.crystalstate_idx,
+                                  CurrentCrystalState.assembly_name, CurrentCrystalState.place,
+                                  CurrentCrystalState.status, CurrentCrystalState.timestamp))}
+    return sorted(name for name in expected.keys() | actual.keys() if expected.get(name) != actual.get(name))
+
+
+def latest_crystal_states_query():
+    return select(CrystalState.idx,
+                  CrystalState.crystal_name,
+                  CrystalState.assembly_name,
+                  CrystalState.place,
+                  CrystalState.status,
+                  CrystalState.timestamp,
+                  func.row_number().over(partition_by=CrystalState.crystal_name,
+                                         order_by=(CrystalState.timestamp.desc(), CrystalState.idx.desc())
+                                         ).label("rank"))
+
+
+def current_state_from(crystal_state: CrystalState) -> CurrentCrystalState:
+    return CurrentCrystalState(crystal_name=crystal_state.crystal_name,
+                               crystalstate_idx=crystal_state.idx,
+                               assembly_name=crystal_state.assembly_name,
+                               place=crystal_state.place,
+                               status=crystal_state.status,
+                               timestamp=crystal_state.timestamp)
@@ -1,27 +1,48 @@
+from contextlib import contextmanager
 from datetime import datetime
 
 from fastapi import UploadFile
 from sqlmodel import select
 
 from sqlmodel import SQLModel, Session
-from typing import Optional
+from typing import Optional, Iterator
 from enum import Enum, auto
 from sqlmodel import Field, Relationship
-from sqlalchemy import DateTime
+from sqlalchemy import DateTime, Index
+from sqlalchemy.orm import object_session
 
 from server.rdtsserver.dependencies import engine, get_session
+from server.rdtsserver.utils.storage import blob_path
 
 
 class RDTSDatabase(SQLModel):
     pass
 
 
+@contextmanager
+def session_of(instance: SQLModel) -> Iterator[Session]:
+    """The session `instance` is attached to, so properties reuse the request session; a short-lived one otherwise."""
+    session = object_session(instance)
+    if session is not None:
+        yield session
+        return
+    with Session(engine) as session:
+        yield session
+
+
 class CrystalStatus(Enum):
     USED = auto()  # используется - используется в данный timestamp сборкой assembly_id.
     UNUSED = auto()  # не используется - использовался некоторой сборкой, но потом был удален или перемещен в другую
     DESTROYED = auto()  # уничтожен - не используется никакой сборкой. assembly_id и place отсутствует
 
 
+class IngestionStatus(Enum):
+    QUEUED = auto()  # загрузка сохранена во временный каталог и ждет обработчика
+    RUNNING = auto()  # обработчик создает результат
+    DONE = auto()  # результат создан, testsuiteresult_idx заполнен
+    FAILED = auto()  # результат не создан, причина в error
+
+
 class RoleName(Enum):
     ADMIN = auto
     ENGINEER = auto()
@@ -38,6 +59,8 @@ class RoleName(Enum):
 
 class CrystalStateTestsuiteresult(RDTSDatabase, table=True):
     __tablename__ = "crystalstate_testsuiteresult_table"
+    __table_args__ = (Index("ix_crystalstate_testsuiteresult_result_state", "testsuiteresult_idx", "crystalstate_idx"),
+                      Index("ix_crystalstate_testsuiteresult_state", "crystalstate_idx"))
     idx: Optional[int] = Field(None, primary_key=True, sa_column_kwargs={"autoincrement": True})
     crystalstate_idx: Optional[int] = Field(None, foreign_key="crystals_states.idx", primary_key=True)
     testsuiteresult_idx: Optional[int] = Field(None, foreign_key="testsuiteresults.idx", primary_key=True)
@@ -59,39 +82,18 @@ class Assembly(AssemblyBase, table=True):
 
     @property
     def crystal_quantity(self) -> int:
-        with (Session(engine) as session):
-            # crystal_count = session.query(select(CrystalState).where(CrystalState.assembly_name == self.name)).count()
-            crystal_state = session.exec(select(CrystalState)
-                                         .where(CrystalState.assembly_name == self.name)
-                                         .where(CrystalState.status == CrystalStatus.USED)
-                                         .order_by(CrystalState.place.desc())
-                                         ).first()
-            if crystal_state is None:
-                return 0
-            return crystal_state.place + 1
+        return len(self.current_crystals)
 
     @property
     def current_crystals(self) -> list[Optional[str]]:
-        return self.crystals_at_timestamp(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-
-    def crystals_at_timestamp(self, timestamp) -> list[Optional[str]]:
-        crystals = []
-        n = self.crystal_quantity
-        for place in range(n):
-            with Session(engine) as session:
-                crystal_state = session.exec(select(CrystalState)
-                                             .where(CrystalState.assembly_name == self.name)
-                                             .where(CrystalState.place == place)
-                                             .where(CrystalState.timestamp <= timestamp)
-                                             .order_by(CrystalState.timestamp.desc())
-                                             ).first()
-                name = None
-                if crystal_state and (crystal_state.status == CrystalStatus.USED):
-                    crystal = session.exec(select(Crystal).where(Crystal.name == crystal_state.crystal_name)).first()
-                    if crystal:
-                        name = crystal.name
-                crystals.append(name)
-        return crystals
+        from server.rdtsserver.db.repository import current_assemblies_composition
+        with session_of(self) as session:
+            return current_assemblies_composition(session, [self.name])[self.name]
+
+    def crystals_at_timestamp(self, timestamp: datetime) -> list[Optional[str]]:
+        from server.rdtsserver.db.repository import resolve_assemblies_composition
+        with session_of(self) as session:
+            return resolve_assemblies_composition(session, [self.name], timestamp)[self.name]
 
 
 class AssemblyCreate(AssemblyBase):
@@ -100,6 +102,11 @@ class AssemblyCreate(AssemblyBase):
     timestamp: Optional[str] = None
 
 
+class AssemblyCreateResult(AssemblyBase):
+    name: str
+    status_code: int
+
+
 class AssemblyRead(AssemblyBase):
     # idx: int
     name: str
@@ -122,24 +129,17 @@ class Crystal(CrystalBase, table=True):
 
     @property
     def current_assembly(self) -> Optional[str]:
-        with Session(engine) as session:
-            query = session.query(CrystalState).filter(CrystalState.crystal_name == self.name)
-            query = query.order_by(CrystalState.timestamp.desc())
-            crystal_state = query.first()
-            if crystal_state and crystal_state.status == CrystalStatus.USED:
-                assembly = session.exec(
-                    select(Assembly).where(Assembly.name == crystal_state.assembly_name)).one_or_none()
-                if assembly:
-                    return assembly.name
+        with session_of(self) as session:
+            current_state = session.get(CurrentCrystalState, self.name)
+            if current_state and current_state.status == CrystalStatus.USED:
+                return current_state.assembly_name
             return None
 
     @property
     def current_status(self) -> Optional[CrystalStatus]:
-        with Session(engine) as session:
-            query = session.query(CrystalState).filter(CrystalState.crystal_name == self.name)
-            query = query.order_by(CrystalState.timestamp.desc())
-            crystal_state = query.first()
-            return crystal_state.status
+        with session_of(self) as session:
+            current_state = session.get(CurrentCrystalState, self.name)
+            return current_state.status if current_state else None
 
 
 class CrystalCreate(CrystalBase):
@@ -166,6 +166,8 @@ class CrystalStateBase(RDTSDatabase):
 
 class CrystalState(CrystalStateBase, table=True):
     __tablename__ = "crystals_states"
+    __table_args__ = (Index("ix_crystals_states_crystal_name_timestamp", "crystal_name", "timestamp", "idx"),
+                      Index("ix_crystals_states_assembly_place_timestamp", "assembly_name", "place", "timestamp", "idx"))
     idx: int = Field(None, primary_key=True, sa_column_kwargs={"autoincrement": True})
     crystal_name: str = Field(foreign_key="crystals.name")
     assembly_name: str = Field(None, foreign_key="assemblies.name", nullable=True)
@@ -189,6 +191,33 @@ class CrystalStateRead(CrystalStateBase):
     pass
 
 
+# ================= CurrentCrystalState =================
+class CurrentCrystalState(RDTSDatabase, table=True):
+    # Последнее состояние каждого кристалла, поддерживается вместе с историей crystals_states.
+    __tablename__ = "crystals_current_states"
+    __table_args__ = (Index("ix_crystals_current_states_assembly_place", "assembly_name", "place"),
+                      Index("ix_crystals_current_states_crystalstate_idx", "crystalstate_idx"))
+    crystal_name: str = Field(primary_key=True, foreign_key="crystals.name")
+    crystalstate_idx: int = Field(foreign_key="crystals_states.idx")
+    assembly_name: Optional[str] = Field(None, foreign_key="assemblies.name", nullable=True)
+    place: int
+    status: CrystalStatus
+    timestamp: datetime
+
+
+# ================= Blob =================
+class Blob(RDTSDatabase, table=True):
+    # Файл в хранилище с адресацией по содержимому, refcount - число ссылающихся строк.
+    __tablename__ = "blobs"
+    sha256: str = Field(primary_key=True)
+    size: int
+    refcount: int = Field(default=0)
+
+    @property
+    def path(self) -> str:
+        return blob_path(self.sha256)
+
+
 # ================= TestSuite =================
 
 class TestSuiteBase(RDTSDatabase):
@@ -198,21 +227,27 @@ class TestSuiteBase(RDTSDatabase):
 
 class TestSuite(TestSuiteBase, table=True):
     __tablename__ = "testsuites"
+    __table_args__ = (Index("ix_testsuites_name_version", "name", "version", unique=True),)
     idx: Optional[int] = Field(None, primary_key=True, sa_column_kwargs={"autoincrement": True})
     name: str = Field()
     version: str = Field()
     timestamp: datetime
+    sha256: Optional[str] = Field(default=None, nullable=True)
+    size: Optional[int] = Field(default=None, nullable=True)
+    blob: Optional[str] = Field(default=None, foreign_key="blobs.sha256", nullable=True)
 
     testsuiteresults: list["TestSuiteResult"] = Relationship(back_populates="testsuite")
 
     @property
     def versions(self) -> list[str]:
-        with Session(engine) as session:
+        with session_of(self) as session:
             testsuites = session.exec(select(TestSuite).where(TestSuite.name == self.name)).all()
             return [testsuite.name for testsuite in testsuites]
 
     @property
     def path(self) -> str:
+        if self.blob:
+            return blob_path(self.blob)
         return f"/testsuites/{self.name}_v{self.version.replace('.', '-')}.zip"
 
     @property
@@ -259,6 +294,8 @@ class TestSuiteResultBase(RDTSDatabase):
 
 class TestSuiteResult(TestSuiteResultBase, table=True):
     __tablename__ = "testsuiteresults"
+    __table_args__ = (Index("ix_testsuiteresults_timestamp", "timestamp"),
+                      Index("ix_testsuiteresults_testsuite_idx", "testsuite_idx"))
     idx: int = Field(None, primary_key=True, sa_column_kwargs={"autoincrement": True})
     # testsuite_name: str = Field(foreign_key="testsuites.name")
     # testsuite_version: str = Field(foreign_key="testsuites.version")
@@ -266,6 +303,11 @@ class TestSuiteResult(TestSuiteResultBase, table=True):
     # assembly_name: str = Field(foreign_key="assemblies.name")
     # crystal_name: str = Field(foreign_key="crystals.name")
     timestamp: datetime
+    result_sha256: Optional[str] = Field(default=None, nullable=True)
+    result_size: Optional[int] = Field(default=None, nullable=True)
+    config_sha256: Optional[str] = Field(default=None, nullable=True)
+    config_size: Optional[int] = Field(default=None, nullable=True)
+    config_blob: Optional[str] = Field(default=None, foreign_key="blobs.sha256", nullable=True)
 
     #    testsresults: list[TestResult] = Relationship(back_populates="testsuiteresult")
     testsuite: TestSuite = Relationship(back_populates="testsuiteresults")
@@ -283,6 +325,8 @@ class TestSuiteResult(TestSuiteResultBase, table=True):
 
     @property
     def config_path(self) -> str:
+        if self.config_blob:
+            return blob_path(self.config_blob)
         return f"{self.testsuite.results_path}/config-{str(self.testsuite_idx)}-{str(self.idx)}.json"
 
 
@@ -297,6 +341,58 @@ class TestSuiteResultInfo(TestSuiteResultBase):
     testsuite_name: str
 
 
+class TestSuiteResultBatchEntry(RDTSDatabase):
+    # Запись manifest.json пакетной загрузки: config и result - имена файлов внутри архива.
+    testsuite_idx: int
+    assembly_name: str
+    timestamp: Optional[str] = None
+    config: str
+    result: str
+
+
+class TestSuiteResultBatchRead(RDTSDatabase):
+    index: int
+    idx: Optional[int] = None
+    error: Optional[str] = None
+
+
+class ResultMetric(RDTSDatabase, table=True):
+    # Числовые метрики файла результата по кристаллам, извлекаются при загрузке результата.
+    __tablename__ = "result_metrics"
+    __table_args__ = (Index("ix_result_metrics_metric_timestamp", "metric", "timestamp"),
+                      Index("ix_result_metrics_crystal_metric_timestamp", "crystal_name", "metric", "timestamp"),
+                      Index("ix_result_metrics_testsuite_metric_timestamp", "testsuite_idx", "metric", "timestamp"))
+    testsuiteresult_idx: int = Field(primary_key=True, foreign_key="testsuiteresults.idx")
+    crystal_name: str = Field(primary_key=True)
+    metric: str = Field(primary_key=True)
+    testsuite_idx: int = Field(foreign_key="testsuites.idx")
+    timestamp: datetime
+    value: float
+
+
+class ResultMetricRead(RDTSDatabase):
+    testsuiteresult_idx: int
+    testsuite_idx: int
+    crystal_name: str
+    metric: str
+    timestamp: str
+    value: float
+
+
+class CrystalMetricStats(RDTSDatabase):
+    crystal_name: str
+    metric: str
+    count: int
+    mean: float
+    std: float
+    min: float
+    max: float
+    p5: float
+    p50: float
+    p95: float
+    slope_per_day: Optional[float]
+
+
 # Порядок сохранения результатов тестов (Клиент):
 # Запрос на обновление/создание сборки (+ получаем id)
 # Запрос на обновление/создание набора тестов (+ получаем id)
@@ -316,6 +412,7 @@ class UserRegister(RDTSDatabase):
 
 class User(RDTSDatabase, table=True):
     __tablename__ = "users"
+    __table_args__ = (Index("ix_users_login", "login", unique=True),)
     idx: int = Field(None, primary_key=True, sa_column_kwargs={"autoincrement": True})
     login: str = Field()
     hashed_password: str = Field()
@@ -330,6 +427,43 @@ class Role(RDTSDatabase, table=True):
     name: RoleName = Field()
 
 
+class ChangeCounter(RDTSDatabase, table=True):
+    # Счетчик изменений, по которому процессы сервера сбрасывают свои кэши.
+    __tablename__ = "change_counters"
+    name: str = Field(primary_key=True)
+    version: int = Field(default=0)
+
+
+# ================= IngestionJob =================
+class IngestionJob(RDTSDatabase, table=True):
+    # Отложенная загрузка результата: файлы лежат в staging_path, пока обработчик их не разместит.
+    __tablename__ = "ingestion_jobs"
+    __table_args__ = (Index("ix_ingestion_jobs_status", "status"),)
+    idx: str = Field(primary_key=True)
+    status: IngestionStatus
+    testsuite_idx: int
+    assembly_name: str
+    timestamp: datetime
+    created: datetime
+    started: Optional[datetime] = Field(default=None, nullable=True)
+    finished: Optional[datetime] = Field(default=None, nullable=True)
+    testsuiteresult_idx: Optional[int] = Field(default=None, nullable=True)
+    error: Optional[str] = Field(default=None, nullable=True)
+
+
+class IngestionJobRead(RDTSDatabase):
+    idx: str
+    status: IngestionStatus
+    testsuite_idx: int
+    assembly_name: str
+    timestamp: str
+    created: str
+    started: Optional[str]
+    finished: Optional[str]
+    testsuiteresult_idx: Optional[int]
+    error: Optional[str]
+
+
 class Token(RDTSDatabase):
     access_token: str
     refresh_token: str
@@ -2,21 +2,29 @@ from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Depends
-from dotenv import load_dotenv
+from fastapi.responses import PlainTextResponse
 
-from server.rdtsserver.db.tables import RDTSDatabase
-from server.rdtsserver.dependencies import engine, get_session
+from server.rdtsserver.dependencies import async_engine, get_session
+from server.rdtsserver.utils.executor import cpu_executor
+from server.rdtsserver.utils.metrics import MetricsMiddleware, registry, CONTENT_TYPE
+from server.rdtsserver.utils.querystats import QueryStatsMiddleware
 from server.rdtsserver.routers import assemblies, crystals, crystalstates, testsuites, testsuiteresults
+from server.rdtsserver.routers.testsuiteresults import ingestion_queue
 from server.rdtsserver.versions.v1.v1_0_1 import app_1_0_1
 from server.rdtsserver.versions.v1.v1_0_2 import app_1_0_2
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
-    RDTSDatabase.metadata.create_all(engine)
+    ingestion_queue.start()
     yield
+    ingestion_queue.stop()
+    cpu_executor.shutdown()
+    await async_engine.dispose()
 
 main_app = FastAPI(title="RDTS Server", lifespan=lifespan)
+main_app.add_middleware(QueryStatsMiddleware)
+main_app.add_middleware(MetricsMiddleware)
 
 ACTUAL_API_VERSION = "/v1.0.2"
 
@@ -34,4 +42,17 @@ def health() -> str:
     return "Server is running!"
 
 
-load_dotenv('server/rdtsserver/config.env')
+@main_app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+@main_app.get("/executor")
+def executor_stats() -> dict[str, int]:
+    return cpu_executor.stats()
+
+
+@main_app.get("/ingestion")
+def ingestion_stats() -> dict[str, int]:
+    return ingestion_queue.stats()
+
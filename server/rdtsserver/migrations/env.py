@@ -0,0 +1,35 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from server.rdtsserver.db.tables import RDTSDatabase
+from server.rdtsserver.dependencies import engine
+
+if context.config.config_file_name is not None:
+    fileConfig(context.config.config_file_name)
+
+target_metadata = RDTSDatabase.metadata
+
+
+def run_migrations_offline():
+    context.configure(url=engine.url.render_as_string(hide_password=False),
+                      target_metadata=target_metadata,
+                      literal_binds=True,
+                      dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        context.configure(connection=connection,
+                          target_metadata=target_metadata,
+                          render_as_batch=connection.dialect.name == "sqlite")
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,121 @@
+"""current states blobs and change counters
+
+Current-state table of crystals (filled from the history), content-addressed blob store,
+change counters for cache invalidation and stored hashes and sizes of uploaded files.
+Tables and columns a pre-migration server already created are kept.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 15:21:15
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Серверы до появления миграций создавали новые таблицы через metadata.create_all,
+    # но не добавляли столбцы в существующие: создается только то, чего в базе еще нет
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+
+    def create_table(name, *elements):
+        if name not in existing:
+            op.create_table(name, *elements)
+
+    def add_columns(table, columns, foreign_key):
+        present = {column['name'] for column in inspector.get_columns(table)}
+        missing = [column for column in columns if column.name not in present]
+        if not missing:
+            return
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in missing:
+                batch_op.add_column(column)
+            name, referent, local_cols, remote_cols = foreign_key
+            if local_cols[0] not in present:
+                batch_op.create_foreign_key(name, referent, local_cols, remote_cols)
+
+    create_table('blobs',
+    sa.Column('sha256', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    create_table('change_counters',
+    sa.Column('name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    create_table('crystals_current_states',
+    sa.Column('crystal_name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('crystalstate_idx', sa.Integer(), nullable=False),
+    sa.Column('assembly_name', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('place', sa.Integer(), nullable=False),
+    sa.Column('status', postgresql.ENUM('USED', 'UNUSED', 'DESTROYED', name='crystalstatus', create_type=False),
+              nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['assembly_name'], ['assemblies.name'], ),
+    sa.ForeignKeyConstraint(['crystal_name'], ['crystals.name'], ),
+    sa.ForeignKeyConstraint(['crystalstate_idx'], ['crystals_states.idx'], ),
+    sa.PrimaryKeyConstraint('crystal_name')
+    )
+    indexes = {index['name'] for index in inspector.get_indexes('crystals_current_states')}
+    if 'ix_crystals_current_states_assembly_place' not in indexes:
+        with op.batch_alter_table('crystals_current_states', schema=None) as batch_op:
+            batch_op.create_index('ix_crystals_current_states_assembly_place', ['assembly_name', 'place'], unique=False)
+
+    add_columns('testsuiteresults',
+                [sa.Column('result_sha256', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+                 sa.Column('result_size', sa.Integer(), nullable=True),
+                 sa.Column('config_sha256', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+                 sa.Column('config_size', sa.Integer(), nullable=True),
+                 sa.Column('config_blob', sqlmodel.sql.sqltypes.AutoString(), nullable=True)],
+                ('fk_testsuiteresults_config_blob_blobs', 'blobs', ['config_blob'], ['sha256']))
+    add_columns('testsuites',
+                [sa.Column('sha256', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+                 sa.Column('size', sa.Integer(), nullable=True),
+                 sa.Column('blob', sqlmodel.sql.sqltypes.AutoString(), nullable=True)],
+                ('fk_testsuites_blob_blobs', 'blobs', ['blob'], ['sha256']))
+
+    op.execute("""
+        INSERT INTO crystals_current_states (crystal_name, crystalstate_idx, assembly_name, place, status, timestamp)
+        SELECT crystal_name, idx, assembly_name, place, status, timestamp
+        FROM (SELECT crystals_states.*,
+                     row_number() OVER (PARTITION BY crystal_name ORDER BY timestamp DESC, idx DESC) AS rank
+              FROM crystals_states) AS latest
+        WHERE rank = 1
+          AND NOT EXISTS (SELECT 1 FROM crystals_current_states
+                          WHERE crystals_current_states.crystal_name = latest.crystal_name)
+    """)
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('testsuites', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_testsuites_blob_blobs', type_='foreignkey')
+        batch_op.drop_column('blob')
+        batch_op.drop_column('size')
+        batch_op.drop_column('sha256')
+
+    with op.batch_alter_table('testsuiteresults', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_testsuiteresults_config_blob_blobs', type_='foreignkey')
+        batch_op.drop_column('config_blob')
+        batch_op.drop_column('config_size')
+        batch_op.drop_column('config_sha256')
+        batch_op.drop_column('result_size')
+        batch_op.drop_column('result_sha256')
+
+    with op.batch_alter_table('crystals_current_states', schema=None) as batch_op:
+        batch_op.drop_index('ix_crystals_current_states_assembly_place')
+
+    op.drop_table('crystals_current_states')
+    op.drop_table('change_counters')
+    op.drop_table('blobs')
+    # ### end Alembic commands ###
@@ -0,0 +1,67 @@
+"""hot path indexes
+
+Composite indexes for the temporal lookups of crystal states, result period scans,
+test suite and user lookups and both directions of the state/result link table.
+On PostgreSQL they are built CONCURRENTLY, so a running server keeps writing. The unique
+indexes are only built when the existing rows have no duplicates; an invalid index left by
+an interrupted build is dropped and built again.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 15:21:46
+"""
+from alembic import op
+from alembic.util import CommandError
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_crystals_states_crystal_name_timestamp', 'crystals_states', ['crystal_name', 'timestamp', 'idx'], False),
+    ('ix_crystals_states_assembly_place_timestamp', 'crystals_states',
+     ['assembly_name', 'place', 'timestamp', 'idx'], False),
+    ('ix_crystals_current_states_crystalstate_idx', 'crystals_current_states', ['crystalstate_idx'], False),
+    ('ix_crystalstate_testsuiteresult_result_state', 'crystalstate_testsuiteresult_table',
+     ['testsuiteresult_idx', 'crystalstate_idx'], False),
+    ('ix_crystalstate_testsuiteresult_state', 'crystalstate_testsuiteresult_table', ['crystalstate_idx'], False),
+    ('ix_testsuiteresults_timestamp', 'testsuiteresults', ['timestamp'], False),
+    ('ix_testsuiteresults_testsuite_idx', 'testsuiteresults', ['testsuite_idx'], False),
+    ('ix_testsuites_name_version', 'testsuites', ['name', 'version'], True),
+    ('ix_users_login', 'users', ['login'], True),
+]
+
+
+def upgrade():
+    bind = op.get_bind()
+    for name, table, columns, unique in INDEXES:
+        if unique:
+            check_unique(bind, name, table, columns)
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            # Прерванный CREATE INDEX CONCURRENTLY оставляет индекс INVALID, который не используется
+            # и мешает повторному созданию
+            if bind.dialect.name == 'postgresql' and bind.execute(
+                    sa.text('SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+                            'WHERE pg_class.relname = :name AND NOT pg_index.indisvalid'), {'name': name}).first():
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True)
+
+
+def check_unique(bind, name, table, columns):
+    """Stops the migration before building a unique index that existing duplicate rows would make fail."""
+    keys = ', '.join(columns)
+    duplicates = bind.execute(sa.text(f'SELECT {keys}, count(*) FROM {table} GROUP BY {keys} HAVING count(*) > 1')).all()
+    if duplicates:
+        listed = '; '.join(f"{tuple(row[:-1])}: {row[-1]} rows" for row in duplicates[:10])
+        raise CommandError(f"Cannot create unique index {name}: {table} has {len(duplicates)} duplicate "
+                           f"({keys}) values ({listed}). Remove the duplicates and run upgrade again.")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
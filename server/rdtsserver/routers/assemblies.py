@@ -1,43 +1,50 @@
+import json
 from datetime import datetime
 from typing import Optional, Annotated
 
-from fastapi import Response, status, APIRouter, HTTPException, Depends
-from sqlalchemy import func
+from fastapi import Response, Request, status, APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, delete, insert
 from sqlmodel import Session, select
-from server.rdtsserver.db.tables import Assembly, AssemblyCreate, AssemblyRead, \
-    CrystalCreate, Period, CrystalState, CrystalStatus
-from server.rdtsserver.dependencies import engine
-from server.rdtsserver.routers.crystals import create_crystal
-from server.rdtsserver.utils.security import validate_access_token
+from server.rdtsserver.db.tables import Assembly, AssemblyCreate, AssemblyCreateResult, AssemblyRead, \
+    Period, Crystal, CrystalState, CrystalStatus, CurrentCrystalState
+from server.rdtsserver.db.repository import current_assemblies_composition, refresh_current_crystal_states, \
+    pull_out_displaced_crystals, pull_out_placed_crystals
+from server.rdtsserver.dependencies import SessionDep, AsyncSessionDep
+from server.rdtsserver.utils.executor import cpu_executor
+from server.rdtsserver.utils.pagination import read_page
+from server.rdtsserver.utils.responsecache import cached_response, invalidate_responses, ASSEMBLIES, CRYSTALS
+from server.rdtsserver.utils.security import validate_access_token, validate_access_token_async
 from server.rdtsserver.utils.validator import validate_string, validate_AssemblyCreate
 
 router = APIRouter()
 
 
 @router.post("", status_code=207, response_model=str)
-def handle_create_assembly(user_login: Annotated[str, Depends(validate_access_token)], assembly: AssemblyCreate, response: Response):
+def handle_create_assembly(user_login: Annotated[str, Depends(validate_access_token)], assembly: AssemblyCreate, response: Response, session: SessionDep):
     assembly = validate_AssemblyCreate(assembly=assembly)
-    db_assembly, response.status_code = create_assembly(assembly)
+    db_assembly, response.status_code = create_assembly(session, assembly)
     return db_assembly.name
 
 
+@router.post("/bulk", status_code=207, response_model=list[AssemblyCreateResult])
+async def handle_create_assemblies(user_login: Annotated[str, Depends(validate_access_token)], request: Request, session: SessionDep):
+    body = await request.body()
+    assemblies = await cpu_executor.run(parse_assemblies, body, request.headers.get("content-type", ""))
+    return await run_in_threadpool(create_assemblies_in_transaction, session, assemblies)
+
+
 @router.get("/{name}", response_model=Optional[AssemblyRead])
-def handle_read_assembly(user_login: Annotated[str, Depends(validate_access_token)], name: str):
+async def handle_read_assembly(user_login: Annotated[str, Depends(validate_access_token_async)], name: str, session: AsyncSessionDep):
     name = validate_string(value=name, object_error="Assembly name")
-    with Session(engine) as session:
-        assembly = session.exec(select(Assembly).where(Assembly.name == name)).one_or_none()
-        if assembly is None:
-            raise HTTPException(status_code=400, detail=f"Assembly {name} not found!")
-        return AssemblyRead(
-            name=assembly.name,
-            crystal_quantity=assembly.crystal_quantity,
-            current_crystals=assembly.current_crystals,
-            timestamp=assembly.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        )
+    assembly = (await session.exec(select(Assembly).where(Assembly.name == name))).one_or_none()
+    if assembly is None:
+        raise HTTPException(status_code=400, detail=f"Assembly {name} not found!")
+    return (await session.run_sync(read_assemblies, [assembly]))[0]
 
 
 @router.delete("/{name}/{timestamp}")
-def handle_delete_assembly(user_login: Annotated[str, Depends(validate_access_token)], name: str, timestamp: str):
+def handle_delete_assembly(user_login: Annotated[str, Depends(validate_access_token)], name: str, timestamp: str, session: SessionDep):
     name = validate_string(value=name, object_error="Assembly name")
     timestamp = datetime.strptime(timestamp, '%Y-%m-%d%H:%M:%S').replace(microsecond=0)
     #with Session(engine) as session:
@@ -46,103 +53,159 @@ def handle_delete_assembly(user_login: Annotated[str, Depends(validate_access_to
         #if assembly is None:
         #    raise HTTPException(status_code=400, detail=f"Assembly with name {name} not found!")
 
-    delete_crystal_states(name, timestamp)
+    delete_crystal_states(session, name, timestamp)
         #session.delete(assembly)
         #session.commit()
 
 
 @router.get("", response_model=list[AssemblyRead])
-def handle_read_all_assemblies(user_login: Annotated[str, Depends(validate_access_token)]):
-    with Session(engine) as session:
-        assemblies = session.exec(select(Assembly)).all()
-        assemblies_read = []
-        for assembly in assemblies:
-            assemblies_read.append(AssemblyRead(
-                name=assembly.name,
-                crystal_quantity=assembly.crystal_quantity,
-                current_crystals=assembly.current_crystals,
-                timestamp=assembly.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            ))
-        return assemblies_read
+def handle_read_all_assemblies(user_login: Annotated[str, Depends(validate_access_token)],
+                               session: SessionDep,
+                               request: Request,
+                               response: Response,
+                               limit: Optional[int] = None,
+                               after: Optional[str] = None,
+                               stream: bool = False):
+    return cached_response(request, response, ASSEMBLIES, lambda: read_page(
+        session, select(Assembly), [Assembly.name], lambda assembly: [assembly.name],
+        read_assemblies, response, limit, after, stream))
 
 
 @router.get("/{start_date}/{end_date}", response_model=list[AssemblyRead])
-def handle_read_all_assemblies_during_the_time(user_login: Annotated[str, Depends(validate_access_token)], start_date: str, end_date: str):
-    with Session(engine) as session:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d").replace(microsecond=0)
-        end_date = datetime.strptime(end_date, "%Y-%m-%d").replace(microsecond=0)
-        results = session.query(
-            CrystalState.assembly_name,
-            CrystalState.timestamp,
-            func.array_agg(CrystalState.crystal_name)
-        ).where(
-            CrystalState.timestamp.between(start_date, end_date)
-        ).group_by(CrystalState.assembly_name, CrystalState.timestamp).all()
-        assemblies_read = []
-        for assembly_name, timestamp, crystal_names in results:
-            print(f"Assembly read: {assembly_name, timestamp, crystal_names}")
-            if assembly_name is not None:
-                assemblies_read.append(AssemblyRead(
-                    name=assembly_name,
-                    crystal_quantity=len(crystal_names),
-                    current_crystals=crystal_names,
-                    timestamp=timestamp.strftime("%Y-%m-%d %H:%M:%S")
-                ))
-        return assemblies_read
-
-
-def create_assembly(assembly: AssemblyCreate) -> (Assembly, status):
-    with Session(engine) as session:
-        status_code = status.HTTP_207_MULTI_STATUS
-        db_assembly = session.exec(select(Assembly).where(Assembly.name == assembly.name).where(Assembly.timestamp == datetime.strptime(assembly.timestamp, '%Y-%m-%d %H:%M:%S').replace(microsecond=0))).one_or_none()
-        if db_assembly:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Assembly with name {assembly.name} and time {assembly.timestamp} already exists!")
+def handle_read_all_assemblies_during_the_time(user_login: Annotated[str, Depends(validate_access_token)],
+                                               start_date: str,
+                                               end_date: str,
+                                               session: SessionDep,
+                                               request: Request,
+                                               response: Response,
+                                               limit: Optional[int] = None,
+                                               after: Optional[str] = None,
+                                               stream: bool = False):
+    start_date = datetime.strptime(start_date, "%Y-%m-%d").replace(microsecond=0)
+    end_date = datetime.strptime(end_date, "%Y-%m-%d").replace(microsecond=0)
+    statement = select(
+        CrystalState.assembly_name,
+        CrystalState.timestamp,
+        func.array_agg(CrystalState.crystal_name)
+    ).where(
+        CrystalState.timestamp.between(start_date, end_date)
+    ).where(
+        CrystalState.assembly_name.is_not(None)
+    ).group_by(CrystalState.assembly_name, CrystalState.timestamp)
+    return cached_response(request, response, ASSEMBLIES, lambda: read_page(
+        session, statement, [CrystalState.assembly_name, CrystalState.timestamp], lambda row: row[:2],
+        read_assembly_periods, response, limit, after, stream))
+
+
+def read_assemblies(session: Session, assemblies: list[Assembly]) -> list[AssemblyRead]:
+    compositions = current_assemblies_composition(session, [assembly.name for assembly in assemblies])
+    return [AssemblyRead(
+        name=assembly.name,
+        crystal_quantity=len(compositions[assembly.name]),
+        current_crystals=compositions[assembly.name],
+        timestamp=assembly.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    ) for assembly in assemblies]
+
+
+def read_assembly_periods(session: Session, rows) -> list[AssemblyRead]:
+    return [AssemblyRead(
+        name=assembly_name,
+        crystal_quantity=len(crystal_names),
+        current_crystals=crystal_names,
+        timestamp=timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    ) for assembly_name, timestamp, crystal_names in rows]
+
+
+def create_assembly(session: Session, assembly: AssemblyCreate) -> (Assembly, status):
+    [(db_assembly, status_code)] = create_assemblies(session, [assembly])
+    session.commit()
+    session.refresh(db_assembly)
+    return db_assembly, status_code
+
 
-        if assembly.timestamp is None:
-            timestamp = datetime.now().replace(microsecond=0)
+def parse_assemblies(body: bytes, content_type: str) -> list[AssemblyCreate]:
+    try:
+        if content_type.startswith("application/x-ndjson"):
+            payloads = [json.loads(line) for line in body.splitlines() if line.strip()]
         else:
-            timestamp = datetime.strptime(assembly.timestamp, '%Y-%m-%d %H:%M:%S').replace(microsecond=0)
+            payloads = json.loads(body)
+            if isinstance(payloads, dict):
+                payloads = [payloads]
+        return [validate_AssemblyCreate(assembly=AssemblyCreate.model_validate(payload)) for payload in payloads]
+    except (ValueError, TypeError) as error:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(error))
+
+
+def create_assemblies_in_transaction(session: Session, assemblies: list[AssemblyCreate]) -> list[AssemblyCreateResult]:
+    results = [AssemblyCreateResult(name=db_assembly.name, status_code=status_code)
+               for db_assembly, status_code in create_assemblies(session, assemblies)]
+    session.commit()
+    return results
+
+
+def create_assemblies(session: Session, assemblies: list[AssemblyCreate]) -> list[tuple[Assembly, int]]:
+    timestamps = [parse_assembly_timestamp(assembly) for assembly in assemblies]
+    names = {assembly.name for assembly in assemblies}
+    db_assemblies = {db_assembly.name: db_assembly
+                     for db_assembly in session.exec(select(Assembly).where(Assembly.name.in_(names))).all()}
+    for assembly, timestamp in zip(assemblies, timestamps):
+        db_assembly = db_assemblies.get(assembly.name)
+        if db_assembly and db_assembly.timestamp == timestamp:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Assembly with name {assembly.name} and time {assembly.timestamp} already exists!")
 
-        db_assembly = session.exec(select(Assembly).where(Assembly.name == assembly.name)).one_or_none()
+    crystal_names = {crystal_name for assembly in assemblies for crystal_name in assembly.crystals if crystal_name}
+    existing_crystals = set(session.exec(select(Crystal.name).where(Crystal.name.in_(crystal_names))).all())
+    new_crystals = [{"name": crystal_name} for crystal_name in sorted(crystal_names - existing_crystals)]
+    if new_crystals:
+        session.execute(insert(Crystal), new_crystals)
+
+    results = []
+    touched_crystals = set(crystal_names)
+    for assembly, timestamp in zip(assemblies, timestamps):
+        status_code = status.HTTP_207_MULTI_STATUS
+        db_assembly = db_assemblies.get(assembly.name)
         if db_assembly is None:
             status_code = status.HTTP_201_CREATED
             db_assembly = Assembly(name=assembly.name, timestamp=timestamp)
-            #db_assembly = Assembly.from_orm(assembly)
             session.add(db_assembly)
-            session.commit()
-            session.refresh(db_assembly)
-        crystals: [str] = assembly.crystals
-
-        for place, crystal_name in enumerate(crystals):
-            if crystal_name:
-                db_crystal, crystal_status_code = create_crystal(CrystalCreate(
-                    name=crystal_name,
-                    assembly_name=assembly.name,
-                    place=place),
-                timestamp
-                )
-
-                #pull_out_this_crystal_from_some_assembly(crystal_name, CrystalStatus.UNUSED)
-                #pull_out_some_crystal_from_this_assembly(crystal_name, db_assembly.name, place, CrystalStatus.UNUSED)
-
-                #create_crystal_state(CrystalStateCreate(
-                #    timestamp=str(timestamp),
-                #    crystal_name=db_crystal.name,
-                #    assembly_name=db_assembly.name,
-                #    place=place,
-                #    status=CrystalStatus.USED)
-                #)
-
-    return db_assembly, status_code
-
-
-def delete_crystal_states(name: str, timestamp: datetime):
-    with Session(engine) as session:
-        crystal_states = session.exec(select(CrystalState)
-                                      .where(CrystalState.assembly_name == name)
-                                      .where(CrystalState.timestamp == timestamp)).all()
-
-        for crystal_state in crystal_states:
-            session.delete(crystal_state)
-        session.commit()
+            session.flush()
+            db_assemblies[assembly.name] = db_assembly
+
+        placements = [(place, crystal_name) for place, crystal_name in enumerate(assembly.crystals) if crystal_name]
+        touched_crystals.update(pull_out_displaced_crystals(session, assembly.name, placements, CrystalStatus.UNUSED))
+        touched_crystals.update(pull_out_placed_crystals(session, [crystal_name for _, crystal_name in placements],
+                                                         CrystalStatus.UNUSED))
+        if placements:
+            session.execute(insert(CrystalState), [{"crystal_name": crystal_name,
+                                                    "assembly_name": assembly.name,
+                                                    "timestamp": timestamp,
+                                                    "place": place,
+                                                    "status": CrystalStatus.USED}
+                                                   for place, crystal_name in placements])
+        results.append((db_assembly, status_code))
+
+    refresh_current_crystal_states(session, sorted(touched_crystals))
+    invalidate_responses(session, ASSEMBLIES, CRYSTALS)
+    return results
+
+
+def parse_assembly_timestamp(assembly: AssemblyCreate) -> datetime:
+    if assembly.timestamp is None:
+        return datetime.now().replace(microsecond=0)
+    return datetime.strptime(assembly.timestamp, '%Y-%m-%d %H:%M:%S').replace(microsecond=0)
+
+
+def delete_crystal_states(session: Session, name: str, timestamp: datetime):
+    crystal_states = session.exec(select(CrystalState)
+                                  .where(CrystalState.assembly_name == name)
+                                  .where(CrystalState.timestamp == timestamp)).all()
+
+    crystal_names = list({crystal_state.crystal_name for crystal_state in crystal_states})
+    session.exec(delete(CurrentCrystalState).where(CurrentCrystalState.crystal_name.in_(crystal_names)))
+    for crystal_state in crystal_states:
+        session.delete(crystal_state)
+    session.flush()
+    refresh_current_crystal_states(session, crystal_names)
+    invalidate_responses(session, ASSEMBLIES, CRYSTALS)
+    session.commit()
 
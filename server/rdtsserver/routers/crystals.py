@@ -1,5 +1,5 @@
 from datetime import datetime
-from fastapi import APIRouter, status, HTTPException, Depends
+from fastapi import APIRouter, Request, status, HTTPException, Depends
 
 from ..routers.crystalstates import create_crystal_state
 from sqlalchemy.orm import Session
@@ -9,18 +9,22 @@ from fastapi import Response
 from sqlmodel import Session, select
 from server.rdtsserver.db.tables import CrystalCreate, Crystal, CrystalRead, CrystalStateCreate, CrystalStatus, CrystalState
 
+from server.rdtsserver.db.repository import sync_crystal_state_status, read_crystals, crystals_read_query, \
+    to_crystal_reads
+from server.rdtsserver.utils.pagination import read_page
+from server.rdtsserver.utils.responsecache import cached_response, invalidate_responses, ASSEMBLIES, CRYSTALS
 from server.rdtsserver.utils.validator import validate_CrystalCreate, validate_string
 
-from server.rdtsserver.dependencies import engine
-from ..utils.security import validate_access_token
+from server.rdtsserver.dependencies import SessionDep, AsyncSessionDep
+from ..utils.security import validate_access_token, validate_access_token_async
 
 router = APIRouter()
 
 
 @router.post("", response_model=str)
-def handle_create_crystal(user_login: Annotated[str, Depends(validate_access_token)], crystal: CrystalCreate, response: Response) -> str:
+def handle_create_crystal(user_login: Annotated[str, Depends(validate_access_token)], crystal: CrystalCreate, response: Response, session: SessionDep) -> str:
     crystal = validate_CrystalCreate(crystal)
-    db_crystal, response.status_code = create_crystal(crystal)
+    db_crystal, response.status_code = create_crystal(session, crystal)
     #if response.status_code == status.HTTP_207_MULTI_STATUS:
     #    pull_out_this_crystal_from_some_assembly(crystal.name, CrystalStatus.UNUSED)
     #    pull_out_some_crystal_from_this_assembly(crystal.assembly_name, crystal.place, CrystalStatus.UNUSED)
@@ -38,71 +42,78 @@ def handle_create_crystal(user_login: Annotated[str, Depends(validate_access_tok
 
 
 @router.get("/{name}", response_model=Optional[CrystalRead])
-def handle_read_crystal(user_login: Annotated[str, Depends(validate_access_token)], name: str) -> Crystal:
+async def handle_read_crystal(user_login: Annotated[str, Depends(validate_access_token_async)], name: str, session: AsyncSessionDep) -> CrystalRead:
     name = validate_string(value=name, object_error="Crystal name")
-    with Session(engine) as session:
-        crystal = session.exec(select(Crystal).where(Crystal.name == name)).one_or_none()
-        if crystal is None:
-            raise HTTPException(status_code=400, detail=f"Crystal {name} not found!")
-        return crystal
+    crystals = await session.run_sync(read_crystals, Crystal.name == name)
+    if not crystals:
+        raise HTTPException(status_code=400, detail=f"Crystal {name} not found!")
+    return crystals[0]
 
 
 @router.get("", response_model=list[CrystalRead])
-def handle_read_all_crystals(user_login: Annotated[str, Depends(validate_access_token)]):
-    with Session(engine) as session:
-        return session.exec(select(Crystal)).all()
-
-
-def create_crystal(crystal: CrystalCreate, timestamp: datetime) -> (Crystal, status):
-    with Session(engine) as session:
-        pull_out_some_crystal_from_this_assembly(crystal.name, crystal.assembly_name, crystal.place, CrystalStatus.UNUSED)
-
-        existing_crystal = session.exec(select(Crystal).where(Crystal.name == crystal.name)).one_or_none()
-        if existing_crystal:
-            pull_out_this_crystal_from_some_assembly(crystal.name, CrystalStatus.UNUSED)
-            db_crystal = existing_crystal
-            status_code = status.HTTP_207_MULTI_STATUS
-        else:
-            db_crystal = Crystal.from_orm(crystal)
-            session.add(db_crystal)
-            session.commit()
-            session.refresh(db_crystal)
-            status_code = status.HTTP_201_CREATED
-
-        #pull_out_some_crystal_from_this_assembly(crystal.assembly_name, crystal.place, CrystalStatus.UNUSED)
-
-        #db_crystal = Crystal.from_orm(crystal)
-        #session.add(db_crystal)
-        #session.commit()
-        #session.refresh(db_crystal)
-        create_crystal_state(CrystalStateCreate(
-                                                crystal_name=crystal.name,
-                                                assembly_name=crystal.assembly_name,
-                                                timestamp=timestamp,
-                                                place=crystal.place,
-                                                status=CrystalStatus.USED)
-                                                )
-        return db_crystal, status_code
-
-
-def pull_out_this_crystal_from_some_assembly(crystal_name, new_status):
-    with (Session(engine) as session):
-        crystal_state = session.exec(select(CrystalState)
-                                     .where(CrystalState.crystal_name == crystal_name)
-                                     .where(CrystalState.status == CrystalStatus.USED)
-                                     ).one_or_none()
-        if crystal_state:
-            crystal_state.status = new_status
-            session.commit()
-
-
-def pull_out_some_crystal_from_this_assembly(crystal_name, assembly_name, place, new_status):
-    with Session(engine) as session:
-        crystal_state = session.exec(select(CrystalState)
-                                     .where(CrystalState.assembly_name == assembly_name)
-                                     .where(CrystalState.place == place)
-                                     .order_by(CrystalState.timestamp.desc())).first()
-
-        if crystal_state and crystal_state.crystal_name != crystal_name:
-            crystal_state.status = new_status
-            session.commit()
+def handle_read_all_crystals(user_login: Annotated[str, Depends(validate_access_token)],
+                             session: SessionDep,
+                             request: Request,
+                             response: Response,
+                             limit: Optional[int] = None,
+                             after: Optional[str] = None,
+                             stream: bool = False):
+    return cached_response(request, response, CRYSTALS, lambda: read_page(
+        session, crystals_read_query(), [Crystal.name], lambda row: [row[0]],
+        lambda session, rows: to_crystal_reads(rows), response, limit, after, stream))
+
+
+def create_crystal(session: Session, crystal: CrystalCreate, timestamp: Optional[datetime] = None) -> (Crystal, status):
+    if timestamp is None:
+        timestamp = datetime.now().replace(microsecond=0)
+    pull_out_some_crystal_from_this_assembly(session, crystal.name, crystal.assembly_name, crystal.place, CrystalStatus.UNUSED)
+
+    existing_crystal = session.exec(select(Crystal).where(Crystal.name == crystal.name)).one_or_none()
+    if existing_crystal:
+        pull_out_this_crystal_from_some_assembly(session, crystal.name, CrystalStatus.UNUSED)
+        db_crystal = existing_crystal
+        status_code = status.HTTP_207_MULTI_STATUS
+    else:
+        db_crystal = Crystal.from_orm(crystal)
+        session.add(db_crystal)
+        session.flush()
+        status_code = status.HTTP_201_CREATED
+
+    #pull_out_some_crystal_from_this_assembly(crystal.assembly_name, crystal.place, CrystalStatus.UNUSED)
+
+    #db_crystal = Crystal.from_orm(crystal)
+    #session.add(db_crystal)
+    #session.commit()
+    #session.refresh(db_crystal)
+    create_crystal_state(session, CrystalStateCreate(
+                                            crystal_name=crystal.name,
+                                            assembly_name=crystal.assembly_name,
+                                            timestamp=timestamp,
+                                            place=crystal.place,
+                                            status=CrystalStatus.USED)
+                                            )
+    invalidate_responses(session, ASSEMBLIES, CRYSTALS)
+    session.commit()
+    session.refresh(db_crystal)
+    return db_crystal, status_code
+
+
+def pull_out_this_crystal_from_some_assembly(session: Session, crystal_name, new_status):
+    crystal_state = session.exec(select(CrystalState)
+                                 .where(CrystalState.crystal_name == crystal_name)
+                                 .where(CrystalState.status == CrystalStatus.USED)
+                                 ).one_or_none()
+    if crystal_state:
+        crystal_state.status = new_status
+        sync_crystal_state_status(session, crystal_state)
+
+
+def pull_out_some_crystal_from_this_assembly(session: Session, crystal_name, assembly_name, place, new_status):
+    crystal_state = session.exec(select(CrystalState)
+                                 .where(CrystalState.assembly_name == assembly_name)
+                                 .where(CrystalState.place == place)
+                                 .order_by(CrystalState.timestamp.desc())).first()
+
+    if crystal_state and crystal_state.crystal_name != crystal_name:
+        crystal_state.status = new_status
+        sync_crystal_state_status(session, crystal_state)
@@ -3,7 +3,7 @@ from typing import Optional
 from fastapi import status, APIRouter
 from sqlmodel import Session, select
 from server.rdtsserver.db.tables import CrystalStateCreate, CrystalState, CrystalStateRead
-from server.rdtsserver.dependencies import engine
+from server.rdtsserver.db.repository import apply_crystal_state
 
 router = APIRouter()
 
@@ -26,10 +26,9 @@ router = APIRouter()
 #        return session.exec(select(CrystalState)).all()
 
 
-def create_crystal_state(crystal_state: CrystalStateCreate) -> (CrystalState, status):
-    with Session(engine) as session:
-        db_crystal_state = CrystalState.from_orm(crystal_state)
-        session.add(db_crystal_state)
-        session.commit()
-        session.refresh(db_crystal_state)
-        return db_crystal_state, status.HTTP_201_CREATED
+def create_crystal_state(session: Session, crystal_state: CrystalStateCreate) -> (CrystalState, status):
+    db_crystal_state = CrystalState.from_orm(crystal_state)
+    session.add(db_crystal_state)
+    session.flush()
+    apply_crystal_state(session, db_crystal_state)
+    return db_crystal_state, status.HTTP_201_CREATED
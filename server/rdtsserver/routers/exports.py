@@ -0,0 +1,35 @@
+from datetime import datetime
+from typing import Optional, Annotated
+
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+
+from server.rdtsserver.utils.export import EXPORT_TABLES, MEDIA_TYPES, EXTENSIONS, PARQUET, export_statement, \
+    iter_export
+from server.rdtsserver.utils.security import validate_access_token
+from server.rdtsserver.utils.validator import validate_positive_number
+
+router = APIRouter()
+
+
+@router.get("/{table}")
+def handle_export_table(user_login: Annotated[str, Depends(validate_access_token)],
+                        table: str,
+                        export_format: Annotated[str, Query(alias="format")] = PARQUET,
+                        testsuite_idx: Optional[int] = None,
+                        start_date: Optional[str] = None,
+                        end_date: Optional[str] = None):
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"Export table {table} not found!")
+    if export_format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Export format {export_format} is not supported!")
+    if testsuite_idx is not None:
+        validate_positive_number(testsuite_idx, "Test suite id")
+    start = datetime.strptime(start_date, "%Y-%m-%d") if start_date is not None else None
+    end = datetime.strptime(end_date, "%Y-%m-%d") if end_date is not None else None
+
+    statement = export_statement(table, testsuite_idx, start, end)
+    return StreamingResponse(iter_export(table, export_format, statement),
+                             media_type=MEDIA_TYPES[export_format],
+                             headers={"Content-Disposition":
+                                      f'attachment; filename="{table}.{EXTENSIONS[export_format]}"'})
@@ -1,19 +1,39 @@
+import json
 import os
 import shutil
+import tarfile
 from datetime import datetime
 from typing import Optional, Annotated
-from fastapi import Response, status, APIRouter, UploadFile, HTTPException, Depends
-from sqlalchemy import select, and_, func
+from fastapi import Request, Response, status, APIRouter, UploadFile, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import delete, update, bindparam
 from sqlmodel import Session, select
-from starlette.responses import FileResponse
 
-from server.rdtsserver.db.tables import (TestSuiteResult, TestSuiteResultInfo, TestSuiteResultCreate, CrystalState)
-from server.rdtsserver.dependencies import engine
-from server.rdtsserver.utils.security import validate_access_token
+from server.rdtsserver.db.tables import (TestSuite, TestSuiteResult, TestSuiteResultInfo, TestSuiteResultCreate, CrystalState,
+                                         IngestionJob, IngestionJobRead, CrystalMetricStats, ResultMetric,
+                                         ResultMetricRead, TestSuiteResultBatchEntry, TestSuiteResultBatchRead)
+from server.rdtsserver.db.repository import read_testsuiteresult_infos, testsuiteresult_infos_query, \
+    to_testsuiteresult_infos, current_crystal_states_of_assembly, result_metric_values, result_metrics_in_assembly, \
+    to_result_metric_reads, testsuiteresults_with_crystal_state, current_crystal_states_of_assemblies, \
+    insert_testsuiteresults
+from server.rdtsserver.dependencies import SessionDep, AsyncSessionDep
+from server.rdtsserver.utils.pagination import read_page
+from server.rdtsserver.utils.security import validate_access_token, validate_access_token_async
+from server.rdtsserver.utils.blobs import store_blob, store_blobs, release_blob, track_new_file
+from server.rdtsserver.utils.archive import iter_archive, MEDIA_TYPES, EXTENSIONS, TAR
+from server.rdtsserver.utils.analytics import crystal_metric_stats, index_result_metrics, result_metric_rows, \
+    insert_result_metrics
+from server.rdtsserver.utils.downloads import stored_file_response
+from server.rdtsserver.utils.executor import cpu_executor
+from server.rdtsserver.utils.ingestion import IngestionQueue, read_job
+from server.rdtsserver.utils.storage import save_upload, remove_stored, results_compression_enabled
 from server.rdtsserver.utils.validator import validate_positive_number, validate_string
 
 router = APIRouter()
 
+BATCH_MANIFEST = "manifest.json"
+
 
 @router.post("", status_code=207, response_model=int)
 def handle_create_testsuiteresult(user_login: Annotated[str, Depends(validate_access_token)],
@@ -22,10 +42,12 @@ def handle_create_testsuiteresult(user_login: Annotated[str, Depends(validate_ac
                                   config: UploadFile,
                                   result: UploadFile,
                                   response: Response,
+                                  session: SessionDep,
                                   timestamp: Optional[str] = None):
     validate_positive_number(testsuite_idx, "Test suite id")
     assembly_name = validate_string(assembly_name, "Assembly name")
-    db_testsuiteresult, response.status_code = create_testsuiteresult(testsuite_idx,
+    db_testsuiteresult, response.status_code = create_testsuiteresult(session,
+                                                                      testsuite_idx,
                                                                       assembly_name,
                                                                       config,
                                                                       result,
@@ -34,146 +56,393 @@ def handle_create_testsuiteresult(user_login: Annotated[str, Depends(validate_ac
     return db_testsuiteresult.idx
 
 
+@router.post("/batch", status_code=207, response_model=list[TestSuiteResultBatchRead])
+def handle_create_testsuiteresults_batch(user_login: Annotated[str, Depends(validate_access_token)],
+                                         bundle: UploadFile,
+                                         response: Response,
+                                         session: SessionDep):
+    results = create_testsuiteresults_batch(session, bundle)
+    if all(result.error is None for result in results):
+        response.status_code = status.HTTP_201_CREATED
+    return results
+
+
+@router.post("/jobs", status_code=202, response_model=IngestionJobRead)
+def handle_submit_testsuiteresult(user_login: Annotated[str, Depends(validate_access_token)],
+                                  testsuite_idx: int,
+                                  assembly_name: str,
+                                  config: UploadFile,
+                                  result: UploadFile,
+                                  session: SessionDep,
+                                  timestamp: Optional[str] = None):
+    validate_positive_number(testsuite_idx, "Test suite id")
+    assembly_name = validate_string(assembly_name, "Assembly name")
+    job = ingestion_queue.submit(session, testsuite_idx, assembly_name, config, result, parse_result_timestamp(timestamp))
+    return read_job(job)
+
+
+@router.get("/jobs/{job_idx}", response_model=IngestionJobRead)
+def handle_read_ingestion_job(user_login: Annotated[str, Depends(validate_access_token)], job_idx: str, session: SessionDep):
+    job = session.get(IngestionJob, job_idx)
+    if job is None:
+        raise HTTPException(status_code=400, detail=f"Ingestion job {job_idx} not found!")
+    return read_job(job)
+
+
+@router.get("/analytics", response_model=list[CrystalMetricStats])
+async def handle_read_testsuiteresult_analytics(user_login: Annotated[str, Depends(validate_access_token_async)],
+                                                session: AsyncSessionDep,
+                                                metric: Annotated[list[str], Query()],
+                                                testsuite_idx: Optional[int] = None,
+                                                start_date: Optional[str] = None,
+                                                end_date: Optional[str] = None,
+                                                assembly_name: Optional[str] = None,
+                                                crystal_name: Optional[str] = None):
+    criteria = result_metric_criteria(testsuite_idx, start_date, end_date, assembly_name, crystal_name)
+    if not criteria:
+        raise HTTPException(status_code=400, detail="Test suite, period, assembly or crystal is required!")
+    rows = await session.run_sync(result_metric_values, ResultMetric.metric.in_(metric), *criteria)
+    return await cpu_executor.run(crystal_metric_stats, rows)
+
+
+@router.get("/metrics", response_model=list[ResultMetricRead])
+def handle_read_result_metrics(user_login: Annotated[str, Depends(validate_access_token)],
+                               session: SessionDep,
+                               response: Response,
+                               metric: Annotated[list[str], Query()],
+                               below: Optional[float] = None,
+                               above: Optional[float] = None,
+                               testsuite_idx: Optional[int] = None,
+                               start_date: Optional[str] = None,
+                               end_date: Optional[str] = None,
+                               assembly_name: Optional[str] = None,
+                               crystal_name: Optional[str] = None,
+                               limit: Optional[int] = None,
+                               after: Optional[str] = None,
+                               stream: bool = False):
+    criteria = [ResultMetric.metric.in_(metric),
+                *result_metric_criteria(testsuite_idx, start_date, end_date, assembly_name, crystal_name)]
+    if below is not None:
+        criteria.append(ResultMetric.value < below)
+    if above is not None:
+        criteria.append(ResultMetric.value > above)
+    key_columns = [ResultMetric.testsuiteresult_idx, ResultMetric.crystal_name, ResultMetric.metric]
+    return read_page(session, select(ResultMetric).where(*criteria), key_columns,
+                     lambda result_metric: [result_metric.testsuiteresult_idx, result_metric.crystal_name,
+                                            result_metric.metric],
+                     lambda session, result_metrics: to_result_metric_reads(result_metrics),
+                     response, limit, after, stream)
+
+
+@router.get("/archive")
+def handle_read_testsuiteresults_archive(user_login: Annotated[str, Depends(validate_access_token)],
+                                         archive_format: Annotated[str, Query(alias="format")] = TAR,
+                                         testsuite_idx: Optional[int] = None,
+                                         start_date: Optional[str] = None,
+                                         end_date: Optional[str] = None,
+                                         assembly_name: Optional[str] = None,
+                                         crystal_name: Optional[str] = None):
+    if archive_format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Archive format {archive_format} is not supported!")
+    criteria = []
+    if testsuite_idx is not None:
+        validate_positive_number(testsuite_idx, "Test suite id")
+        criteria.append(TestSuiteResult.testsuite_idx == testsuite_idx)
+    if start_date is not None:
+        criteria.append(TestSuiteResult.timestamp >= datetime.strptime(start_date, "%Y-%m-%d"))
+    if end_date is not None:
+        criteria.append(TestSuiteResult.timestamp <= datetime.strptime(end_date, "%Y-%m-%d"))
+    if assembly_name is not None:
+        assembly_name = validate_string(assembly_name, "Assembly name")
+        criteria.append(testsuiteresults_with_crystal_state(CrystalState.assembly_name == assembly_name))
+    if crystal_name is not None:
+        crystal_name = validate_string(crystal_name, "Crystal name")
+        criteria.append(testsuiteresults_with_crystal_state(CrystalState.crystal_name == crystal_name))
+    if not criteria:
+        raise HTTPException(status_code=400, detail="Test suite, period, assembly or crystal is required!")
+
+    statement = (select(TestSuiteResult, TestSuite)
+                 .join(TestSuite, TestSuite.idx == TestSuiteResult.testsuite_idx)
+                 .where(*criteria)
+                 .order_by(TestSuiteResult.idx))
+    filename = f"results-{datetime.now().strftime('%Y%m%d%H%M%S')}.{EXTENSIONS[archive_format]}"
+    return StreamingResponse(iter_archive(statement, archive_format),
+                             media_type=MEDIA_TYPES[archive_format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @router.get("/{idx}", response_model=Optional[TestSuiteResultInfo])
-def handle_read_testsuiteresult(user_login: Annotated[str, Depends(validate_access_token)], idx: int):
+async def handle_read_testsuiteresult(user_login: Annotated[str, Depends(validate_access_token_async)], idx: int, session: AsyncSessionDep):
     validate_positive_number(idx, "Test suite results id")
-    with Session(engine) as session:
-        tsr = session.exec(select(TestSuiteResult).where(TestSuiteResult.idx == idx)).one_or_none()
-        if tsr is None:
-            raise HTTPException(status_code=400, detail=f"Test suite result with id {idx} not found!")
-        tsr_info = TestSuiteResultInfo(
-            idx=tsr.idx,
-            assembly_name=tsr.crystal_states[0].assembly_name,
-            timestamp=tsr.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            testsuite_idx=tsr.testsuite_idx,
-            testsuite_name=tsr.testsuite.name
-        )
-        return tsr_info
+    tsr_info = await session.run_sync(read_testsuiteresult_infos, TestSuiteResult.idx == idx)
+    if not tsr_info:
+        raise HTTPException(status_code=400, detail=f"Test suite result with id {idx} not found!")
+    return tsr_info[0]
 
 
 @router.delete("/{idx}")
-def handle_delete_testsuiteresult(user_login: Annotated[str, Depends(validate_access_token)], idx: int):
+def handle_delete_testsuiteresult(user_login: Annotated[str, Depends(validate_access_token)], idx: int, session: SessionDep):
     validate_positive_number(idx, "Test suite results id")
-    with Session(engine) as session:
-        tsr = session.exec(select(TestSuiteResult).where(TestSuiteResult.idx == idx)).one_or_none()
-        if tsr is None:
-            raise HTTPException(status_code=400, detail=f"Test suite result with id {idx} not found!")
+    tsr = session.exec(select(TestSuiteResult).where(TestSuiteResult.idx == idx)).one_or_none()
+    if tsr is None:
+        raise HTTPException(status_code=400, detail=f"Test suite result with id {idx} not found!")
 
-        if os.path.exists(tsr.result_path):
-            os.remove(tsr.result_path)
-            #shutil.rmtree(tsr.result_path)
-        if os.path.exists(tsr.config_path):
-            os.remove(tsr.config_path)
-            #shutil.rmtree(tsr.config_path)
-        session.delete(tsr)
-        session.commit()
+    remove_stored(tsr.result_path)
+    if tsr.config_blob:
+        release_blob(session, tsr.config_blob)
+    else:
+        remove_stored(tsr.config_path)
+    session.exec(delete(ResultMetric).where(ResultMetric.testsuiteresult_idx == tsr.idx))
+    session.delete(tsr)
+    session.commit()
 
 
 @router.get("/{idx}/config")
-def handle_read_testsuiteresult_config(user_login: Annotated[str, Depends(validate_access_token)], idx: int):
+def handle_read_testsuiteresult_config(user_login: Annotated[str, Depends(validate_access_token)], idx: int, request: Request, session: SessionDep):
     validate_positive_number(idx, "Test suite results id")
-    with Session(engine) as session:
-        db_testsuiteresult = session.exec(select(TestSuiteResult).where(TestSuiteResult.idx == idx)).one_or_none()
-        if db_testsuiteresult is None:
-            raise HTTPException(status_code=400, detail=f"Test suite result with id {idx} not found!")
-        return FileResponse(path=db_testsuiteresult.config_path,
-                            filename=f"config-{db_testsuiteresult.idx}-{db_testsuiteresult.timestamp}",
-                            media_type='application/json')
+    db_testsuiteresult = session.exec(select(TestSuiteResult).where(TestSuiteResult.idx == idx)).one_or_none()
+    if db_testsuiteresult is None:
+        raise HTTPException(status_code=400, detail=f"Test suite result with id {idx} not found!")
+    return stored_file_response(request,
+                                db_testsuiteresult.config_path,
+                                filename=f"config-{db_testsuiteresult.idx}-{db_testsuiteresult.timestamp}",
+                                media_type='application/json',
+                                sha256=db_testsuiteresult.config_sha256,
+                                size=db_testsuiteresult.config_size,
+                                last_modified=db_testsuiteresult.timestamp)
 
 
 @router.get("{idx}/result")
-def handle_read_testsuiteresult_result(user_login: Annotated[str, Depends(validate_access_token)], idx: int):
+def handle_read_testsuiteresult_result(user_login: Annotated[str, Depends(validate_access_token)], idx: int, request: Request, session: SessionDep):
     validate_positive_number(idx, "Test suite results id")
-    with Session(engine) as session:
-        db_testsuiteresult = session.exec(select(TestSuiteResult).where(TestSuiteResult.idx == idx)).one_or_none()
-        if db_testsuiteresult is None:
-            raise HTTPException(status_code=400, detail=f"Test suite result with id {idx} not found!")
+    db_testsuiteresult = session.exec(select(TestSuiteResult).where(TestSuiteResult.idx == idx)).one_or_none()
+    if db_testsuiteresult is None:
+        raise HTTPException(status_code=400, detail=f"Test suite result with id {idx} not found!")
 
-        return FileResponse(path=db_testsuiteresult.result_path,
-                            filename=f"{db_testsuiteresult.idx}-{db_testsuiteresult.timestamp}",
-                            media_type='application/json')
+    return stored_file_response(request,
+                                db_testsuiteresult.result_path,
+                                filename=f"{db_testsuiteresult.idx}-{db_testsuiteresult.timestamp}",
+                                media_type='application/json',
+                                sha256=db_testsuiteresult.result_sha256,
+                                size=db_testsuiteresult.result_size,
+                                last_modified=db_testsuiteresult.timestamp)
 
 
 @router.get("", response_model=list[TestSuiteResultInfo])
-def handle_read_all_testsuiteresults(user_login: Annotated[str, Depends(validate_access_token)]):
-    with Session(engine) as session:
-        testsuiteresults = session.exec(select(TestSuiteResult)).all()
-        tsr_info = []
-        for tsr in testsuiteresults:
-            tsr_info.append(
-                TestSuiteResultInfo(
-                    idx=tsr.idx,
-                    assembly_name=tsr.crystal_states[0].assembly_name,
-                    timestamp=tsr.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                    testsuite_idx=tsr.testsuite_idx,
-                    testsuite_name=tsr.testsuite.name
-                )
-            )
-        #    tsr.timestamp = str(tsr.timestamp)
-        return tsr_info
+def handle_read_all_testsuiteresults(user_login: Annotated[str, Depends(validate_access_token)],
+                                     session: SessionDep,
+                                     response: Response,
+                                     limit: Optional[int] = None,
+                                     after: Optional[str] = None,
+                                     stream: bool = False):
+    return read_page(session, testsuiteresult_infos_query(), [TestSuiteResult.idx], lambda row: [row[0]],
+                     lambda session, rows: to_testsuiteresult_infos(rows), response, limit, after, stream)
 
 
 @router.get("/{start_date}/{end_date}", response_model=list[TestSuiteResultInfo])
-def handle_read_all_testsuiteresults_during_the_time(user_login: Annotated[str, Depends(validate_access_token)], start_date: str, end_date: str):
-    with Session(engine) as session:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d").replace(microsecond=0)
-        end_date = datetime.strptime(end_date, "%Y-%m-%d").replace(microsecond=0)
-        testsuiteresults = session.exec(select(TestSuiteResult).where(TestSuiteResult.timestamp.between(start_date, end_date)))
-        tsr_info = []
-        for tsr in testsuiteresults:
-            tsr_info.append(
-                TestSuiteResultInfo(
-                    idx=tsr.idx,
-                    assembly_name=tsr.crystal_states[0].assembly_name,
-                    timestamp=tsr.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                    testsuite_idx=tsr.testsuite_idx,
-                    testsuite_name=tsr.testsuite.name
-                )
-            )
-        #    tsr.timestamp = str(tsr.timestamp)
-        return tsr_info
-
-
-def save_bytes_to_file(file_path, content: bytes):
-    with open(file_path, "wb") as file:
-        file.write(content)
-
-
-def create_testsuiteresult(testsuite_idx: int,
+def handle_read_all_testsuiteresults_during_the_time(user_login: Annotated[str, Depends(validate_access_token)],
+                                                     start_date: str,
+                                                     end_date: str,
+                                                     session: SessionDep,
+                                                     response: Response,
+                                                     limit: Optional[int] = None,
+                                                     after: Optional[str] = None,
+                                                     stream: bool = False):
+    start_date = datetime.strptime(start_date, "%Y-%m-%d").replace(microsecond=0)
+    end_date = datetime.strptime(end_date, "%Y-%m-%d").replace(microsecond=0)
+    return read_page(session, testsuiteresult_infos_query().where(TestSuiteResult.timestamp.between(start_date, end_date)),
+                     [TestSuiteResult.idx], lambda row: [row[0]],
+                     lambda session, rows: to_testsuiteresult_infos(rows), response, limit, after, stream)
+
+
+def create_testsuiteresult(session: Session,
+                           testsuite_idx: int,
                            assembly_name: str,
                            config: UploadFile,
                            result: UploadFile,
                            timestamp: str) -> (TestSuiteResult, status):
-    with (Session(engine) as session):
-        subquery = (session.query(
-            CrystalState.crystal_name,
-            func.max(CrystalState.timestamp).label('max_time')
-        ).group_by(CrystalState.crystal_name).subquery())
-
-        query = (
-            session.query(CrystalState)
-            .join(subquery, and_(CrystalState.crystal_name == subquery.c.crystal_name,
-                                 CrystalState.timestamp == subquery.c.max_time,
-                                 CrystalState.assembly_name == assembly_name))
-        )
-
-        crystals = query.all()
-
-        if not crystals:
-            raise HTTPException(status_code=400, detail=f"Crystals in assembly {assembly_name} not found!")
-
-        if timestamp is None:
-            db_timestamp = datetime.now().replace(microsecond=0)
-        else:
-            db_timestamp = datetime.strptime(timestamp, '%Y-%m-%d%H:%M:%S').replace(microsecond=0)
-
-        db_testsuiteresult = TestSuiteResult(testsuite_idx=testsuite_idx,
-                                             crystal_states=crystals,
-                                             timestamp=db_timestamp
-                                             )
-        session.add(db_testsuiteresult)
-        session.commit()
-        session.refresh(db_testsuiteresult)
-        save_bytes_to_file(db_testsuiteresult.result_path, result.file.read())
-        save_bytes_to_file(db_testsuiteresult.config_path, config.file.read())
-        return db_testsuiteresult, status.HTTP_201_CREATED
+    db_testsuiteresult = add_testsuiteresult(session, testsuite_idx, assembly_name, config, result, timestamp)
+    session.commit()
+    session.refresh(db_testsuiteresult)
+    return db_testsuiteresult, status.HTTP_201_CREATED
+
+
+def add_testsuiteresult(session: Session,
+                        testsuite_idx: int,
+                        assembly_name: str,
+                        config: UploadFile,
+                        result: UploadFile,
+                        timestamp: str) -> TestSuiteResult:
+    """Inserts a result with its files and metrics into the session's transaction without committing it."""
+    crystals = current_crystal_states_of_assembly(session, assembly_name)
+
+    if not crystals:
+        raise HTTPException(status_code=400, detail=f"Crystals in assembly {assembly_name} not found!")
+
+    db_testsuiteresult, = insert_testsuiteresults(session, [(testsuite_idx, parse_result_timestamp(timestamp), crystals)])
+    store_testsuiteresult_files(session, db_testsuiteresult, config, result)
+    index_result_metrics(session, db_testsuiteresult, [crystal.crystal_name for crystal in crystals])
+    return db_testsuiteresult
+
+
+def store_testsuiteresult_files(session: Session, db_testsuiteresult: TestSuiteResult, config: UploadFile, result: UploadFile):
+    """Stores the result file and the config blob of an inserted result; both are removed unless the transaction commits."""
+    compress = results_compression_enabled()
+    track_new_file(session, db_testsuiteresult.result_path)
+    db_testsuiteresult.result_sha256, db_testsuiteresult.result_size = save_upload(result, db_testsuiteresult.result_path, compress)
+    db_testsuiteresult.config_sha256, db_testsuiteresult.config_size = store_blob(session, config, compress)
+    db_testsuiteresult.config_blob = db_testsuiteresult.config_sha256
+
+
+def create_testsuiteresults_batch(session: Session, bundle: UploadFile) -> list[TestSuiteResultBatchRead]:
+    """Creates the results described by manifest.json of a tar bundle in one transaction.
+
+    Entries that are invalid or refer to a missing test suite, assembly or bundle file get an
+    error and are skipped; crystal states are resolved once for all assemblies of the bundle
+    and the files are copied from the archive to storage chunk by chunk. Results, config blobs,
+    file hashes and metrics are written with a fixed number of statements per bundle; result
+    and new blob files are removed again if the transaction fails.
+    """
+    try:
+        archive = tarfile.open(fileobj=bundle.file, mode="r:*")
+    except tarfile.TarError:
+        raise HTTPException(status_code=400, detail="Bundle must be a tar archive!")
+    with archive:
+        manifest = read_batch_manifest(archive)
+        results = [TestSuiteResultBatchRead(index=index) for index in range(len(manifest))]
+        entries = []
+        for index, raw_entry in enumerate(manifest):
+            try:
+                entry = TestSuiteResultBatchEntry.model_validate(raw_entry)
+                validate_positive_number(entry.testsuite_idx, "Test suite id")
+                entry.assembly_name = validate_string(entry.assembly_name, "Assembly name")
+                entries.append((index, entry, parse_result_timestamp(entry.timestamp),
+                                batch_member(archive, entry.config), batch_member(archive, entry.result)))
+            except HTTPException as exception:
+                results[index].error = str(exception.detail)
+            except ValidationError as exception:
+                results[index].error = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                                                 for error in exception.errors())
+            except ValueError as exception:
+                results[index].error = str(exception)
+
+        testsuite_idxs = set(session.exec(select(TestSuite.idx)
+                                          .where(TestSuite.idx.in_({entry.testsuite_idx for _, entry, *_ in entries}))))
+        crystals = current_crystal_states_of_assemblies(session, list({entry.assembly_name for _, entry, *_ in entries}))
+        valid = []
+        for index, entry, timestamp, config, result in entries:
+            if entry.testsuite_idx not in testsuite_idxs:
+                results[index].error = f"Test suite with id {entry.testsuite_idx} not found!"
+            elif not crystals[entry.assembly_name]:
+                results[index].error = f"Crystals in assembly {entry.assembly_name} not found!"
+            else:
+                valid.append((index, entry, timestamp, config, result))
+
+        if not valid:
+            return results
+
+        stored = []
+        try:
+            db_testsuiteresults = insert_testsuiteresults(session,
+                                                          [(entry.testsuite_idx, timestamp, crystals[entry.assembly_name])
+                                                           for _, entry, timestamp, _, _ in valid])
+            compress = results_compression_enabled()
+            result_hashes = []
+            for db_testsuiteresult, (_, _, _, _, result) in zip(db_testsuiteresults, valid):
+                stored.append(db_testsuiteresult.result_path)
+                result_hashes.append(save_upload(UploadFile(file=archive.extractfile(result)),
+                                                 db_testsuiteresult.result_path, compress))
+            config_hashes = store_blobs(session, [UploadFile(file=archive.extractfile(config))
+                                                  for _, _, _, config, _ in valid], compress)
+            testsuiteresults = TestSuiteResult.__table__
+            session.execute(update(testsuiteresults)
+                            .where(testsuiteresults.c.idx == bindparam("b_idx"))
+                            .values(result_sha256=bindparam("b_result_sha256"),
+                                    result_size=bindparam("b_result_size"),
+                                    config_sha256=bindparam("b_config_sha256"),
+                                    config_size=bindparam("b_config_size"),
+                                    config_blob=bindparam("b_config_sha256")),
+                            [{"b_idx": db_testsuiteresult.idx,
+                              "b_result_sha256": result_sha256, "b_result_size": result_size,
+                              "b_config_sha256": config_sha256, "b_config_size": config_size}
+                             for db_testsuiteresult, (result_sha256, result_size), (config_sha256, config_size)
+                             in zip(db_testsuiteresults, result_hashes, config_hashes)])
+            metric_rows = []
+            for db_testsuiteresult, (index, entry, *_) in zip(db_testsuiteresults, valid):
+                metric_rows += result_metric_rows(db_testsuiteresult,
+                                                  [crystal.crystal_name for crystal in crystals[entry.assembly_name]])
+                results[index].idx = db_testsuiteresult.idx
+            insert_result_metrics(session, metric_rows)
+            session.commit()
+        except BaseException:
+            session.rollback()
+            for file_path in stored:
+                remove_stored(file_path)
+            raise
+    return results
+
+
+def read_batch_manifest(archive: tarfile.TarFile) -> list:
+    try:
+        with archive.extractfile(batch_member(archive, BATCH_MANIFEST)) as file:
+            manifest = json.load(file)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Bundle {BATCH_MANIFEST} is not valid JSON!")
+    if not isinstance(manifest, list):
+        raise HTTPException(status_code=400, detail=f"Bundle {BATCH_MANIFEST} must be a list of results!")
+    max_entries = int(os.getenv("RESULTS_BATCH_MAX_ENTRIES", 500))
+    if len(manifest) > max_entries:
+        raise HTTPException(status_code=400, detail=f"Bundle must not contain more than {max_entries} results!")
+    return manifest
+
+
+def batch_member(archive: tarfile.TarFile, name: str) -> tarfile.TarInfo:
+    try:
+        member = archive.getmember(name)
+    except KeyError:
+        member = None
+    if member is None or not member.isfile():
+        raise HTTPException(status_code=400, detail=f"File {name} not found in bundle!")
+    return member
+
+
+def result_metric_criteria(testsuite_idx: Optional[int],
+                           start_date: Optional[str],
+                           end_date: Optional[str],
+                           assembly_name: Optional[str],
+                           crystal_name: Optional[str]) -> list:
+    criteria = []
+    if testsuite_idx is not None:
+        validate_positive_number(testsuite_idx, "Test suite id")
+        criteria.append(ResultMetric.testsuite_idx == testsuite_idx)
+    if start_date is not None:
+        criteria.append(ResultMetric.timestamp >= datetime.strptime(start_date, "%Y-%m-%d"))
+    if end_date is not None:
+        criteria.append(ResultMetric.timestamp <= datetime.strptime(end_date, "%Y-%m-%d"))
+    if assembly_name is not None:
+        criteria.append(result_metrics_in_assembly(validate_string(assembly_name, "Assembly name")))
+    if crystal_name is not None:
+        criteria.append(ResultMetric.crystal_name == validate_string(crystal_name, "Crystal name"))
+    return criteria
+
+
+def parse_result_timestamp(timestamp: Optional[str]) -> datetime:
+    if timestamp is None:
+        return datetime.now().replace(microsecond=0)
+    return datetime.strptime(timestamp, '%Y-%m-%d%H:%M:%S').replace(microsecond=0)
+
+
+def add_testsuiteresult_of_job(session: Session, job: IngestionJob, config: UploadFile, result: UploadFile) -> int:
+    db_testsuiteresult = add_testsuiteresult(session,
+                                             job.testsuite_idx,
+                                             job.assembly_name,
+                                             config,
+                                             result,
+                                             job.timestamp.strftime('%Y-%m-%d%H:%M:%S'))
+    return db_testsuiteresult.idx
+
+
+ingestion_queue = IngestionQueue(add_testsuiteresult_of_job,
+                                 workers=int(os.getenv("INGESTION_WORKERS", 2)),
+                                 max_pending=int(os.getenv("INGESTION_MAX_PENDING", 100)),
+                                 lease=float(os.getenv("INGESTION_LEASE_SECONDS", 600)))
@@ -1,15 +1,19 @@
 import os
 from datetime import datetime
 from typing import Optional, Annotated
-from fastapi import Response, status, APIRouter, UploadFile, HTTPException, Depends
-from fastapi.responses import FileResponse
-from sqlalchemy import select
+from fastapi import Request, Response, status, APIRouter, UploadFile, HTTPException, Depends
+from sqlalchemy import select, delete
 from sqlmodel import Session, select
-from server.rdtsserver.db.tables import TestSuite
-from server.rdtsserver.dependencies import engine, ROLE_ENGINEER, ROLE_ADMIN
+from server.rdtsserver.db.tables import TestSuite, ResultMetric
+from server.rdtsserver.dependencies import ROLE_ENGINEER, ROLE_ADMIN, SessionDep, AsyncSessionDep
 
 from server.rdtsserver.db.tables import TestSuiteRead
-from server.rdtsserver.utils.security import validate_access_token, check_role
+from server.rdtsserver.utils.pagination import read_page
+from server.rdtsserver.utils.responsecache import cached_response, invalidate_responses, TESTSUITES
+from server.rdtsserver.utils.security import validate_access_token, validate_access_token_async, check_role
+from server.rdtsserver.utils.blobs import store_blob, release_blob
+from server.rdtsserver.utils.downloads import stored_file_response
+from server.rdtsserver.utils.storage import remove_stored
 
 from server.rdtsserver.utils.validator import validate_string
 
@@ -24,146 +28,158 @@ def handle_create_testsuite(user_login: Annotated[str, Depends(validate_access_t
                             version: str,
                             zip_file: UploadFile,
                             response: Response,
+                            session: SessionDep,
                             timestamp: Optional[str] = None):
-    check_role(user_login, [ROLE_ADMIN, ROLE_ENGINEER])
+    check_role(session, user_login, [ROLE_ADMIN, ROLE_ENGINEER])
     name = validate_string(name, "Test suite name")
     version = validate_string(version, "Test suite version")
-    db_testsuite, response.status_code = create_testsuite(name, version, zip_file, timestamp)
+    db_testsuite, response.status_code = create_testsuite(session, name, version, zip_file, timestamp)
     return db_testsuite.idx
 
 
 @router.get("/{name}", response_model=Optional[TestSuiteRead])
-def handle_read_testsuite(user_login: Annotated[str, Depends(validate_access_token)], name: str):
+async def handle_read_testsuite(user_login: Annotated[str, Depends(validate_access_token_async)], name: str, session: AsyncSessionDep):
     name = validate_string(value=name, object_error="Testsuite name")
-    with (Session(engine) as session):
-        testsuite = session.exec(select(TestSuite)
-                                 .where(TestSuite.name == name)
-                                 .order_by(TestSuite.version.desc())).first()
-        if testsuite is None:
-            raise HTTPException(status_code=400, detail=f"Test suite {name} not found!")
-        return TestSuiteRead(
-            idx=testsuite.idx,
-            name=testsuite.name,
-            version=testsuite.version,
-            timestamp=testsuite.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        )
+    testsuite = (await session.exec(select(TestSuite)
+                             .where(TestSuite.name == name)
+                             .order_by(TestSuite.version.desc()))).first()
+    if testsuite is None:
+        raise HTTPException(status_code=400, detail=f"Test suite {name} not found!")
+    return TestSuiteRead(
+        idx=testsuite.idx,
+        name=testsuite.name,
+        version=testsuite.version,
+        timestamp=testsuite.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    )
 
 
 @router.delete("/{name}/{version}")
-def handle_delete_testsuite(user_login: Annotated[str, Depends(validate_access_token)], name: str, version: str):
+def handle_delete_testsuite(user_login: Annotated[str, Depends(validate_access_token)], name: str, version: str, session: SessionDep):
     name = validate_string(value=name, object_error="Testsuite name")
-    with Session(engine) as session:
-        testsuite: TestSuite = session.exec(select(TestSuite)
-                                 .where(TestSuite.name == name)
-                                 .where(TestSuite.version == version)).one_or_none()
-
-        if testsuite is None:
-            raise HTTPException(status_code=400, detail=f"Test suite {name} not found!")
-
-        testsuites_other = session.exec(select(TestSuite)
-                                 .where(TestSuite.name == name)
-                                 .where(TestSuite.version != version)).all()
-
-        if len(testsuites_other) == 0:
-            for testsuiteresult in testsuite.testsuiteresults:
-                if os.path.exists(testsuiteresult.result_path):
-                    os.remove(testsuiteresult.result_path)
-                    #shutil.rmtree(testsuiteresult.result_path)
-                if os.path.exists(testsuiteresult.config_path):
-                    os.remove(testsuiteresult.config_path)
-                    #shutil.rmtree(testsuiteresult.config_path)
-                session.delete(testsuiteresult)
-                session.commit()
-
-            if os.path.exists(testsuite.path):
-                os.remove(testsuite.path)
-                #shutil.rmtree(testsuite.path)
-            if os.path.exists(testsuite.results_path):
-                #os.remove(testsuite.results_path)
-                shutil.rmtree(testsuite.results_path)
-
-        session.delete(testsuite)
-        session.commit()
+    testsuite: TestSuite = session.exec(select(TestSuite)
+                             .where(TestSuite.name == name)
+                             .where(TestSuite.version == version)).one_or_none()
+
+    if testsuite is None:
+        raise HTTPException(status_code=400, detail=f"Test suite {name} not found!")
+
+    testsuites_other = session.exec(select(TestSuite)
+                             .where(TestSuite.name == name)
+                             .where(TestSuite.version != version)).all()
+
+    if len(testsuites_other) == 0:
+        session.exec(delete(ResultMetric).where(ResultMetric.testsuite_idx == testsuite.idx))
+        for testsuiteresult in testsuite.testsuiteresults:
+            remove_stored(testsuiteresult.result_path)
+            if testsuiteresult.config_blob:
+                release_blob(session, testsuiteresult.config_blob)
+            else:
+                remove_stored(testsuiteresult.config_path)
+            session.delete(testsuiteresult)
+            session.commit()
+
+        if not testsuite.blob and os.path.exists(testsuite.path):
+            os.remove(testsuite.path)
+            #shutil.rmtree(testsuite.path)
+        if os.path.exists(testsuite.results_path):
+            #os.remove(testsuite.results_path)
+            shutil.rmtree(testsuite.results_path)
+
+    if testsuite.blob:
+        release_blob(session, testsuite.blob)
+    invalidate_responses(session, TESTSUITES)
+    session.delete(testsuite)
+    session.commit()
 
 
 @router.get("/download/{name}")
-def handle_download_testsuite(user_login: Annotated[str, Depends(validate_access_token)], name: str):
+def handle_download_testsuite(user_login: Annotated[str, Depends(validate_access_token)], name: str, request: Request, session: SessionDep):
     name = validate_string(value=name, object_error="Testsuite name")
-    with (Session(engine) as session):
-        testsuite: TestSuite = session.exec(select(TestSuite)
-                                            .where(TestSuite.name == name)
-                                            .order_by(TestSuite.version.desc())).first()
-        if testsuite:
-            timestamp = testsuite.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            return FileResponse(path=testsuite.path, filename=f"{testsuite.name}", media_type='application/zip')
-
-        raise HTTPException(status_code=400, detail=f"Test suite {name} not found!")
+    testsuite: TestSuite = session.exec(select(TestSuite)
+                                        .where(TestSuite.name == name)
+                                        .order_by(TestSuite.version.desc())).first()
+    if testsuite:
+        timestamp = testsuite.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        return stored_file_response(request,
+                                    testsuite.path,
+                                    filename=f"{testsuite.name}",
+                                    media_type='application/zip',
+                                    sha256=testsuite.sha256,
+                                    size=testsuite.size,
+                                    last_modified=testsuite.timestamp)
+
+    raise HTTPException(status_code=400, detail=f"Test suite {name} not found!")
 
 
 @router.get("", response_model=list[TestSuiteRead])
-def handle_read_all_testsuites(user_login: Annotated[str, Depends(validate_access_token)]):
-    with Session(engine) as session:
-        testsuites = session.exec(select(TestSuite)).all()
-        testsuites_read = []
-        for testsuite in testsuites:
-            testsuites_read.append(TestSuiteRead(
-                idx=testsuite.idx,
-                name=testsuite.name,
-                version=testsuite.version,
-                timestamp=testsuite.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            ))
-        return testsuites_read
+def handle_read_all_testsuites(user_login: Annotated[str, Depends(validate_access_token)],
+                               session: SessionDep,
+                               request: Request,
+                               response: Response,
+                               limit: Optional[int] = None,
+                               after: Optional[str] = None,
+                               stream: bool = False):
+    return cached_response(request, response, TESTSUITES, lambda: read_page(
+        session, select(TestSuite), [TestSuite.idx], lambda testsuite: [testsuite.idx],
+        read_testsuites, response, limit, after, stream))
 
 
 @router.get("/{start_date}/{end_date}", response_model=list[TestSuiteRead])
-def handle_read_all_testsuites_during_the_time(user_login: Annotated[str, Depends(validate_access_token)], start_date: str, end_date: str):
-    with Session(engine) as session:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d").replace(microsecond=0)
-        end_date = datetime.strptime(end_date, "%Y-%m-%d").replace(microsecond=0)
-        testsuites = session.exec(select(TestSuite).where(TestSuite.timestamp.between(start_date, end_date))).all()
-        testsuites_read = []
-        for testsuite in testsuites:
-            testsuites_read.append(TestSuiteRead(
-                idx=testsuite.idx,
-                name=testsuite.name,
-                version=testsuite.version,
-                timestamp=testsuite.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            ))
-        return testsuites_read
-
-
-def save_bytes_to_file(file_path, file: UploadFile):
-    content = file.file.read()
-    with open(file_path, "wb") as file:
-        file.write(content)
-
-
-def create_testsuite(name: str,
+def handle_read_all_testsuites_during_the_time(user_login: Annotated[str, Depends(validate_access_token)],
+                                               start_date: str,
+                                               end_date: str,
+                                               session: SessionDep,
+                                               request: Request,
+                                               response: Response,
+                                               limit: Optional[int] = None,
+                                               after: Optional[str] = None,
+                                               stream: bool = False):
+    start_date = datetime.strptime(start_date, "%Y-%m-%d").replace(microsecond=0)
+    end_date = datetime.strptime(end_date, "%Y-%m-%d").replace(microsecond=0)
+    return cached_response(request, response, TESTSUITES, lambda: read_page(
+        session, select(TestSuite).where(TestSuite.timestamp.between(start_date, end_date)),
+        [TestSuite.idx], lambda testsuite: [testsuite.idx],
+        read_testsuites, response, limit, after, stream))
+
+
+def read_testsuites(session: Session, testsuites: list[TestSuite]) -> list[TestSuiteRead]:
+    return [TestSuiteRead(
+        idx=testsuite.idx,
+        name=testsuite.name,
+        version=testsuite.version,
+        timestamp=testsuite.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    ) for testsuite in testsuites]
+
+
+def create_testsuite(session: Session,
+                     name: str,
                      version: str,
                      zip_file: UploadFile,
                      timestamp: str) -> (TestSuite, status):
-    with Session(engine) as session:
-        status_code = status.HTTP_207_MULTI_STATUS
-        db_testsuite = session.exec(select(TestSuite)
-                                    .where(TestSuite.name == name)
-                                    .where(TestSuite.version == version)).one_or_none()
-        if db_testsuite:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"Testsuite with name {name} and version {version} already exists!"
-            )
-        if timestamp is None:
-            db_timestamp = datetime.now().replace(microsecond=0)
-        else:
-            db_timestamp = datetime.strptime(timestamp, '%Y-%m-%d%H:%M:%S').replace(microsecond=0)
-        status_code = status.HTTP_201_CREATED
-        db_testsuite = TestSuite(name=name,
-                                 version=version,
-                                 timestamp=db_timestamp)
-        session.add(db_testsuite)
-        session.commit()
-        session.refresh(db_testsuite)
-        os.mkdir(db_testsuite.results_path)
-        save_bytes_to_file(db_testsuite.path, zip_file)
-        return db_testsuite, status_code
+    status_code = status.HTTP_207_MULTI_STATUS
+    db_testsuite = session.exec(select(TestSuite)
+                                .where(TestSuite.name == name)
+                                .where(TestSuite.version == version)).one_or_none()
+    if db_testsuite:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Testsuite with name {name} and version {version} already exists!"
+        )
+    if timestamp is None:
+        db_timestamp = datetime.now().replace(microsecond=0)
+    else:
+        db_timestamp = datetime.strptime(timestamp, '%Y-%m-%d%H:%M:%S').replace(microsecond=0)
+    status_code = status.HTTP_201_CREATED
+    db_testsuite = TestSuite(name=name,
+                             version=version,
+                             timestamp=db_timestamp)
+    session.add(db_testsuite)
+    session.flush()
+    os.mkdir(db_testsuite.results_path)
+    db_testsuite.sha256, db_testsuite.size = store_blob(session, zip_file)
+    db_testsuite.blob = db_testsuite.sha256
+    invalidate_responses(session, TESTSUITES)
+    session.commit()
+    session.refresh(db_testsuite)
+    return db_testsuite, status_code
 
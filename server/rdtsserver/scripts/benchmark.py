@@ -0,0 +1,180 @@
+# ruff: noqa: E402
+# Модули сервера читают DATABASE_URL при импорте, поэтому они импортируются после разбора аргументов
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tarfile
+import time
+from datetime import datetime, timedelta
+
+# Нагрузочный прогон основных эндпоинтов на синтетических данных масштаба участка.
+# База заполняется скриптом generate_data.py (если она пуста), затем каждый сценарий
+# выполняется --repeat раз; выводятся перцентили задержки и среднее число SQL-запросов.
+# С --save-baseline результаты сохраняются, иначе сравниваются с сохраненным baseline.
+# Запуск: python3 server/rdtsserver/scripts/benchmark.py --database-url sqlite:////tmp/rdts-benchmark.db
+# Пишет файлы в /results и /blobs, поэтому запускается только на тестовом стенде.
+
+parser = argparse.ArgumentParser(description="RDTS server benchmark")
+parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:////tmp/rdts-benchmark.db"))
+parser.add_argument("--scale", type=float, default=1.0, help="multiplier of generate_data volumes")
+parser.add_argument("--repeat", type=int, default=50, help="requests per scenario")
+parser.add_argument("--baseline", default="benchmark_baseline.json")
+parser.add_argument("--save-baseline", action="store_true")
+parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p95 growth against the baseline")
+parser.add_argument("--min-delta-ms", type=float, default=2.0, help="p95 growth below this is never a regression")
+args = parser.parse_args()
+
+os.environ["DATABASE_URL"] = args.database_url
+os.environ["ASYNC_DATABASE_URL"] = (args.database_url
+                                    .replace("sqlite://", "sqlite+aiosqlite://", 1)
+                                    .replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1))
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select, func
+
+from server.rdtsserver.db.tables import Assembly, TestSuiteResult
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.main import main_app
+from server.rdtsserver.scripts.generate_data import generate, create_schema, BENCHMARK_LOGIN, BENCHMARK_PASSWORD, \
+    PLACES, HISTORY, crystal_name
+from server.rdtsserver.utils.querystats import track_queries
+
+API = "/v1.0.2"
+WARMUP = 3
+rng = random.Random(1)
+
+create_schema(engine)
+with Session(engine) as session:
+    seeded = session.exec(select(func.count()).select_from(Assembly)).one() > 0
+if not seeded:
+    started = time.perf_counter()
+    print(f"seeding {generate(engine, args.scale)} in {time.perf_counter() - started:.0f} s")
+
+with Session(engine) as session:
+    assembly_count = session.exec(select(func.count()).select_from(Assembly)).one()
+    result_idxs = session.exec(select(TestSuiteResult.idx)).all()
+    first, last = session.exec(select(func.min(TestSuiteResult.timestamp), func.max(TestSuiteResult.timestamp))).one()
+
+
+def day(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def random_assembly() -> str:
+    return f"A{rng.randrange(assembly_count)}"
+
+
+def ingest_result(client: TestClient):
+    return client.post(f"{API}/testsuiteresults",
+                       params={"testsuite_idx": 1, "assembly_name": random_assembly()},
+                       files={"config": ("config.json", b'{"config": 0, "threshold": 0.0}'),
+                              "result": ("result.json", json.dumps({"ly": {"value": rng.random()}}).encode())})
+
+
+def ingest_batch(client: TestClient, size: int = 20):
+    # тот же объем, что size вызовов ingest_result, одним архивом
+    bundle = io.BytesIO()
+    files = {"config.json": b'{"config": 0, "threshold": 0.0}'}
+    manifest = []
+    for number in range(size):
+        files[f"result-{number}.json"] = json.dumps({"ly": {"value": rng.random()}}).encode()
+        manifest.append({"testsuite_idx": 1, "assembly_name": random_assembly(),
+                         "config": "config.json", "result": f"result-{number}.json"})
+    files["manifest.json"] = json.dumps(manifest).encode()
+    with tarfile.open(fileobj=bundle, mode="w") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return client.post(f"{API}/testsuiteresults/batch", files={"bundle": ("bundle.tar", bundle.getvalue())})
+
+
+def update_assembly(client: TestClient):
+    a = rng.randrange(assembly_count)
+    crystals = [crystal_name(a, place, rng.randrange(HISTORY)) for place in range(PLACES)]
+    return client.post(f"{API}/assemblies", json={"name": f"A{a}", "crystals": crystals})
+
+
+SCENARIOS = {
+    "assemblies page": lambda client: client.get(f"{API}/assemblies", params={"limit": 100}),
+    "assembly": lambda client: client.get(f"{API}/assemblies/{random_assembly()}"),
+    "crystals page": lambda client: client.get(f"{API}/crystals", params={"limit": 100}),
+    "crystal": lambda client: client.get(f"{API}/crystals/{crystal_name(rng.randrange(assembly_count), 0, 0)}"),
+    "results page": lambda client: client.get(f"{API}/testsuiteresults", params={"limit": 100}),
+    "results period": lambda client: client.get(f"{API}/testsuiteresults/{day(first)}/{day(last + timedelta(days=1))}",
+                                                params={"limit": 100}),
+    "result": lambda client: client.get(f"{API}/testsuiteresults/{rng.choice(result_idxs)}"),
+    "result config download": lambda client: client.get(f"{API}/testsuiteresults/{rng.choice(result_idxs)}/config"),
+    "testsuite download": lambda client: client.get(f"{API}/testsuites/download/TS{rng.randrange(10)}"),
+    "result ingestion": ingest_result,
+    "batch ingestion x20": ingest_batch,
+    "assembly update": update_assembly,
+}
+if engine.dialect.name == "postgresql":
+    # array_agg есть только в PostgreSQL
+    SCENARIOS["assemblies period"] = lambda client: client.get(
+        f"{API}/assemblies/{day(first - timedelta(days=400))}/{day(last)}", params={"limit": 100})
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+report = {}
+with TestClient(main_app) as client:
+    token = client.post(f"{API}/auth/sign-in",
+                        data={"username": BENCHMARK_LOGIN, "password": BENCHMARK_PASSWORD}).json()["access_token"]
+    client.headers["Authorization"] = f"Bearer {token}"
+
+    for name, scenario in SCENARIOS.items():
+        for _ in range(WARMUP):
+            scenario(client)
+        latencies = []
+        queries = 0
+        for _ in range(args.repeat):
+            with track_queries() as stats:
+                started = time.perf_counter()
+                response = scenario(client)
+                latencies.append(time.perf_counter() - started)
+            queries += stats.queries
+            if response.status_code >= 300:
+                sys.exit(f"{name}: {response.status_code} {response.text[:200]}")
+        report[name] = {"p50": percentile(latencies, 0.50) * 1000,
+                        "p95": percentile(latencies, 0.95) * 1000,
+                        "p99": percentile(latencies, 0.99) * 1000,
+                        "queries": queries / args.repeat}
+
+baseline = {}
+if os.path.exists(args.baseline) and not args.save_baseline:
+    with open(args.baseline) as file:
+        baseline = json.load(file)["scenarios"]
+
+regressions = []
+print(f"{'scenario':24s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'queries':>8s}  baseline p95 / queries")
+for name, result in report.items():
+    line = f"{name:24s} {result['p50']:9.1f} {result['p95']:9.1f} {result['p99']:9.1f} {result['queries']:8.1f}"
+    previous = baseline.get(name)
+    if previous:
+        line += f"  {previous['p95']:9.1f} / {previous['queries']:.1f}"
+        slower = result["p95"] > max(previous["p95"] * (1 + args.tolerance), previous["p95"] + args.min_delta_ms)
+        # доли запроса дает периодический опрос счетчиков изменений, поэтому сравниваются целые числа
+        if slower or round(result["queries"]) > round(previous["queries"]):
+            regressions.append(name)
+            line += "  REGRESSION"
+    print(line)
+
+if args.save_baseline:
+    with open(args.baseline, "w") as file:
+        json.dump({"database": engine.dialect.name,
+                   "scale": args.scale,
+                   "repeat": args.repeat,
+                   "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                   "scenarios": report}, file, indent=2)
+    print(f"baseline saved to {args.baseline}")
+
+if regressions:
+    sys.exit(f"regressions: {', '.join(regressions)}")
@@ -0,0 +1,45 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from sqlmodel import Session
+
+from server.rdtsserver.db.tables import RDTSDatabase, Assembly, Crystal, CrystalState, CrystalStatus
+from server.rdtsserver.db.repository import resolve_assemblies_composition
+
+ASSEMBLY_COUNTS = [10, 100, 500]
+PLACES = 64
+
+# Измеряет число SQL-запросов и время построения состава сборок для страницы GET /assemblies.
+# Запуск: python3 server/rdtsserver/scripts/benchmark_composition.py
+
+for assembly_count in ASSEMBLY_COUNTS:
+    engine = create_engine("sqlite://")
+    RDTSDatabase.metadata.create_all(engine, tables=[Assembly.__table__, Crystal.__table__, CrystalState.__table__])
+    timestamp = datetime.now().replace(microsecond=0) - timedelta(days=1)
+
+    with Session(engine) as session:
+        for a in range(assembly_count):
+            session.add(Assembly(name=f"A{a}", timestamp=timestamp))
+            for place in range(PLACES):
+                crystal_name = f"A{a}-C{place}"
+                session.add(Crystal(name=crystal_name))
+                session.add(CrystalState(crystal_name=crystal_name,
+                                         assembly_name=f"A{a}",
+                                         timestamp=timestamp,
+                                         place=place,
+                                         status=CrystalStatus.USED))
+        session.commit()
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with Session(engine) as session:
+        start = time.perf_counter()
+        compositions = resolve_assemblies_composition(session,
+                                                      [f"A{a}" for a in range(assembly_count)],
+                                                      datetime.now())
+        elapsed = time.perf_counter() - start
+
+    assert all(len(crystals) == PLACES for crystals in compositions.values())
+    print(f"assemblies={assembly_count:5d} places={PLACES} queries={len(statements)} time={elapsed * 1000:.1f} ms")
@@ -0,0 +1,19 @@
+import sys
+
+from sqlmodel.orm.session import Session
+
+from server.rdtsserver.db.repository import find_inconsistent_crystals
+from server.rdtsserver.dependencies import engine
+
+# Сверяет таблицу crystals_current_states с историей crystals_states.
+# Код возврата 1, если найдены расхождения (исправляются скриптом rebuild_current_states.py).
+
+with Session(engine) as session:
+    crystal_names = find_inconsistent_crystals(session)
+
+for crystal_name in crystal_names:
+    print(f"Inconsistent current state: {crystal_name}")
+
+if crystal_names:
+    sys.exit(1)
+print("Current crystal states are consistent with history")
@@ -0,0 +1,90 @@
+import sys
+from datetime import datetime
+
+from sqlalchemy import and_
+from sqlmodel import select
+
+from server.rdtsserver.db.tables import CrystalState, CrystalStatus, CurrentCrystalState, TestSuite, TestSuiteResult, \
+    User, CrystalStateTestsuiteresult, ResultMetric
+from server.rdtsserver.dependencies import engine
+
+# Проверяет, что запросы горячих путей используют индексы из миграций.
+# Для каждого запроса выполняется EXPLAIN (в PostgreSQL с enable_seqscan = off, чтобы
+# на маленькой базе проверялась возможность использовать индекс, а не выбор планировщика).
+# Запуск: python3 server/rdtsserver/scripts/check_indexes.py
+
+CHECKS = [
+    ("state of a crystal",
+     "ix_crystals_states_crystal_name_timestamp",
+     select(CrystalState.idx)
+     .where(CrystalState.crystal_name == "C")
+     .where(CrystalState.status == CrystalStatus.USED)
+     .order_by(CrystalState.timestamp.desc(), CrystalState.idx.desc())),
+    ("state of an assembly place",
+     "ix_crystals_states_assembly_place_timestamp",
+     select(CrystalState.idx)
+     .where(CrystalState.assembly_name == "A")
+     .where(CrystalState.place == 0)
+     .order_by(CrystalState.timestamp.desc(), CrystalState.idx.desc())
+     .limit(1)),
+    ("current states of an assembly",
+     "ix_crystals_current_states_assembly_place",
+     select(CrystalState)
+     .join(CurrentCrystalState, CurrentCrystalState.crystalstate_idx == CrystalState.idx)
+     .where(CurrentCrystalState.assembly_name == "A")
+     .order_by(CurrentCrystalState.place, CurrentCrystalState.crystal_name)),
+    ("current state by history row",
+     "ix_crystals_current_states_crystalstate_idx",
+     select(CurrentCrystalState.crystal_name).where(CurrentCrystalState.crystalstate_idx == 1)),
+    ("results of a period",
+     "ix_testsuiteresults_timestamp",
+     select(TestSuiteResult.idx).where(TestSuiteResult.timestamp.between(datetime(2024, 1, 1), datetime(2024, 2, 1)))),
+    ("results of a test suite",
+     "ix_testsuiteresults_testsuite_idx",
+     select(TestSuiteResult.idx).where(TestSuiteResult.testsuite_idx == 1)),
+    ("states of a result",
+     "ix_crystalstate_testsuiteresult_result_state",
+     select(CrystalStateTestsuiteresult.crystalstate_idx).where(CrystalStateTestsuiteresult.testsuiteresult_idx == 1)),
+    ("results of a state",
+     "ix_crystalstate_testsuiteresult_state",
+     select(CrystalStateTestsuiteresult.testsuiteresult_idx).where(CrystalStateTestsuiteresult.crystalstate_idx == 1)),
+    ("metric values of a period",
+     "ix_result_metrics_metric_timestamp",
+     select(ResultMetric.crystal_name, ResultMetric.value)
+     .where(ResultMetric.metric == "ly")
+     .where(ResultMetric.timestamp >= datetime(2024, 1, 1))),
+    ("metric values of a crystal",
+     "ix_result_metrics_crystal_metric_timestamp",
+     select(ResultMetric.timestamp, ResultMetric.value)
+     .where(ResultMetric.crystal_name == "C")
+     .where(ResultMetric.metric == "ly")),
+    ("test suite version",
+     "ix_testsuites_name_version",
+     select(TestSuite.idx).where(and_(TestSuite.name == "TS", TestSuite.version == "1.0"))),
+    ("user by login",
+     "ix_users_login",
+     select(User.idx).where(User.login == "admin")),
+]
+
+
+def explain(connection, statement) -> str:
+    sql = statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    if connection.dialect.name == "sqlite":
+        return "\n".join(row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+    return "\n".join(row[0] for row in connection.exec_driver_sql(f"EXPLAIN {sql}"))
+
+
+failures = 0
+with engine.begin() as connection:
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    for name, index, statement in CHECKS:
+        plan = explain(connection, statement)
+        uses_index = index in plan
+        failures += not uses_index
+        print(f"{'OK  ' if uses_index else 'FAIL'} {name}: {index}")
+        if not uses_index:
+            print("     " + plan.replace("\n", "\n     "))
+    connection.rollback()
+
+sys.exit(1 if failures else 0)
@@ -0,0 +1,9 @@
+from sqlmodel.orm.session import Session
+
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.utils.blobs import collect_garbage
+
+# Удаляет из хранилища /blobs файлы, на которые больше не ссылается ни один набор тестов или результат.
+
+with Session(engine) as session:
+    print(f"Removed {collect_garbage(session)} unreferenced blobs")
@@ -0,0 +1,16 @@
+import glob
+
+from server.rdtsserver.utils.storage import compress_stored
+
+# Однократно сжимает (gzip) уже сохраненные файлы результатов и конфигураций в /results.
+# Сжатые файлы получают суффикс .gz, исходные удаляются; повторный запуск ничего не меняет.
+
+RESULTS_DIR = "/results"
+
+compressed = 0
+for pattern in ("result-*.json", "config-*.json"):
+    for file_path in glob.glob(f"{RESULTS_DIR}/*/{pattern}"):
+        if compress_stored(file_path):
+            compressed += 1
+
+print(f"Compressed {compressed} files")
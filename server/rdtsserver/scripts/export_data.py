@@ -0,0 +1,29 @@
+import argparse
+import os
+from datetime import datetime
+
+from server.rdtsserver.utils.export import EXPORT_TABLES, EXTENSIONS, PARQUET, ARROW, export_statement, iter_export
+
+# Выгружает таблицы crystalstates, testsuiteresults, links и metrics в файлы Parquet или Arrow IPC
+# для анализа в ноутбуках (то же, что GET /export/{table}, но напрямую из базы DATABASE_URL).
+# Строки читаются серверным курсором пачками по EXPORT_BATCH_SIZE, поэтому память не растет с объемом базы.
+# Запуск: python3 server/rdtsserver/scripts/export_data.py --output-dir export [--format arrow]
+#         [--testsuite-idx 1] [--start-date 2024-01-01] [--end-date 2024-02-01] [--table metrics]
+
+parser = argparse.ArgumentParser(description="RDTS bulk export")
+parser.add_argument("--output-dir", default=".")
+parser.add_argument("--format", choices=[PARQUET, ARROW], default=PARQUET)
+parser.add_argument("--table", choices=list(EXPORT_TABLES), action="append", help="default: all tables")
+parser.add_argument("--testsuite-idx", type=int)
+parser.add_argument("--start-date", type=lambda value: datetime.strptime(value, "%Y-%m-%d"))
+parser.add_argument("--end-date", type=lambda value: datetime.strptime(value, "%Y-%m-%d"))
+args = parser.parse_args()
+
+os.makedirs(args.output_dir, exist_ok=True)
+for table in args.table or list(EXPORT_TABLES):
+    path = os.path.join(args.output_dir, f"{table}.{EXTENSIONS[args.format]}")
+    statement = export_statement(table, args.testsuite_idx, args.start_date, args.end_date)
+    with open(path, "wb") as file:
+        for chunk in iter_export(table, args.format, statement):
+            file.write(chunk)
+    print(f"{table}: {path} ({os.path.getsize(path)} bytes)")
@@ -0,0 +1,172 @@
+import io
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from fastapi import UploadFile
+from sqlalchemy import insert, update, text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import RDTSDatabase, Assembly, Crystal, CrystalState, CrystalStatus, Blob, \
+    TestSuite, TestSuiteResult, CrystalStateTestsuiteresult, CurrentCrystalState, Role, RoleName, User
+from server.rdtsserver.db.repository import refresh_current_crystal_states
+from server.rdtsserver.dependencies import ROLE_ADMIN, ROLE_ENGINEER, ROLE_USER
+from server.rdtsserver.utils.analytics import index_result_metrics
+from server.rdtsserver.utils.blobs import store_blob
+from server.rdtsserver.utils.security import get_password_hash
+from server.rdtsserver.utils.storage import save_upload, results_compression_enabled
+
+ASSEMBLIES = 2000
+PLACES = 32
+HISTORY = 4
+TESTSUITES = 10
+RESULTS = 5000
+CONFIGS = 20
+BATCH_SIZE = 5000
+
+BENCHMARK_LOGIN = "benchmark"
+BENCHMARK_PASSWORD = "benchmark"
+
+# Заполняет базу синтетическими данными масштаба испытательного участка:
+# ASSEMBLIES сборок по PLACES мест, HISTORY кристаллов на каждом месте (история перестановок),
+# TESTSUITES наборов тестов и RESULTS результатов со связанными состояниями и файлами.
+# Запуск: python3 server/rdtsserver/scripts/generate_data.py [scale]
+# Объемы умножаются на scale (по умолчанию 1). Использовать только на тестовом стенде.
+
+
+def create_schema(engine: Engine):
+    """Creates the tables; on SQLite the link table gets an AUTOINCREMENT key SQLite cannot derive itself."""
+    link = CrystalStateTestsuiteresult.__table__
+    if engine.dialect.name != "sqlite":
+        RDTSDatabase.metadata.create_all(engine)
+        return
+    RDTSDatabase.metadata.create_all(engine, tables=[table for table in RDTSDatabase.metadata.sorted_tables
+                                                     if table is not link])
+    with engine.begin() as connection:
+        connection.execute(text(f"CREATE TABLE IF NOT EXISTS {link.name} ("
+                                "idx INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                "crystalstate_idx INTEGER REFERENCES crystals_states(idx), "
+                                "testsuiteresult_idx INTEGER REFERENCES testsuiteresults(idx))"))
+
+
+def generate(engine: Engine, scale: float = 1.0, seed: int = 0) -> dict[str, int]:
+    """Seeds an empty database and returns the numbers of generated rows."""
+    rng = random.Random(seed)
+    assemblies = max(int(ASSEMBLIES * scale), 1)
+    results = max(int(RESULTS * scale), 1)
+    start = datetime.now().replace(microsecond=0) - timedelta(days=365)
+    create_schema(engine)
+
+    with Session(engine) as session:
+        for idx, name in ((ROLE_ADMIN, RoleName.ADMIN), (ROLE_ENGINEER, RoleName.ENGINEER), (ROLE_USER, RoleName.USER)):
+            if session.get(Role, idx) is None:
+                session.add(Role(idx=idx, name=name))
+        session.add(User(login=BENCHMARK_LOGIN, hashed_password=get_password_hash(BENCHMARK_PASSWORD), role=ROLE_ADMIN))
+
+        insert_batched(session, Assembly, [{"name": assembly_name(a), "timestamp": start} for a in range(assemblies)])
+        insert_batched(session, Crystal, [{"name": crystal_name(a, place, step)}
+                                          for step in range(HISTORY)
+                                          for a in range(assemblies)
+                                          for place in range(PLACES)])
+        insert_batched(session, CrystalState, [{"crystal_name": crystal_name(a, place, step),
+                                                "assembly_name": assembly_name(a),
+                                                "timestamp": history_timestamp(start, step),
+                                                "place": place,
+                                                "status": CrystalStatus.USED if step == HISTORY - 1 else CrystalStatus.UNUSED}
+                                               for step in range(HISTORY)
+                                               for a in range(assemblies)
+                                               for place in range(PLACES)])
+        refresh_current_crystal_states(session)
+        session.commit()
+
+        states: dict[str, list[int]] = {}
+        crystal_names: dict[str, list[str]] = {}
+        for name, crystalstate_idx, crystal in session.exec(select(CurrentCrystalState.assembly_name,
+                                                                   CurrentCrystalState.crystalstate_idx,
+                                                                   CurrentCrystalState.crystal_name)
+                                                            .where(CurrentCrystalState.status == CrystalStatus.USED)):
+            states.setdefault(name, []).append(crystalstate_idx)
+            crystal_names.setdefault(name, []).append(crystal)
+
+        testsuites = []
+        for t in range(TESTSUITES):
+            testsuite = TestSuite(name=f"TS{t}", version="1.0", timestamp=start)
+            session.add(testsuite)
+            session.flush()
+            os.makedirs(testsuite.results_path, exist_ok=True)
+            testsuite.sha256, testsuite.size = store_blob(session, upload(f"testsuite {t}".encode() * 64))
+            testsuite.blob = testsuite.sha256
+            testsuites.append(testsuite)
+
+        compress = results_compression_enabled()
+        configs = [store_blob(session, upload(json.dumps({"config": c, "threshold": c * 0.1}).encode()), compress)
+                   for c in range(CONFIGS)]
+        session.commit()
+
+        result_timestamp = history_timestamp(start, HISTORY)
+        rows = []
+        for r in range(results):
+            config_sha256, config_size = configs[r % CONFIGS]
+            rows.append({"testsuite_idx": testsuites[r % TESTSUITES].idx,
+                         "assembly_name": assembly_name(rng.randrange(assemblies)),
+                         "timestamp": result_timestamp + timedelta(minutes=r),
+                         "config_sha256": config_sha256,
+                         "config_size": config_size,
+                         "config_blob": config_sha256})
+        links = 0
+        for batch_start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[batch_start:batch_start + BATCH_SIZE]
+            idxs = session.scalars(insert(TestSuiteResult).returning(TestSuiteResult.idx, sort_by_parameter_order=True),
+                                   [{key: value for key, value in row.items() if key != "assembly_name"}
+                                    for row in batch]).all()
+            link_rows = [{"crystalstate_idx": crystalstate_idx, "testsuiteresult_idx": idx}
+                         for idx, row in zip(idxs, batch) for crystalstate_idx in states[row["assembly_name"]]]
+            insert_batched(session, CrystalStateTestsuiteresult, link_rows)
+            links += len(link_rows)
+            assembly_of = {idx: row["assembly_name"] for idx, row in zip(idxs, batch)}
+            for testsuiteresult in session.exec(select(TestSuiteResult).where(TestSuiteResult.idx.in_(idxs))):
+                data = json.dumps({name: {"value": rng.random()} for name in ("ly", "resolution", "noise")}).encode()
+                testsuiteresult.result_sha256, testsuiteresult.result_size = \
+                    save_upload(upload(data), testsuiteresult.result_path, compress)
+                index_result_metrics(session, testsuiteresult, crystal_names[assembly_of[testsuiteresult.idx]])
+            session.commit()
+
+        for c, (config_sha256, _) in enumerate(configs):
+            uses = len(range(c, results, CONFIGS))
+            session.exec(update(Blob).where(Blob.sha256 == config_sha256).values(refcount=Blob.refcount + uses - 1))
+        session.commit()
+
+    return {"assemblies": assemblies,
+            "crystal_states": assemblies * PLACES * HISTORY,
+            "testsuiteresults": results,
+            "links": links}
+
+
+def insert_batched(session: Session, model, rows: list[dict]):
+    for batch_start in range(0, len(rows), BATCH_SIZE):
+        session.execute(insert(model), rows[batch_start:batch_start + BATCH_SIZE])
+
+
+def upload(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data))
+
+
+def assembly_name(a: int) -> str:
+    return f"A{a}"
+
+
+def crystal_name(a: int, place: int, step: int) -> str:
+    return f"C{a}-{place}-{step}"
+
+
+def history_timestamp(start: datetime, step: int) -> datetime:
+    return start + timedelta(days=30 * step)
+
+
+if __name__ == "__main__":
+    import sys
+    from server.rdtsserver.dependencies import engine
+
+    print(generate(engine, float(sys.argv[1]) if len(sys.argv) > 1 else 1.0))
@@ -0,0 +1,37 @@
+from sqlalchemy import exists
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import TestSuiteResult, ResultMetric, CrystalState, CrystalStateTestsuiteresult
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.utils.analytics import index_result_metrics
+
+# Извлекает числовые метрики из файлов результатов, загруженных до появления таблицы result_metrics.
+# Результаты, у которых метрики уже есть, пропускаются, поэтому скрипт можно прерывать и запускать повторно.
+
+BATCH_SIZE = 500
+
+indexed = 0
+metrics = 0
+last_idx = 0
+with Session(engine) as session:
+    while True:
+        testsuiteresults = session.exec(select(TestSuiteResult)
+                                        .where(TestSuiteResult.idx > last_idx)
+                                        .where(~exists().where(ResultMetric.testsuiteresult_idx == TestSuiteResult.idx))
+                                        .order_by(TestSuiteResult.idx)
+                                        .limit(BATCH_SIZE)).all()
+        if not testsuiteresults:
+            break
+        crystal_names: dict[int, list[str]] = {}
+        for testsuiteresult_idx, crystal_name in session.exec(
+                select(CrystalStateTestsuiteresult.testsuiteresult_idx, CrystalState.crystal_name)
+                .join(CrystalState, CrystalState.idx == CrystalStateTestsuiteresult.crystalstate_idx)
+                .where(CrystalStateTestsuiteresult.testsuiteresult_idx.in_([tsr.idx for tsr in testsuiteresults]))):
+            crystal_names.setdefault(testsuiteresult_idx, []).append(crystal_name)
+        for testsuiteresult in testsuiteresults:
+            metrics += index_result_metrics(session, testsuiteresult, crystal_names.get(testsuiteresult.idx, []))
+        last_idx = testsuiteresults[-1].idx
+        indexed += len(testsuiteresults)
+        session.commit()
+
+print(f"Indexed {metrics} metrics of {indexed} results")
@@ -0,0 +1,10 @@
+from sqlmodel.orm.session import Session
+
+from server.rdtsserver.db.repository import refresh_current_crystal_states
+from server.rdtsserver.dependencies import engine
+
+# Пересобирает таблицу crystals_current_states из истории crystals_states.
+
+with Session(engine) as session:
+    refresh_current_crystal_states(session)
+    session.commit()
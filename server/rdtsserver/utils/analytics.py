@@ -0,0 +1,133 @@
+import json
+from datetime import datetime
+from typing import Any, Optional
+
+import numpy as np
+from sqlalchemy import insert
+from sqlmodel import Session
+
+from server.rdtsserver.db.tables import CrystalMetricStats, ResultMetric, TestSuiteResult
+from server.rdtsserver.utils.storage import open_stored
+
+PERCENTILES = (5, 50, 95)
+SECONDS_PER_DAY = 86400.0
+
+
+class ParsedMetrics:
+    """Numeric metrics of one result file.
+
+    A metric is a number or an object with a numeric "value". Top-level metrics apply to
+    every crystal of the result; an object keyed by a crystal name holds that crystal's own
+    metrics, which take precedence.
+    """
+
+    def __init__(self, data: Any):
+        self.shared: dict[str, float] = {}
+        self.crystals: dict[str, dict[str, float]] = {}
+        if not isinstance(data, dict):
+            return
+        for name, raw in data.items():
+            value = numeric(raw)
+            if value is not None:
+                self.shared[name] = value
+            elif isinstance(raw, dict):
+                self.crystals[name] = {metric: value for metric, raw_value in raw.items()
+                                       if (value := numeric(raw_value)) is not None}
+
+    def of_crystal(self, crystal_name: str) -> dict[str, float]:
+        return {**self.shared, **self.crystals.get(crystal_name, {})}
+
+
+def numeric(raw: Any) -> Optional[float]:
+    if isinstance(raw, dict):
+        raw = raw.get("value")
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        return float(raw)
+    return None
+
+
+def parse_result_metrics(result_path: str) -> ParsedMetrics:
+    try:
+        with open_stored(result_path) as file:
+            return ParsedMetrics(json.load(file))
+    except (OSError, ValueError):
+        return ParsedMetrics(None)
+
+
+def index_result_metrics(session: Session, testsuiteresult: TestSuiteResult, crystal_names: list[str]) -> int:
+    """Extracts the metrics of a stored result file into result_metrics in the caller's transaction."""
+    return insert_result_metrics(session, result_metric_rows(testsuiteresult, crystal_names))
+
+
+def result_metric_rows(testsuiteresult: TestSuiteResult, crystal_names: list[str]) -> list[dict]:
+    metrics = parse_result_metrics(testsuiteresult.result_path)
+    return [{"testsuiteresult_idx": testsuiteresult.idx,
+             "crystal_name": crystal_name,
+             "metric": metric,
+             "testsuite_idx": testsuiteresult.testsuite_idx,
+             "timestamp": testsuiteresult.timestamp,
+             "value": value}
+            for crystal_name in sorted(set(crystal_names))
+            for metric, value in metrics.of_crystal(crystal_name).items()]
+
+
+def insert_result_metrics(session: Session, rows: list[dict]) -> int:
+    """Inserts result_metrics rows as a plain Core statement; the ORM bulk path costs more than the insert."""
+    if rows:
+        session.execute(insert(ResultMetric.__table__), rows)
+    return len(rows)
+
+
+def crystal_metric_stats(rows: list[tuple[str, str, datetime, float]]) -> list[CrystalMetricStats]:
+    """Aggregates per (crystal, metric) over (crystal name, metric, timestamp, value) rows.
+
+    The rows become flat arrays grouped after one sort, so count, mean, std, min/max,
+    percentiles and the least-squares slope per day are computed for all groups at once.
+    """
+    if not rows:
+        return []
+    crystal_names, metrics, timestamps, values = zip(*rows)
+    keys, group_ids = np.unique(np.rec.fromarrays([np.array(crystal_names), np.array(metrics)]),
+                                return_inverse=True)
+    group_ids = group_ids.ravel()
+    values = np.asarray(values, dtype=float)
+    seconds = np.array([timestamp.timestamp() for timestamp in timestamps])
+    days = (seconds - seconds.min()) / SECONDS_PER_DAY
+    order = np.lexsort((values, group_ids))
+    group_ids, values, days = group_ids[order], values[order], days[order]
+
+    counts = np.bincount(group_ids, minlength=len(keys))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    means = np.bincount(group_ids, weights=values) / counts
+    stds = np.sqrt(np.bincount(group_ids, weights=(values - means[group_ids]) ** 2) / counts)
+    minimums = values[starts]
+    maximums = values[starts + counts - 1]
+    percentiles = {q: grouped_percentile(values, starts, counts, q) for q in PERCENTILES}
+
+    mean_days = np.bincount(group_ids, weights=days) / counts
+    day_deviations = days - mean_days[group_ids]
+    spread = np.bincount(group_ids, weights=day_deviations ** 2)
+    covariance = np.bincount(group_ids, weights=day_deviations * (values - means[group_ids]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = np.where(spread > 0, covariance / spread, np.nan)
+
+    return [CrystalMetricStats(crystal_name=str(crystal_name),
+                               metric=str(metric),
+                               count=int(counts[group]),
+                               mean=float(means[group]),
+                               std=float(stds[group]),
+                               min=float(minimums[group]),
+                               max=float(maximums[group]),
+                               p5=float(percentiles[5][group]),
+                               p50=float(percentiles[50][group]),
+                               p95=float(percentiles[95][group]),
+                               slope_per_day=None if np.isnan(slopes[group]) else float(slopes[group]))
+            for group, (crystal_name, metric) in enumerate(keys)]
+
+
+def grouped_percentile(values: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """Linearly interpolated percentile `q` of every group of `values`, sorted within each group."""
+    positions = starts + (counts - 1) * q / 100
+    lower = np.floor(positions).astype(int)
+    upper = np.ceil(positions).astype(int)
+    return values[lower] + (values[upper] - values[lower]) * (positions - lower)
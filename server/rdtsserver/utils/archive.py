@@ -0,0 +1,103 @@
+import json
+import tarfile
+import time
+import zlib
+from typing import Iterator, Optional
+
+from sqlmodel import Session
+
+from server.rdtsserver.db.repository import result_crystal_states
+from server.rdtsserver.db.tables import TestSuite, TestSuiteResult
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.utils.pagination import STREAM_BATCH_SIZE
+from server.rdtsserver.utils.storage import iter_stored, stored_size
+
+MANIFEST_NAME = "manifest.json"
+TAR = "tar"
+TGZ = "tgz"
+MEDIA_TYPES = {TAR: "application/x-tar", TGZ: "application/gzip"}
+EXTENSIONS = {TAR: "tar", TGZ: "tar.gz"}
+
+
+def tar_member(name: str, size: int, mtime: float, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """A tar header, the `size` bytes of `chunks` and the padding to the next 512-byte block."""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    yield info.tobuf(tarfile.PAX_FORMAT)
+    remaining = size
+    for chunk in chunks:
+        chunk = chunk[:remaining]
+        remaining -= len(chunk)
+        yield chunk
+        if not remaining:
+            break
+    if remaining:
+        raise OSError(f"{name} is shorter than {size} bytes")
+    yield tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+
+
+def tar_end() -> bytes:
+    return tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+def gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
+def stored_member(name: str, file_path: str, mtime: float) -> tuple[Optional[int], Iterator[bytes]]:
+    """Size and tar member of a stored file, or (None, nothing) if the file is missing."""
+    try:
+        size = stored_size(file_path)
+    except OSError:
+        return None, iter(())
+    return size, tar_member(name, size, mtime, iter_stored(file_path))
+
+
+def iter_results_archive(statement) -> Iterator[bytes]:
+    """Streams a tar of the result and config files of the (TestSuiteResult, TestSuite) rows of `statement`.
+
+    Rows are fetched from a server-side cursor, each file is read from storage in CHUNK_SIZE
+    pieces and written right behind its tar header, so neither the archive nor a whole file is
+    ever held in memory or on disk. manifest.json, describing every result, closes the archive.
+    """
+    manifest = []
+    with Session(engine) as session:
+        result = session.exec(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+        for rows in result.partitions():
+            crystal_states = result_crystal_states(session, [testsuiteresult.idx for testsuiteresult, _ in rows])
+            for testsuiteresult, testsuite in rows:
+                entry = manifest_entry(testsuiteresult, testsuite, crystal_states[testsuiteresult.idx])
+                mtime = testsuiteresult.timestamp.timestamp()
+                for kind, file_path, sha256 in (("result", testsuiteresult.result_path, testsuiteresult.result_sha256),
+                                                ("config", testsuiteresult.config_path, testsuiteresult.config_sha256)):
+                    name = f"{testsuiteresult.idx}/{kind}.json"
+                    size, member = stored_member(name, file_path, mtime)
+                    entry[kind] = {"path": name if size is not None else None, "size": size, "sha256": sha256}
+                    yield from member
+                manifest.append(entry)
+
+    body = json.dumps(manifest, ensure_ascii=False, indent=1).encode()
+    yield from tar_member(MANIFEST_NAME, len(body), time.time(), iter((body,)))
+    yield tar_end()
+
+
+def manifest_entry(testsuiteresult: TestSuiteResult, testsuite: TestSuite, crystal_states: list) -> dict:
+    return {"idx": testsuiteresult.idx,
+            "testsuite_idx": testsuite.idx,
+            "testsuite_name": testsuite.name,
+            "testsuite_version": testsuite.version,
+            "timestamp": testsuiteresult.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "assembly_name": crystal_states[0].assembly_name if crystal_states else None,
+            "crystals": [{"crystal_name": crystal_state.crystal_name, "place": crystal_state.place}
+                         for crystal_state in crystal_states]}
+
+
+def iter_archive(statement, archive_format: str) -> Iterator[bytes]:
+    chunks = iter_results_archive(statement)
+    return gzip_chunks(chunks) if archive_format == TGZ else chunks
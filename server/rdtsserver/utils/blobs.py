@@ -0,0 +1,128 @@
+import os
+from collections import Counter
+
+from fastapi import UploadFile
+from sqlalchemy import update, event, insert, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import Blob
+from server.rdtsserver.utils.storage import blob_path, hash_upload, save_upload, remove_stored
+
+NEW_FILES = "rdts_new_blob_files"
+
+
+def store_blob(session: Session, file: UploadFile, compress: bool = False) -> tuple[str, int]:
+    """Adds a reference to the blob with the content of `file` and returns its sha256 and size.
+
+    The upload is hashed first; if a blob with the same content is already stored, only its
+    reference count is incremented and nothing is written to disk. A new blob row is inserted
+    before its file is written, so a concurrent upload of the same content waits for this
+    transaction instead of relying on a file that a rollback removes again.
+    """
+    sha256, size = hash_upload(file)
+    blob = session.get(Blob, sha256, with_for_update=True)
+    if blob is None:
+        try:
+            with session.begin_nested():
+                session.add(Blob(sha256=sha256, size=size, refcount=1))
+        except IntegrityError:
+            blob = session.get(Blob, sha256, with_for_update=True)
+        else:
+            write_blob(session, sha256, file, compress)
+            return sha256, size
+    blob.refcount += 1
+    return sha256, size
+
+
+def store_blobs(session: Session, files: list[UploadFile], compress: bool = False) -> list[tuple[str, int]]:
+    """`store_blob` for many uploads with a fixed number of statements, whatever their count.
+
+    Existing blobs are locked with one query, new ones inserted with one statement and the
+    reference counts of existing ones raised with one executemany UPDATE. If a concurrent
+    transaction inserts one of the new blobs first, every file goes through `store_blob`.
+    """
+    hashes = [hash_upload(file) for file in files]
+    if not hashes:
+        return hashes
+    references = Counter(sha256 for sha256, _ in hashes)
+    existing = set(session.exec(select(Blob.sha256)
+                                .where(Blob.sha256.in_(list(references)))
+                                .with_for_update()))
+    new_files = {sha256: (file, size) for file, (sha256, size) in zip(files, hashes) if sha256 not in existing}
+    if new_files:
+        try:
+            with session.begin_nested():
+                session.execute(insert(Blob.__table__),
+                                [{"sha256": sha256, "size": size, "refcount": references[sha256]}
+                                 for sha256, (_, size) in new_files.items()])
+        except IntegrityError:
+            return [store_blob(session, file, compress) for file in files]
+        for sha256, (file, _) in new_files.items():
+            write_blob(session, sha256, file, compress)
+    if existing:
+        blobs = Blob.__table__
+        session.execute(update(blobs)
+                        .where(blobs.c.sha256 == bindparam("b_sha256"))
+                        .values(refcount=blobs.c.refcount + bindparam("b_references")),
+                        [{"b_sha256": sha256, "b_references": references[sha256]} for sha256 in existing])
+    return hashes
+
+
+def write_blob(session: Session, sha256: str, file: UploadFile, compress: bool = False):
+    """Writes the file of a blob inserted by the session's transaction; it is removed unless the transaction commits."""
+    path = blob_path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    track_new_file(session, path)
+    save_upload(file, path, compress)
+
+
+def track_new_file(session: Session, path: str):
+    if NEW_FILES not in session.info:
+        session.info[NEW_FILES] = []
+        event.listen(session, "after_commit", forget_new_files)
+        event.listen(session, "after_transaction_end", remove_new_files)
+    session.info[NEW_FILES].append(path)
+
+
+def forget_new_files(session: Session):
+    """Keeps the files once the outermost transaction commits; after_commit also fires when a savepoint is released."""
+    if not session.in_nested_transaction():
+        session.info[NEW_FILES].clear()
+
+
+def remove_new_files(session: Session, transaction):
+    """Removes the files written by a transaction that ended without a commit (rollback or close)."""
+    if transaction.parent is None:
+        for path in session.info[NEW_FILES]:
+            remove_stored(path)
+        session.info[NEW_FILES].clear()
+
+
+def release_blob(session: Session, sha256: str):
+    session.exec(update(Blob).where(Blob.sha256 == sha256).values(refcount=Blob.refcount - 1))
+
+
+def collect_garbage(session: Session) -> int:
+    """Removes blobs nobody references any more and returns their number.
+
+    The rows are deleted and committed before the files are removed, so a failure leaves at
+    most a file without a row, never a row without its file. Each file is removed while the
+    session holds an uncommitted placeholder row for its sha256: an upload of the same content
+    that inserted its row in the meantime keeps the file, a later one waits and writes it again.
+    """
+    blobs = session.exec(select(Blob).where(Blob.refcount <= 0).with_for_update()).all()
+    sha256s = [blob.sha256 for blob in blobs]
+    for blob in blobs:
+        session.delete(blob)
+    session.commit()
+    for sha256 in sha256s:
+        try:
+            session.add(Blob(sha256=sha256, size=0, refcount=0))
+            session.flush()
+        except IntegrityError:
+            session.rollback()
+            continue
+        remove_stored(blob_path(sha256))
+        session.rollback()
+    return len(sha256s)
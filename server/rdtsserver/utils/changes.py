@@ -0,0 +1,45 @@
+import os
+import threading
+import time
+
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import ChangeCounter
+from server.rdtsserver.dependencies import engine
+
+
+def bump_change_counter(session: Session, name: str):
+    """Increments the counter `name` in the caller's transaction, so every worker sees the change."""
+    result = session.exec(update(ChangeCounter)
+                          .where(ChangeCounter.name == name)
+                          .values(version=ChangeCounter.version + 1))
+    if result.rowcount == 0:
+        session.add(ChangeCounter(name=name, version=1))
+
+
+class ChangeWatcher:
+    """Per-process view of the change counters, refreshed from the database at most every poll interval."""
+
+    def __init__(self):
+        self._versions: dict[str, int] = {}
+        self._polled_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def version(self, name: str) -> int:
+        self.poll()
+        return self._versions.get(name, 0)
+
+    def poll(self):
+        if time.monotonic() - self._polled_at < float(os.getenv("CHANGE_POLL_SECONDS", 1)):
+            return
+        with self._lock:
+            if time.monotonic() - self._polled_at < float(os.getenv("CHANGE_POLL_SECONDS", 1)):
+                return
+            with Session(engine) as session:
+                self._versions = {counter.name: counter.version
+                                  for counter in session.exec(select(ChangeCounter)).all()}
+            self._polled_at = time.monotonic()
+
+
+change_watcher = ChangeWatcher()
@@ -0,0 +1,151 @@
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Iterator
+
+from fastapi import Request, status
+from fastapi.responses import FileResponse, StreamingResponse, Response
+
+from server.rdtsserver.utils.storage import stored_path, iter_stored, open_stored, CHUNK_SIZE
+
+GZIP_ETAG_SUFFIX = "-gzip"
+
+
+def accepts_gzip(request: Request) -> bool:
+    encodings = request.headers.get("accept-encoding", "")
+    return any(encoding.split(";")[0].strip() in ("gzip", "*") for encoding in encodings.split(","))
+
+
+def stored_file_response(request: Request,
+                         file_path: str,
+                         filename: str,
+                         media_type: str,
+                         sha256: Optional[str] = None,
+                         size: Optional[int] = None,
+                         last_modified: Optional[datetime] = None) -> Response:
+    """Serves a file saved through utils.storage.
+
+    With a stored `sha256` the response carries a strong ETag and If-None-Match is answered
+    with 304 without touching the file; `last_modified` does the same for If-Modified-Since.
+    A single byte range of the original content is served with 206. Otherwise gzipped files
+    are sent as they are with Content-Encoding: gzip when the client accepts it, and
+    decompressed on the fly when it does not.
+    """
+    etag = f'"{sha256}"' if sha256 else None
+    headers = {"Accept-Ranges": "bytes"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+
+    if not_modified(request, etag, last_modified):
+        if etag:
+            headers["ETag"] = etag
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    path, compressed = stored_path(file_path)
+    if size is None and not compressed:
+        size = os.path.getsize(path)
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    byte_range = requested_range(request, etag, last_modified)
+    if byte_range is not None and size is not None:
+        if etag:
+            headers["ETag"] = etag
+        bounds = parse_range(byte_range, size)
+        if bounds is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+        start, end = bounds
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(iter_stored_range(file_path, start, end),
+                                 status_code=status.HTTP_206_PARTIAL_CONTENT,
+                                 headers=headers,
+                                 media_type=media_type)
+
+    if not compressed:
+        if etag:
+            headers["ETag"] = etag
+        return FileResponse(path=path, headers=headers, media_type=media_type)
+
+    headers["Vary"] = "Accept-Encoding"
+    if accepts_gzip(request):
+        if etag:
+            headers["ETag"] = f'"{sha256}{GZIP_ETAG_SUFFIX}"'
+        headers["Content-Encoding"] = "gzip"
+        return FileResponse(path=path, headers=headers, media_type=media_type)
+    if etag:
+        headers["ETag"] = etag
+    if size is not None:
+        headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_stored(file_path), headers=headers, media_type=media_type)
+
+
+def not_modified(request: Request, etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        tags = {tag.strip().removeprefix("W/").replace(GZIP_ETAG_SUFFIX + '"', '"')
+                for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).astimezone(timezone.utc).replace(tzinfo=None)
+            if last_modified.tzinfo is not None:
+                last_modified = last_modified.astimezone(timezone.utc).replace(tzinfo=None)
+            return last_modified.replace(microsecond=0) <= since
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def requested_range(request: Request, etag: Optional[str], last_modified: Optional[datetime]) -> Optional[str]:
+    """The Range header if it is a single byte range that applies to the current content.
+
+    Multiple ranges and ranges failing If-Range are ignored, so the whole file is sent.
+    """
+    byte_range = request.headers.get("range")
+    if byte_range is None or not byte_range.strip().startswith("bytes=") or "," in byte_range:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return byte_range
+    if if_range.startswith('"'):
+        return byte_range if etag is not None and if_range == etag else None
+    if last_modified is not None and if_range == http_date(last_modified):
+        return byte_range
+    return None
+
+
+def parse_range(byte_range: str, size: int) -> Optional[tuple[int, int]]:
+    """Inclusive bounds of a single "bytes=" range, or None if it cannot be satisfied."""
+    first, _, last = byte_range.partition("=")[2].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def iter_stored_range(file_path: str, start: int, end: int) -> Iterator[bytes]:
+    with open_stored(file_path) as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0 and (chunk := file.read(min(CHUNK_SIZE, remaining))):
+            remaining -= len(chunk)
+            yield chunk
+
+
+def http_date(timestamp: datetime) -> str:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return format_datetime(timestamp.replace(microsecond=0, tzinfo=timezone.utc), usegmt=True)
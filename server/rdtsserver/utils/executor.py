@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any
+
+from fastapi import HTTPException, status
+
+from server.rdtsserver.utils.metrics import registry, Counter, Gauge
+
+cpu_executor_calls = registry.register(Gauge(
+    "rdts_cpu_executor_calls", "Calls of the CPU executor by state.", ("state",)))
+cpu_executor_rejected = registry.register(Counter(
+    "rdts_cpu_executor_rejected_total", "Calls rejected with 503 because the CPU executor was full."))
+
+
+class CPUExecutor:
+    """Bounded pool for CPU-heavy work (bcrypt, large JSON parsing, compression).
+
+    Async handlers await `run` instead of doing such work on the event loop. When more than
+    `max_pending` calls are queued or running, new calls are rejected with 503.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rdts-cpu")
+        registry.collectors.append(self.collect)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                cpu_executor_rejected.inc()
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Server is busy, try again later",
+                                    headers={"Retry-After": "1"})
+            self.pending += 1
+        try:
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self._executor, context.run,
+                                                                    self._call, func, args, kwargs)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def _call(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "running": self.running,
+                "queued": self.pending - self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def collect(self):
+        stats = self.stats()
+        cpu_executor_calls.set(stats["queued"], state="queued")
+        cpu_executor_calls.set(stats["running"], state="running")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+cpu_executor = CPUExecutor(workers=int(os.getenv("CPU_EXECUTOR_WORKERS", os.cpu_count() or 1)),
+                           max_pending=int(os.getenv("CPU_EXECUTOR_MAX_PENDING", 64)))
@@ -0,0 +1,159 @@
+import io
+import os
+from datetime import datetime
+from enum import Enum
+from typing import Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import exists
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import CrystalState, CrystalStateTestsuiteresult, TestSuite, TestSuiteResult, \
+    ResultMetric
+from server.rdtsserver.dependencies import engine
+
+PARQUET = "parquet"
+ARROW = "arrow"
+MEDIA_TYPES = {PARQUET: "application/vnd.apache.parquet", ARROW: "application/vnd.apache.arrow.stream"}
+EXTENSIONS = {PARQUET: "parquet", ARROW: "arrows"}
+
+
+def export_batch_size() -> int:
+    return int(os.getenv("EXPORT_BATCH_SIZE", 10000))
+
+
+class ExportTable:
+    """Columns of one exported table: (name, SQL expression, Arrow type) triples and a primary-key order."""
+
+    def __init__(self, columns: list[tuple], order_by: list):
+        self.columns = columns
+        self.order_by = order_by
+        self.schema = pa.schema([(name, arrow_type) for name, _, arrow_type in columns])
+
+    def statement(self):
+        return select(*[column for _, column, _ in self.columns]).order_by(*self.order_by)
+
+
+EXPORT_TABLES = {
+    "crystalstates": ExportTable([("idx", CrystalState.idx, pa.int64()),
+                                  ("crystal_name", CrystalState.crystal_name, pa.string()),
+                                  ("assembly_name", CrystalState.assembly_name, pa.string()),
+                                  ("place", CrystalState.place, pa.int32()),
+                                  ("status", CrystalState.status, pa.string()),
+                                  ("timestamp", CrystalState.timestamp, pa.timestamp("s"))],
+                                 [CrystalState.idx]),
+    "testsuiteresults": ExportTable([("idx", TestSuiteResult.idx, pa.int64()),
+                                     ("testsuite_idx", TestSuiteResult.testsuite_idx, pa.int64()),
+                                     ("testsuite_name", TestSuite.name, pa.string()),
+                                     ("testsuite_version", TestSuite.version, pa.string()),
+                                     ("timestamp", TestSuiteResult.timestamp, pa.timestamp("s")),
+                                     ("result_sha256", TestSuiteResult.result_sha256, pa.string()),
+                                     ("result_size", TestSuiteResult.result_size, pa.int64()),
+                                     ("config_sha256", TestSuiteResult.config_sha256, pa.string()),
+                                     ("config_size", TestSuiteResult.config_size, pa.int64())],
+                                    [TestSuiteResult.idx]),
+    "links": ExportTable([("testsuiteresult_idx", CrystalStateTestsuiteresult.testsuiteresult_idx, pa.int64()),
+                          ("crystalstate_idx", CrystalStateTestsuiteresult.crystalstate_idx, pa.int64())],
+                         [CrystalStateTestsuiteresult.testsuiteresult_idx, CrystalStateTestsuiteresult.crystalstate_idx]),
+    "metrics": ExportTable([("testsuiteresult_idx", ResultMetric.testsuiteresult_idx, pa.int64()),
+                            ("testsuite_idx", ResultMetric.testsuite_idx, pa.int64()),
+                            ("crystal_name", ResultMetric.crystal_name, pa.string()),
+                            ("metric", ResultMetric.metric, pa.string()),
+                            ("timestamp", ResultMetric.timestamp, pa.timestamp("s")),
+                            ("value", ResultMetric.value, pa.float64())],
+                           [ResultMetric.testsuiteresult_idx, ResultMetric.crystal_name, ResultMetric.metric]),
+}
+
+
+def export_statement(table: str,
+                     testsuite_idx: Optional[int] = None,
+                     start: Optional[datetime] = None,
+                     end: Optional[datetime] = None):
+    """The query of an exported table restricted to a test suite and a period.
+
+    Results, their links and metrics are filtered by the result timestamp; crystal states by
+    their own timestamp and, with a test suite, to the states linked to results of that suite.
+    """
+    statement = EXPORT_TABLES[table].statement()
+    if table == "crystalstates":
+        if testsuite_idx is not None:
+            statement = statement.where(exists()
+                                        .where(CrystalStateTestsuiteresult.crystalstate_idx == CrystalState.idx)
+                                        .where(TestSuiteResult.idx == CrystalStateTestsuiteresult.testsuiteresult_idx)
+                                        .where(TestSuiteResult.testsuite_idx == testsuite_idx))
+        timestamp = CrystalState.timestamp
+    elif table == "metrics":
+        if testsuite_idx is not None:
+            statement = statement.where(ResultMetric.testsuite_idx == testsuite_idx)
+        timestamp = ResultMetric.timestamp
+    else:
+        if table == "testsuiteresults":
+            statement = statement.join(TestSuite, TestSuite.idx == TestSuiteResult.testsuite_idx)
+        else:
+            statement = statement.join(TestSuiteResult,
+                                       TestSuiteResult.idx == CrystalStateTestsuiteresult.testsuiteresult_idx)
+        if testsuite_idx is not None:
+            statement = statement.where(TestSuiteResult.testsuite_idx == testsuite_idx)
+        timestamp = TestSuiteResult.timestamp
+    if start is not None:
+        statement = statement.where(timestamp >= start)
+    if end is not None:
+        statement = statement.where(timestamp <= end)
+    return statement
+
+
+def record_batches(table: str, statement) -> Iterator[pa.RecordBatch]:
+    """Rows of `statement` fetched from a server-side cursor, EXPORT_BATCH_SIZE at a time."""
+    schema = EXPORT_TABLES[table].schema
+    with Session(engine) as session:
+        result = session.exec(statement.execution_options(yield_per=export_batch_size()))
+        for rows in result.partitions():
+            columns = zip(*rows)
+            yield pa.record_batch([pa.array([arrow_value(value) for value in values], type=field.type)
+                                   for values, field in zip(columns, schema)], schema=schema)
+
+
+def arrow_value(value):
+    return value.name if isinstance(value, Enum) else value
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file collecting what a writer produced since the last `drain`."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_export(table: str, export_format: str, statement) -> Iterator[bytes]:
+    """Encodes the rows of `statement` as a Parquet file or an Arrow IPC stream, batch by batch.
+
+    Every database batch becomes a Parquet row group or an Arrow record batch and is sent as
+    soon as it is encoded, so memory stays bounded by EXPORT_BATCH_SIZE whatever the table size.
+    """
+    schema = EXPORT_TABLES[table].schema
+    chunks = ChunkSink()
+    if export_format == PARQUET:
+        writer = pq.ParquetWriter(chunks, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(chunks, schema)
+    with writer:
+        for batch in record_batches(table, statement):
+            writer.write_batch(batch)
+            if data := chunks.drain():
+                yield data
+    if data := chunks.drain():
+        yield data
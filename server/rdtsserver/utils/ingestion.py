@@ -0,0 +1,242 @@
+import logging
+import os
+import queue
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from fastapi import HTTPException, UploadFile, status
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import IngestionJob, IngestionJobRead, IngestionStatus
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.utils.metrics import registry, Counter, Gauge
+from server.rdtsserver.utils.storage import save_upload
+
+STAGED_CONFIG = "config.json"
+STAGED_RESULT = "result.json"
+
+logger = logging.getLogger("rdtsserver.ingestion")
+
+ingestion_jobs = registry.register(Counter(
+    "rdts_ingestion_jobs_total", "Asynchronous result uploads by outcome.", ("status",)))
+ingestion_queue_depth = registry.register(Gauge(
+    "rdts_ingestion_queue_depth", "Accepted uploads of this process waiting for or being processed by a worker."))
+
+
+def staging_dir() -> str:
+    return os.getenv("INGESTION_STAGING_DIR", "/results/.staging")
+
+
+class IngestionQueue:
+    """Background workers creating test suite results from uploads staged on disk.
+
+    `submit` saves both files under INGESTION_STAGING_DIR, records a QUEUED job and returns
+    at once; a worker claims the job and runs `handler` with the staged files. The handler
+    adds the result to the session without committing it, and the worker commits it together
+    with the outcome in the job row, so any process can report it. When `max_pending` jobs of this
+    process are queued or running, new uploads are rejected with 503. Jobs still queued
+    when the server stops stay QUEUED and are picked up on the next start.
+
+    A worker holds a RUNNING job for `lease` seconds. Jobs RUNNING for longer were left by a
+    process that died while handling them; they are put back to QUEUED on start and whenever
+    a worker has been idle for `lease` seconds, so they are never stuck. The outcome is only
+    written while the job is still RUNNING with the `started` time its worker claimed it with;
+    a worker whose job was queued again in the meantime rolls its result back, so a job never
+    creates two results.
+    """
+
+    def __init__(self, handler: Callable[[Session, IngestionJob, UploadFile, UploadFile], int],
+                 workers: int, max_pending: int, lease: float):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lease = lease
+        self.pending = 0
+        self.rejected = 0
+        self._queue: queue.Queue[Optional[str]] = queue.Queue()
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        registry.collectors.append(lambda: ingestion_queue_depth.set(self.pending))
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [threading.Thread(target=self._work, name=f"rdts-ingestion-{number}", daemon=True)
+                             for number in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        self.requeue_expired()
+        with Session(engine) as session:
+            queued = session.exec(select(IngestionJob.idx)
+                                  .where(IngestionJob.status == IngestionStatus.QUEUED)
+                                  .order_by(IngestionJob.created)).all()
+        for job_idx in queued:
+            self._enqueue(job_idx)
+
+    def stop(self, timeout: float = 10):
+        """Lets the running jobs finish; queued ones are left for the next start."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        while True:
+            try:
+                if self._queue.get_nowait() is not None:
+                    self._release()
+            except queue.Empty:
+                break
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, session: Session, testsuite_idx: int, assembly_name: str, config: UploadFile,
+               result: UploadFile, timestamp: datetime) -> IngestionJob:
+        self.start()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Ingestion queue is full, try again later",
+                                    headers={"Retry-After": "5"})
+            self.pending += 1
+
+        job = IngestionJob(idx=uuid.uuid4().hex,
+                           status=IngestionStatus.QUEUED,
+                           testsuite_idx=testsuite_idx,
+                           assembly_name=assembly_name,
+                           timestamp=timestamp,
+                           created=datetime.now().replace(microsecond=0))
+        path = job_staging_path(job.idx)
+        try:
+            os.makedirs(path)
+            save_upload(config, f"{path}/{STAGED_CONFIG}")
+            save_upload(result, f"{path}/{STAGED_RESULT}")
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+        except BaseException:
+            self._release()
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        ingestion_jobs.inc(status=IngestionStatus.QUEUED.name)
+        self._queue.put(job.idx)
+        return job
+
+    def requeue_expired(self):
+        """Puts jobs RUNNING for longer than the lease back to QUEUED and into this process's queue."""
+        expired = datetime.now() - timedelta(seconds=self.lease)
+        with Session(engine) as session:
+            job_idxs = session.exec(select(IngestionJob.idx)
+                                    .where(IngestionJob.status == IngestionStatus.RUNNING)
+                                    .where(IngestionJob.started < expired)
+                                    .order_by(IngestionJob.created)).all()
+            requeued = []
+            for job_idx in job_idxs:
+                if session.exec(update(IngestionJob)
+                                .where(IngestionJob.idx == job_idx)
+                                .where(IngestionJob.status == IngestionStatus.RUNNING)
+                                .where(IngestionJob.started < expired)
+                                .values(status=IngestionStatus.QUEUED, started=None)).rowcount:
+                    requeued.append(job_idx)
+            session.commit()
+        for job_idx in requeued:
+            logger.warning("Ingestion job %s outlived its lease, queued again", job_idx)
+            self._enqueue(job_idx)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"workers": len(self._threads), "max_pending": self.max_pending,
+                    "pending": self.pending, "rejected": self.rejected}
+
+    def _enqueue(self, job_idx: str):
+        with self._lock:
+            self.pending += 1
+        self._queue.put(job_idx)
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def _work(self):
+        while True:
+            try:
+                job_idx = self._queue.get(timeout=self.lease)
+            except queue.Empty:
+                try:
+                    self.requeue_expired()
+                except Exception:
+                    logger.exception("Requeueing expired ingestion jobs failed")
+                continue
+            if job_idx is None:
+                break
+            try:
+                self.process(job_idx)
+            except Exception:
+                logger.exception("Ingestion job %s failed", job_idx)
+            finally:
+                self._release()
+
+    def process(self, job_idx: str):
+        with Session(engine) as session:
+            started = datetime.now().replace(microsecond=0)
+            claimed = session.exec(update(IngestionJob)
+                                   .where(IngestionJob.idx == job_idx)
+                                   .where(IngestionJob.status == IngestionStatus.QUEUED)
+                                   .values(status=IngestionStatus.RUNNING, started=started)).rowcount
+            session.commit()
+            if not claimed:
+                return
+
+            job = session.get(IngestionJob, job_idx)
+            path = job_staging_path(job_idx)
+            outcome, error, testsuiteresult_idx = IngestionStatus.DONE, None, None
+            try:
+                with open(f"{path}/{STAGED_CONFIG}", "rb") as config, open(f"{path}/{STAGED_RESULT}", "rb") as result:
+                    testsuiteresult_idx = self.handler(session, job, UploadFile(file=config), UploadFile(file=result))
+            except HTTPException as exception:
+                outcome, error = IngestionStatus.FAILED, str(exception.detail)
+            except Exception as exception:
+                logger.exception("Ingestion job %s failed", job_idx)
+                outcome, error = IngestionStatus.FAILED, str(exception)
+            if error is not None:
+                session.rollback()
+
+            finished = session.exec(update(IngestionJob)
+                                    .where(IngestionJob.idx == job_idx)
+                                    .where(IngestionJob.status == IngestionStatus.RUNNING)
+                                    .where(IngestionJob.started == started)
+                                    .values(status=outcome,
+                                            error=error,
+                                            testsuiteresult_idx=testsuiteresult_idx,
+                                            finished=datetime.now().replace(microsecond=0))).rowcount
+            if not finished:
+                session.rollback()
+                logger.warning("Ingestion job %s was queued again while running, its outcome is discarded", job_idx)
+                return
+            session.commit()
+            shutil.rmtree(path, ignore_errors=True)
+            ingestion_jobs.inc(status=outcome.name)
+
+
+def job_staging_path(job_idx: str) -> str:
+    return f"{staging_dir()}/{job_idx}"
+
+
+def read_job(job: IngestionJob) -> IngestionJobRead:
+    def format_time(timestamp: Optional[datetime]) -> Optional[str]:
+        return timestamp.strftime("%Y-%m-%d %H:%M:%S") if timestamp is not None else None
+
+    return IngestionJobRead(idx=job.idx,
+                            status=job.status,
+                            testsuite_idx=job.testsuite_idx,
+                            assembly_name=job.assembly_name,
+                            timestamp=format_time(job.timestamp),
+                            created=format_time(job.created),
+                            started=format_time(job.started),
+                            finished=format_time(job.finished),
+                            testsuiteresult_idx=job.testsuiteresult_idx,
+                            error=job.error)
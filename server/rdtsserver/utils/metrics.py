@@ -0,0 +1,302 @@
+import hashlib
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+from server.rdtsserver.utils.querystats import record_statement
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+MAX_FINGERPRINTS = 500
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Metric:
+    """Labelled metric of this process, rendered in the Prometheus text format."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels_of(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in sorted(values):
+            lines.extend(self.render_value(labels, value))
+        return lines
+
+    def render_value(self, labels: tuple[str, ...], value) -> list[str]:
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_number(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.labels_of(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.labels_of(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        key = self.labels_of(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels: str):
+        key = self.labels_of(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render_value(self, labels: tuple[str, ...], value) -> list[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            bucket_labels = format_labels(self.labelnames + ("le",), labels + (format_number(bound),))
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_number(total)}")
+        lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        self.collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Runs the collectors, which refresh gauges read from other objects, and renders everything."""
+        for collector in self.collectors:
+            collector()
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Histogram(
+    "rdts_http_request_duration_seconds", "Time spent handling HTTP requests.",
+    ("version", "method", "route", "status")))
+http_in_flight = registry.register(Gauge(
+    "rdts_http_requests_in_flight", "HTTP requests being handled right now.", ("version",)))
+http_received_bytes = registry.register(Counter(
+    "rdts_http_request_bytes_total", "Bytes of request bodies, uploads included.", ("version", "method", "route")))
+http_sent_bytes = registry.register(Counter(
+    "rdts_http_response_bytes_total", "Bytes of response bodies, downloads included.", ("version", "method", "route")))
+sql_statements = registry.register(Histogram(
+    "rdts_sql_statement_duration_seconds", "Time spent executing SQL statements.",
+    ("engine", "operation", "fingerprint"), SQL_BUCKETS))
+sql_fingerprints = registry.register(Gauge(
+    "rdts_sql_statement_info", "Normalized text of every SQL fingerprint.", ("fingerprint", "statement")))
+pool_checkout_wait = registry.register(Histogram(
+    "rdts_db_pool_checkout_wait_seconds", "Time spent checking out a pooled database connection.",
+    ("engine",), SQL_BUCKETS))
+pool_connections = registry.register(Gauge(
+    "rdts_db_pool_connections", "Connections of the database pool by state.", ("engine", "state")))
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ================= HTTP =================
+
+class MetricsMiddleware:
+    """Records latency, in-flight requests and body sizes per API version and route template.
+
+    The route is the path template of the endpoint that handled the request, found through the
+    (sub-)application it was routed to, so path parameters do not multiply label values.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        version = mount_of(scope["path"])
+        method = scope["method"]
+        received = 0
+        sent = 0
+        status_code = 500
+
+        async def counting_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message: Message):
+            nonlocal sent, status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc(version=version)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            http_in_flight.dec(version=version)
+            route = route_of(scope)
+            http_requests.observe(time.perf_counter() - started,
+                                  version=version, method=method, route=route, status=str(status_code))
+            if received:
+                http_received_bytes.inc(received, version=version, method=method, route=route)
+            if sent:
+                http_sent_bytes.inc(sent, version=version, method=method, route=route)
+
+
+def mount_of(path: str) -> str:
+    """API version a path belongs to, e.g. "v1.0.2", or "" for the main application."""
+    first = path.lstrip("/").split("/", 1)[0]
+    return first if re.fullmatch(r"v\d+(\.\d+)*", first) else ""
+
+
+def route_of(scope: Scope) -> str:
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is None or app is None:
+        return "unmatched"
+    for route in getattr(getattr(app, "router", None), "routes", ()):
+        if getattr(route, "endpoint", None) is endpoint:
+            return route.path
+    return "unmatched"
+
+
+# ================= Database =================
+
+def fingerprint(statement: str) -> tuple[str, str, str]:
+    """Operation, short hash and normalized text of a statement with literals and parameters removed."""
+    normalized = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    normalized = re.sub(r"%\(\w+\)s|\$\d+|\b\d+(\.\d+)?\b", "?", normalized)
+    normalized = re.sub(r"\(\s*\?(\s*,\s*\?)*\s*\)", "(?)", normalized)
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    operation = normalized.split(" ", 1)[0].upper() if normalized else ""
+    return operation, hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+
+def instrument_engine(engine: Engine, name: str):
+    """Times every statement executed through `engine`, also for per-request query stats, and reports its pool state."""
+    known_fingerprints: dict[str, tuple[str, str]] = {}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("rdts_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info["rdts_started"].pop()
+        record_statement(elapsed)
+        labels = known_fingerprints.get(statement)
+        if labels is None:
+            operation, digest, normalized = fingerprint(statement)
+            if len(known_fingerprints) >= MAX_FINGERPRINTS:
+                labels = (operation, "other")
+            else:
+                labels = known_fingerprints[statement] = (operation, digest)
+                sql_fingerprints.set(1, fingerprint=digest, statement=normalized[:500])
+        sql_statements.observe(elapsed, engine=name, operation=labels[0], fingerprint=labels[1])
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("rdts_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+    def collect_pool():
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            pool_connections.set(pool.size(), engine=name, state="size")
+            pool_connections.set(pool.checkedout(), engine=name, state="checked_out")
+            pool_connections.set(pool.checkedin(), engine=name, state="idle")
+            pool_connections.set(max(pool.overflow(), 0), engine=name, state="overflow")
+
+    registry.collectors.append(collect_pool)
+
+
+class CheckoutTimer:
+    """Pool mixin that records how long checkouts take, waiting for a free connection included.
+
+    Times the public `Pool.connect`, through which the engine checks out every connection.
+    """
+
+    metrics_name = ""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - started, engine=self.metrics_name)
+
+
+class TimedQueuePool(CheckoutTimer, QueuePool):
+    metrics_name = "sync"
+
+
+class TimedAsyncQueuePool(CheckoutTimer, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+def timed_pool_class(url: str, is_async: bool) -> Optional[type]:
+    if url.startswith("sqlite"):
+        return None
+    return TimedAsyncQueuePool if is_async else TimedQueuePool
@@ -0,0 +1,76 @@
+import base64
+import json
+from datetime import datetime
+from typing import Callable, Optional, Sequence, Any
+
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import DateTime, tuple_
+from sqlmodel import Session
+
+from server.rdtsserver.dependencies import engine
+
+STREAM_BATCH_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, key_columns: Sequence) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(key_columns):
+            raise ValueError(cursor)
+        return [datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+                for value, column in zip(values, key_columns)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor}!")
+
+
+def keyset(statement, key_columns: Sequence, limit: Optional[int] = None, after: Optional[str] = None):
+    """Orders `statement` by `key_columns` and restricts it to the page that follows cursor `after`."""
+    if after is not None:
+        statement = statement.where(tuple_(*key_columns) > tuple_(*decode_cursor(after, key_columns)))
+    statement = statement.order_by(*key_columns)
+    if limit is not None:
+        if limit <= 0:
+            raise HTTPException(status_code=400, detail="Limit must be positive!")
+        statement = statement.limit(limit)
+    return statement
+
+
+def read_page(session: Session,
+              statement,
+              key_columns: Sequence,
+              cursor_of: Callable[[Any], Sequence[Any]],
+              to_models: Callable[[Session, list], list],
+              response: Response,
+              limit: Optional[int] = None,
+              after: Optional[str] = None,
+              stream: bool = False):
+    """Runs a list query page by page.
+
+    Without `stream` the page is read with the request session, returned as a list and the
+    cursor of the next page is put into the X-Next-Cursor header. With `stream` rows are fetched
+    from a server-side cursor of a session owned by the response and sent as NDJSON while they
+    arrive.
+    """
+    statement = keyset(statement, key_columns, limit, after)
+    if stream:
+        return StreamingResponse(stream_ndjson(statement, to_models), media_type="application/x-ndjson")
+
+    rows = session.exec(statement).all()
+    if limit is not None and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(cursor_of(rows[-1]))
+    return to_models(session, rows)
+
+
+def stream_ndjson(statement, to_models: Callable[[Session, list], list]):
+    with Session(engine) as session:
+        result = session.exec(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+        for rows in result.partitions():
+            for model in to_models(session, rows):
+                yield model.model_dump_json() + "\n"
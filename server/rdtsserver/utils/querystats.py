@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+DB_TIME_HEADER = "X-DB-Time"
+SESSION_COUNT_HEADER = "X-Session-Count"
+
+logger = logging.getLogger("rdtsserver.queries")
+
+
+@dataclass
+class QueryStats:
+    queries: int = 0
+    sessions: int = 0
+    db_time: float = 0.0
+
+
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_stats", default=None)
+_budgets: list[QueryStats] = []
+_budgets_lock = threading.Lock()
+
+
+def record_statement(elapsed: float):
+    """Called for every executed statement; charges it to the current request and to active budgets."""
+    for stats in active_stats():
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+@event.listens_for(Session, "after_begin")
+def record_session(session, transaction, connection):
+    for stats in active_stats():
+        stats.sessions += 1
+
+
+def active_stats() -> list[QueryStats]:
+    stats = current_stats.get()
+    with _budgets_lock:
+        budgets = list(_budgets)
+    return budgets + [stats] if stats is not None else budgets
+
+
+def headers_enabled() -> bool:
+    return os.getenv("QUERY_STATS_HEADERS", "false").strip().lower() == "true"
+
+
+class QueryStatsMiddleware:
+    """Counts statements, sessions and DB time of every request.
+
+    With QUERY_STATS_HEADERS the numbers are sent as X-Query-Count, X-Session-Count and
+    X-DB-Time (milliseconds) headers. One JSON log line is written per request; requests
+    issuing more than QUERY_COUNT_WARN statements are logged as warnings.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        add_headers = headers_enabled()
+        status_code = 500
+
+        async def send_with_stats(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if add_headers:
+                    headers = MutableHeaders(scope=message)
+                    headers[QUERY_COUNT_HEADER] = str(stats.queries)
+                    headers[SESSION_COUNT_HEADER] = str(stats.sessions)
+                    headers[DB_TIME_HEADER] = f"{stats.db_time * 1000:.1f}"
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_stats.reset(token)
+            log_request(scope, status_code, stats, time.perf_counter() - started)
+
+
+def log_request(scope: Scope, status_code: int, stats: QueryStats, elapsed: float):
+    level = logging.WARNING if stats.queries > int(os.getenv("QUERY_COUNT_WARN", 50)) else logging.INFO
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, json.dumps({"method": scope["method"],
+                                  "path": scope["path"],
+                                  "status": status_code,
+                                  "queries": stats.queries,
+                                  "sessions": stats.sessions,
+                                  "db_time_ms": round(stats.db_time * 1000, 1),
+                                  "time_ms": round(elapsed * 1000, 1)}))
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Counts statements executed inside the block in every thread, TestClient requests included."""
+    stats = QueryStats()
+    with _budgets_lock:
+        _budgets.append(stats)
+    try:
+        yield stats
+    finally:
+        with _budgets_lock:
+            _budgets.remove(stats)
+
+
+@contextmanager
+def assert_max_queries(budget: int) -> Iterator[QueryStats]:
+    """Test helper: fails when more than `budget` statements run inside the block.
+
+        with assert_max_queries(3):
+            client.get("/v1.0.2/assemblies")
+    """
+    with track_queries() as stats:
+        yield stats
+    if stats.queries > budget:
+        raise AssertionError(f"Expected at most {budget} queries, {stats.queries} were executed")
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import threading
+from typing import Any, Callable
+
+from fastapi import Request, Response, status
+from pydantic_core import to_json
+from sqlalchemy import event
+from sqlmodel import Session
+
+from server.rdtsserver.utils.cache import TTLCache
+from server.rdtsserver.utils.changes import bump_change_counter, change_watcher
+from server.rdtsserver.utils.downloads import not_modified
+from server.rdtsserver.utils.metrics import registry, Counter, Gauge
+
+ASSEMBLIES = "assemblies"
+CRYSTALS = "crystals"
+TESTSUITES = "testsuites"
+
+cache_requests = registry.register(Counter(
+    "rdts_response_cache_requests_total", "Lookups of the response cache by scope and result.", ("scope", "result")))
+cache_entries = registry.register(Gauge(
+    "rdts_response_cache_entries", "Responses held by the response cache."))
+
+
+class ResponseCache:
+    """Serialized JSON responses of read-mostly list endpoints.
+
+    Entries are keyed by scope, path and query string and remember the scope version they
+    were built at: the local generation, bumped when a writer of this process commits, and
+    the scope's change counter, which other processes see after CHANGE_POLL_SECONDS. A
+    response built while a write commits keeps the old version and is never served.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize, ttl)
+        self.generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def version(self, scope: str) -> tuple[int, int]:
+        return self.generations.get(scope, 0), change_watcher.version(counter_name(scope))
+
+    def get(self, key: tuple, version: tuple[int, int]):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1:]
+
+    def set(self, key: tuple, version: tuple[int, int], etag: str, body: bytes, headers: dict[str, str]):
+        self.entries.set(key, (version, etag, body, headers))
+
+    def expire(self, scopes: tuple[str, ...]):
+        with self._lock:
+            for scope in scopes:
+                self.generations[scope] = self.generations.get(scope, 0) + 1
+        self.entries.pop_where(lambda key, entry: key[0] in scopes)
+
+
+response_cache = ResponseCache(maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", 256)),
+                               ttl=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 60)))
+registry.collectors.append(lambda: cache_entries.set(len(response_cache.entries)))
+
+
+def counter_name(scope: str) -> str:
+    return f"responses.{scope}"
+
+
+def invalidate_responses(session: Session, *scopes: str):
+    """Bumps the change counters of `scopes` in the caller's transaction and drops them here once it commits."""
+    for scope in scopes:
+        bump_change_counter(session, counter_name(scope))
+    event.listen(session, "after_commit", lambda committed: response_cache.expire(scopes), once=True)
+
+
+def cached_response(request: Request, response: Response, scope: str, produce: Callable[[], Any]) -> Response:
+    """Serves a GET endpoint from the response cache.
+
+    `produce` builds the content on a miss; headers it sets on `response` (X-Next-Cursor) are
+    cached with the body, and a Response it returns (NDJSON streams) is passed through uncached.
+    The body gets a weak ETag and a matching If-None-Match is answered with 304.
+    """
+    key = (scope, request.url.path, tuple(sorted(request.query_params.multi_items())))
+    version = response_cache.version(scope)
+    entry = response_cache.get(key, version)
+    if entry is not None:
+        cache_requests.inc(scope=scope, result="hit")
+        etag, body, headers = entry
+    else:
+        content = produce()
+        if isinstance(content, Response):
+            return content
+        cache_requests.inc(scope=scope, result="miss")
+        body = to_json(content)
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+        response_cache.set(key, version, etag, body, headers)
+
+    headers = {**headers, "ETag": f"W/{etag}", "Cache-Control": "no-cache"}
+    if not_modified(request, etag, None):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,13 +1,16 @@
 import os
 from datetime import timedelta, datetime, timezone
-from typing import Annotated
+from typing import Annotated, Optional
 
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event
 from starlette import status
 
 from server.rdtsserver.db.tables import User
-from server.rdtsserver.dependencies import engine
+from server.rdtsserver.dependencies import SessionDep, AsyncSessionDep
+from server.rdtsserver.utils.cache import TTLCache
+from server.rdtsserver.utils.changes import bump_change_counter, change_watcher
 from sqlmodel import Session, select
 from passlib.context import CryptContext
 from jose import JWTError, jwt
@@ -16,6 +19,60 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/sign-in")
 
+AUTH_CHANGES = "auth"
+
+
+class AuthCache:
+    """Verified access tokens and user roles of this process.
+
+    Entries live at most AUTH_CACHE_TTL_SECONDS and never longer than the token itself. The
+    whole cache is dropped when another process bumps the "auth" change counter.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.tokens = TTLCache(maxsize, ttl)
+        self.roles = TTLCache(maxsize, ttl)
+        self.version = None
+
+    def sync(self):
+        version = change_watcher.version(AUTH_CHANGES)
+        if version != self.version:
+            self.tokens.clear()
+            self.roles.clear()
+            self.version = version
+
+    def login(self, token: str) -> Optional[str]:
+        self.sync()
+        return self.tokens.get(token)
+
+    def role(self, login: str) -> Optional[int]:
+        self.sync()
+        return self.roles.get(login)
+
+    def put(self, token: str, login: str, role: int, expires_at: float):
+        ttl = expires_at - datetime.now(timezone.utc).timestamp()
+        if ttl > 0:
+            self.tokens.set(token, login, ttl)
+            self.roles.set(login, role, ttl)
+
+    def invalidate(self, login: str):
+        self.tokens.pop_where(lambda token, token_login: token_login == login)
+        self.roles.pop(login)
+
+
+auth_cache = AuthCache(maxsize=int(os.getenv("AUTH_CACHE_SIZE", 1024)),
+                       ttl=float(os.getenv("AUTH_CACHE_TTL_SECONDS", 60)))
+
+
+def invalidate_user_auth(session: Session, login: str):
+    """Drops cached tokens of `login` here and, through the change counter, in every other process.
+
+    The local entries are dropped once the caller's transaction commits, so a request running
+    in between cannot cache the old role or token again.
+    """
+    bump_change_counter(session, AUTH_CHANGES)
+    event.listen(session, "after_commit", lambda committed: auth_cache.invalidate(login), once=True)
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -25,16 +82,15 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-def get_user(login: str):
-    with Session(engine) as session:
-        user: User = session.exec(select(User).where(User.login == login)).one_or_none()
-        if user is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Not enough rights")
-        return user
+def get_user(session: Session, login: str):
+    user: User = session.exec(select(User).where(User.login == login)).one_or_none()
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Not enough rights")
+    return user
 
 
-def authenticate_user(login: str, password: str):
-    user = get_user(login)
+def authenticate_user(session: Session, login: str, password: str):
+    user = get_user(session, login)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
@@ -64,19 +120,33 @@ def create_refresh_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def validate_access_token(token: Annotated[str, Depends(oauth2_scheme)]):
+def validate_access_token(token: Annotated[str, Depends(oauth2_scheme)], session: SessionDep):
+    return access_token_login(session, token)
+
+
+async def validate_access_token_async(token: Annotated[str, Depends(oauth2_scheme)], session: AsyncSessionDep):
+    """`validate_access_token` for async routes: a user lookup runs on the route's own async session."""
+    return await session.run_sync(access_token_login, token)
+
+
+def access_token_login(session: Session, token: str):
     credential_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid token"
     )
 
+    login = auth_cache.login(token)
+    if login is not None:
+        return login
+
     try:
         payload = jwt.decode(token, os.getenv("ACCESS_TOKEN_SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
         if payload['scope'] != "access_token" or payload['sub'] is None:
             raise credential_exception
-        user = get_user(payload['sub'])
+        user = get_user(session, payload['sub'])
         if user.access_token != token:
             raise credential_exception
+        auth_cache.put(token, user.login, user.role, payload['exp'])
     except JWTError as jwt_error:
         message = str(jwt_error.args[0])
         raise HTTPException(
@@ -86,7 +156,7 @@ def validate_access_token(token: Annotated[str, Depends(oauth2_scheme)]):
     return payload['sub']
 
 
-def validate_refresh_token(token: Annotated[str, Depends(oauth2_scheme)]):
+def validate_refresh_token(token: Annotated[str, Depends(oauth2_scheme)], session: SessionDep):
     credential_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid token"
@@ -96,7 +166,7 @@ def validate_refresh_token(token: Annotated[str, Depends(oauth2_scheme)]):
         payload = jwt.decode(token, os.getenv("REFRESH_TOKEN_SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
         if payload['scope'] != "refresh_token" or payload['sub'] is None:
             raise credential_exception
-        user = get_user(payload['sub'])
+        user = get_user(session, payload['sub'])
         if user.refresh_token != token:
             raise credential_exception
     except JWTError:
@@ -104,8 +174,10 @@ def validate_refresh_token(token: Annotated[str, Depends(oauth2_scheme)]):
     return payload['sub']
 
 
-def check_role(user_login: str, role_idxs: list[int]):
-    user = get_user(user_login)
-    if user.role not in role_idxs:
+def check_role(session: Session, user_login: str, role_idxs: list[int]):
+    role = auth_cache.role(user_login)
+    if role is None:
+        role = get_user(session, user_login).role
+    if role not in role_idxs:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"User {user_login} doesn't have needed role!")
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Iterator
+
+from fastapi import UploadFile
+
+CHUNK_SIZE = 1024 * 1024
+FILE_MODE = 0o644
+GZIP_SUFFIX = ".gz"
+BLOBS_DIR = "/blobs"
+
+
+def results_compression_enabled() -> bool:
+    return os.getenv("RESULTS_COMPRESSION", "none").strip().lower() == "gzip"
+
+
+def blob_path(sha256: str) -> str:
+    return f"{BLOBS_DIR}/{sha256[:2]}/{sha256}"
+
+
+def hash_upload(file: UploadFile) -> tuple[str, int]:
+    """sha256 and size of an upload, read in chunks; the upload is rewound afterwards."""
+    sha256 = hashlib.sha256()
+    size = 0
+    while chunk := file.file.read(CHUNK_SIZE):
+        sha256.update(chunk)
+        size += len(chunk)
+    file.file.seek(0)
+    return sha256.hexdigest(), size
+
+
+def save_upload(file: UploadFile, file_path: str, compress: bool = False) -> tuple[str, int]:
+    """Copies an upload to `file_path` in fixed-size chunks and returns its sha256 and size.
+
+    The data is written to a temporary file in the same directory which is atomically renamed,
+    so readers never see a partially written file. With `compress` the file is stored gzipped
+    as `file_path` + ".gz"; the digest and size always describe the original content.
+    """
+    if compress:
+        file_path += GZIP_SUFFIX
+    sha256 = hashlib.sha256()
+    size = 0
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".upload-")
+    try:
+        with os.fdopen(descriptor, "wb") as raw_file, \
+                (gzip.GzipFile(fileobj=raw_file, mode="wb") if compress else raw_file) as temp_file:
+            while chunk := file.file.read(CHUNK_SIZE):
+                sha256.update(chunk)
+                size += len(chunk)
+                temp_file.write(chunk)
+        os.chmod(temp_path, FILE_MODE)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return sha256.hexdigest(), size
+
+
+def stored_path(file_path: str) -> tuple[str, bool]:
+    """Path under which `file_path` is actually stored and whether it is gzipped."""
+    if os.path.exists(file_path + GZIP_SUFFIX):
+        return file_path + GZIP_SUFFIX, True
+    return file_path, False
+
+
+def open_stored(file_path: str) -> BinaryIO:
+    """Opens a stored file for reading its original content, decompressing it if needed."""
+    path, compressed = stored_path(file_path)
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def stored_size(file_path: str) -> int:
+    """Size of the original content of a stored file; for a gzipped file it is read from the gzip trailer."""
+    path, compressed = stored_path(file_path)
+    if not compressed:
+        return os.path.getsize(path)
+    with open(path, "rb") as file:
+        file.seek(-4, os.SEEK_END)
+        return int.from_bytes(file.read(4), "little")
+
+
+def iter_stored(file_path: str) -> Iterator[bytes]:
+    with open_stored(file_path) as file:
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+def remove_stored(file_path: str):
+    for path in (file_path, file_path + GZIP_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def compress_stored(file_path: str) -> bool:
+    """Replaces a plain stored file with its gzipped copy. Returns False if there was nothing to do."""
+    if not os.path.exists(file_path) or os.path.exists(file_path + GZIP_SUFFIX):
+        return False
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".compress-")
+    try:
+        with open(file_path, "rb") as source, os.fdopen(descriptor, "wb") as raw_file, \
+                gzip.GzipFile(fileobj=raw_file, mode="wb") as target:
+            while chunk := source.read(CHUNK_SIZE):
+                target.write(chunk)
+        os.chmod(temp_path, FILE_MODE)
+        os.replace(temp_path, file_path + GZIP_SUFFIX)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.remove(file_path)
+    return True
@@ -1,7 +1,7 @@
 from fastapi import FastAPI, Depends
 from server.rdtsserver.dependencies import get_session
 
-from server.rdtsserver.routers import assemblies, crystals, crystalstates, testsuites, testsuiteresults, auth
+from server.rdtsserver.routers import assemblies, crystals, crystalstates, testsuites, testsuiteresults, auth, exports
 
 app_1_0_2 = FastAPI(version="1.0.2")
 app_1_0_2.include_router(assemblies.router,
@@ -24,6 +24,10 @@ app_1_0_2.include_router(testsuiteresults.router,
                    prefix="/testsuiteresults",
                    tags=["testsuiteresults"],
                    dependencies=[Depends(get_session)])
+app_1_0_2.include_router(exports.router,
+                   prefix="/export",
+                   tags=["export"],
+                   dependencies=[Depends(get_session)])
 app_1_0_2.include_router(auth.router,
                    prefix="/auth",
                    tags=["auth"],
@@ -0,0 +1,120 @@
+# ruff: noqa: E402
+# Модули сервера читают настройки при импорте, поэтому окружение задается до их импорта
+import os
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="rdts-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATA_DIR}/rdts.db"
+os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{DATA_DIR}/rdts.db"
+os.environ["INGESTION_STAGING_DIR"] = f"{DATA_DIR}/staging"
+os.environ["CHANGE_POLL_SECONDS"] = "0"
+
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+from sqlmodel import Session
+
+from server.rdtsserver.db.tables import RDTSDatabase, Role, RoleName, TestSuite, User
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.main import main_app
+from server.rdtsserver.scripts.generate_data import create_schema
+from server.rdtsserver.utils import storage
+from server.rdtsserver.utils.responsecache import response_cache
+from server.rdtsserver.utils.security import validate_access_token, validate_access_token_async, auth_cache, \
+    get_password_hash
+from server.rdtsserver.versions.v1.v1_0_2 import app_1_0_2
+
+API = "/v1.0.2"
+LOGIN = "admin"
+PASSWORD = "admin-password"
+# Файлы сервера лежат в /testsuites, /results и /blobs, в тестах эти каталоги переносятся в DATA_DIR
+STORAGE_DIRS = tuple(f"{DATA_DIR}/{name}" for name in ("testsuites", "results", "blobs"))
+
+create_schema(engine)
+PASSWORD_HASH = get_password_hash(PASSWORD)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+def in_data_dir(path: str) -> str:
+    return path if path.startswith(DATA_DIR) else DATA_DIR + path
+
+
+def stored_files() -> set[str]:
+    return {os.path.join(directory, name)
+            for storage_dir in STORAGE_DIRS
+            for directory, _, filenames in os.walk(storage_dir)
+            for name in filenames}
+
+
+@pytest.fixture(autouse=True)
+def storage_dirs(monkeypatch):
+    """Empty storage directories under DATA_DIR for every test."""
+    path, results_path = TestSuite.path.fget, TestSuite.results_path.fget
+    monkeypatch.setattr(TestSuite, "path", property(lambda testsuite: in_data_dir(path(testsuite))))
+    monkeypatch.setattr(TestSuite, "results_path", property(lambda testsuite: in_data_dir(results_path(testsuite))))
+    monkeypatch.setattr(storage, "BLOBS_DIR", in_data_dir(storage.BLOBS_DIR))
+    for storage_dir in STORAGE_DIRS:
+        os.makedirs(storage_dir)
+    yield
+    for storage_dir in STORAGE_DIRS:
+        shutil.rmtree(storage_dir)
+
+
+@pytest.fixture(autouse=True)
+def database():
+    """Empty tables with an admin user and empty per-process caches for every test."""
+    with Session(engine) as session:
+        for table in reversed(RDTSDatabase.metadata.sorted_tables):
+            session.exec(delete(table))
+        session.add(Role(idx=1, name=RoleName.ADMIN))
+        session.add(User(login=LOGIN, hashed_password=PASSWORD_HASH, role=1))
+        session.commit()
+    response_cache.entries.clear()
+    response_cache.generations.clear()
+    auth_cache.tokens.clear()
+    auth_cache.roles.clear()
+    auth_cache.version = None
+
+
+@pytest.fixture
+def client():
+    """Client of the whole server with access checks of v1.0.2 passed as the admin."""
+    app_1_0_2.dependency_overrides[validate_access_token] = lambda: LOGIN
+    app_1_0_2.dependency_overrides[validate_access_token_async] = lambda: LOGIN
+    yield TestClient(main_app)
+    app_1_0_2.dependency_overrides.clear()
+
+
+@pytest.fixture
+def anonymous_client():
+    """Client that has to sign in like a real user."""
+    return TestClient(main_app)
+
+
+def create_assembly(client: TestClient, name: str, crystals: list[str], timestamp: str = "2024-01-01 10:00:00") -> str:
+    response = client.post(f"{API}/assemblies", json={"name": name, "crystals": crystals, "timestamp": timestamp})
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def create_testsuite(client: TestClient, name: str = "TS", version: str = "1", content: bytes = b"zip") -> int:
+    response = client.post(f"{API}/testsuites", params={"name": name, "version": version},
+                           files={"zip_file": ("testsuite.zip", content)})
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def create_testsuiteresult(client: TestClient, testsuite_idx: int, assembly_name: str,
+                           result: bytes = b'{"ly": 1.0}', config: bytes = b'{"threshold": 1}',
+                           timestamp: str = "2024-02-0110:00:00") -> int:
+    response = client.post(f"{API}/testsuiteresults",
+                           params={"testsuite_idx": testsuite_idx, "assembly_name": assembly_name,
+                                   "timestamp": timestamp},
+                           files={"config": ("config.json", config), "result": ("result.json", result)})
+    assert response.status_code == 201, response.text
+    return response.json()
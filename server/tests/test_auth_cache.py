@@ -0,0 +1,89 @@
+import pytest
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import User
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.utils.changes import bump_change_counter
+from server.rdtsserver.utils.querystats import track_queries
+from server.rdtsserver.utils.security import auth_cache, invalidate_user_auth, AUTH_CHANGES
+from server.tests.conftest import API, LOGIN, PASSWORD
+
+
+def sign_in(client, login: str = LOGIN, password: str = PASSWORD) -> dict[str, str]:
+    response = client.post(f"{API}/auth/sign-in", data={"username": login, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_verified_token_is_cached(anonymous_client):
+    headers = sign_in(anonymous_client)
+
+    assert anonymous_client.get(f"{API}/crystals", headers=headers).status_code == 200
+
+    assert auth_cache.tokens.get(headers["Authorization"].removeprefix("Bearer ")) == LOGIN
+
+
+def test_wrong_password_is_rejected(anonymous_client):
+    response = anonymous_client.post(f"{API}/auth/sign-in", data={"username": LOGIN, "password": "wrong"})
+
+    assert response.status_code == 401
+
+
+def test_signed_up_user_can_sign_in(anonymous_client):
+    headers = sign_in(anonymous_client)
+    response = anonymous_client.post(f"{API}/auth/sign-up", headers=headers,
+                                     json={"login": "engineer", "password": "secret", "role": 1})
+    assert response.status_code == 201, response.text
+
+    assert anonymous_client.get(f"{API}/crystals", headers=sign_in(anonymous_client, "engineer", "secret")).status_code == 200
+
+
+def test_async_route_checks_token_in_its_own_session(anonymous_client, monkeypatch):
+    headers = sign_in(anonymous_client)
+    auth_cache.tokens.clear()
+    # Счетчики изменений только что прочитаны при входе, их сессия в запросе не учитывается
+    monkeypatch.setenv("CHANGE_POLL_SECONDS", "60")
+
+    with track_queries() as stats:
+        assert anonymous_client.get(f"{API}/crystals/missing", headers=headers).status_code == 400
+
+    assert stats.sessions == 1
+    assert auth_cache.tokens.get(headers["Authorization"].removeprefix("Bearer ")) == LOGIN
+
+
+def test_sign_out_revokes_cached_token(anonymous_client):
+    headers = sign_in(anonymous_client)
+    assert anonymous_client.get(f"{API}/crystals", headers=headers).status_code == 200
+
+    assert anonymous_client.get(f"{API}/auth/sign-out", headers=headers).status_code == 200
+
+    assert anonymous_client.get(f"{API}/crystals", headers=headers).status_code == 401
+
+
+def test_sign_out_in_another_process_revokes_cached_token(anonymous_client):
+    headers = sign_in(anonymous_client)
+    assert anonymous_client.get(f"{API}/crystals", headers=headers).status_code == 200
+
+    with Session(engine) as session:
+        user = session.exec(select(User).where(User.login == LOGIN)).one()
+        user.access_token = None
+        bump_change_counter(session, AUTH_CHANGES)
+        session.commit()
+
+    assert anonymous_client.get(f"{API}/crystals", headers=headers).status_code == 401
+
+
+@pytest.mark.parametrize("commit", [True, False])
+def test_auth_entries_are_evicted_only_on_commit(commit):
+    auth_cache.sync()
+    auth_cache.put("token", LOGIN, 1, expires_at=4102444800)
+
+    with Session(engine) as session:
+        invalidate_user_auth(session, LOGIN)
+        assert auth_cache.tokens.get("token") == LOGIN
+        if commit:
+            session.commit()
+        else:
+            session.rollback()
+
+    assert (auth_cache.tokens.get("token") is None) == commit
@@ -0,0 +1,155 @@
+import hashlib
+import io
+import json
+import tarfile
+
+import pytest
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import Blob, ResultMetric, TestSuiteResult as StoredResult
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.routers import testsuiteresults
+from server.rdtsserver.utils.querystats import assert_max_queries
+from server.tests.conftest import API, create_assembly, create_testsuite, stored_files
+
+BATCH = f"{API}/testsuiteresults/batch"
+CONFIG = b'{"threshold": 1}'
+RESULT = b'{"ly": 1.0}'
+
+
+def bundle(manifest, files: dict[str, bytes] = None) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        members = {"manifest.json": json.dumps(manifest).encode(), **(files or {})}
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def empty_tar() -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w"):
+        pass
+    return buffer.getvalue()
+
+
+def entry(testsuite_idx: int, assembly_name: str, number: int = 0, timestamp: str = "2024-02-0110:00:00") -> dict:
+    return {"testsuite_idx": testsuite_idx, "assembly_name": assembly_name, "timestamp": timestamp,
+            "config": "config.json", "result": f"result{number}.json"}
+
+
+def upload(client, manifest, files: dict[str, bytes] = None):
+    files = {"config.json": CONFIG, **{f"result{number}.json": RESULT for number in range(len(manifest))},
+             **(files or {})}
+    return client.post(BATCH, files={"bundle": ("bundle.tar.gz", bundle(manifest, files))})
+
+
+def count(table) -> int:
+    with Session(engine) as session:
+        return len(session.exec(select(table)).all())
+
+
+@pytest.fixture
+def testsuite(client):
+    create_assembly(client, "A", ["c1", "c2"])
+    create_assembly(client, "B", ["c3"])
+    return create_testsuite(client)
+
+
+def test_valid_bundle_creates_all_results(client, testsuite):
+    response = upload(client, [entry(testsuite, "A", 0), entry(testsuite, "B", 1)])
+
+    assert response.status_code == 201, response.text
+    results = response.json()
+    assert [result["error"] for result in results] == [None, None]
+    for result in results:
+        created = client.get(f"{API}/testsuiteresults{result['idx']}/result")
+        assert created.content == RESULT
+    assert count(ResultMetric) == 3
+
+
+def test_shared_config_is_stored_once(client, testsuite):
+    upload(client, [entry(testsuite, "A", number) for number in range(3)])
+
+    with Session(engine) as session:
+        blob = session.get(Blob, hashlib.sha256(CONFIG).hexdigest())
+    assert (blob.size, blob.refcount) == (len(CONFIG), 3)
+
+
+def test_invalid_entries_are_reported_and_skipped(client, testsuite):
+    manifest = [entry(testsuite, "A", 0),
+                entry(testsuite + 100, "A", 1),
+                entry(testsuite, "missing", 2),
+                entry(testsuite, "A", 3, timestamp="yesterday"),
+                {"assembly_name": "A"},
+                {**entry(testsuite, "A", 5), "result": "absent.json"}]
+
+    response = upload(client, manifest)
+
+    assert response.status_code == 207
+    results = response.json()
+    assert results[0]["idx"] is not None and results[0]["error"] is None
+    assert results[1]["error"] == f"Test suite with id {testsuite + 100} not found!"
+    assert results[2]["error"] == "Crystals in assembly missing not found!"
+    assert all(result["idx"] is None and result["error"] for result in results[3:])
+    assert count(StoredResult) == 1
+
+
+def test_bundle_without_valid_entries_creates_nothing(client, testsuite):
+    existing = stored_files()
+
+    response = upload(client, [entry(testsuite, "missing", 0), entry(testsuite, "A", 1, timestamp="now")])
+
+    assert response.status_code == 207
+    assert all(result["error"] for result in response.json())
+    assert count(StoredResult) == 0
+    assert stored_files() == existing
+
+
+def test_empty_manifest(client, testsuite):
+    response = upload(client, [])
+
+    assert response.status_code == 201
+    assert response.json() == []
+
+
+@pytest.mark.parametrize("content, detail", [
+    (b"not a tar archive", "Bundle must be a tar archive!"),
+    (bundle({"testsuite_idx": 1}), "Bundle manifest.json must be a list of results!"),
+    (empty_tar(), "File manifest.json not found in bundle!"),
+])
+def test_malformed_bundle_is_rejected(client, testsuite, content, detail):
+    response = client.post(BATCH, files={"bundle": ("bundle.tar", content)})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == detail
+
+
+def test_failed_batch_leaves_no_rows_and_files(client, testsuite, monkeypatch):
+    existing = stored_files()
+    blobs = count(Blob)
+
+    def fail(session, rows):
+        raise RuntimeError("metrics are unavailable")
+
+    monkeypatch.setattr(testsuiteresults, "insert_result_metrics", fail)
+    with pytest.raises(RuntimeError):
+        upload(client, [entry(testsuite, "A", 0), entry(testsuite, "B", 1)])
+
+    assert count(StoredResult) == 0
+    assert count(Blob) == blobs
+    assert stored_files() == existing
+
+
+def test_batch_stays_within_query_budget(client, testsuite):
+    small = [entry(testsuite, "A", number) for number in range(2)]
+    large = [entry(testsuite, "A" if number % 2 else "B", number) for number in range(20)]
+
+    with assert_max_queries(30) as stats:
+        assert upload(client, small).status_code == 201
+    # SQLite не возвращает строки пакетного INSERT ... RETURNING в порядке параметров, поэтому
+    # результаты вставляются по одному; в PostgreSQL это один запрос и бюджет не растет
+    with assert_max_queries(stats.queries + len(large) - len(small)):
+        assert upload(client, large).status_code == 201
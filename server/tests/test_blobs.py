@@ -0,0 +1,96 @@
+import io
+
+import pytest
+from fastapi import UploadFile
+from sqlalchemy import create_engine, event
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import Blob
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.utils.blobs import collect_garbage, release_blob, store_blob
+from server.rdtsserver.utils.storage import blob_path
+from server.tests.conftest import stored_files
+
+# pysqlite не открывает транзакцию перед SAVEPOINT, и RELEASE фиксирует все изменения;
+# здесь транзакции начинает SQLAlchemy, чтобы savepoint-ы вели себя как в PostgreSQL
+savepoint_engine = create_engine(engine.url)
+
+
+@event.listens_for(savepoint_engine, "connect")
+def disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(savepoint_engine, "begin")
+def begin_transaction(connection):
+    connection.exec_driver_sql("BEGIN")
+
+
+def upload(content: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(content))
+
+
+@pytest.mark.parametrize("commit", [True, False])
+def test_files_of_a_transaction_are_kept_only_on_commit(commit):
+    with Session(savepoint_engine) as session:
+        hashes = [store_blob(session, upload(content))[0] for content in (b"first", b"second")]
+        if commit:
+            session.commit()
+        else:
+            session.rollback()
+
+    with Session(engine) as session:
+        assert len(session.exec(select(Blob)).all()) == (2 if commit else 0)
+    assert stored_files() == ({blob_path(sha256) for sha256 in hashes} if commit else set())
+
+
+def stored_blob(content: bytes, references: int) -> str:
+    with Session(engine) as session:
+        sha256, _ = store_blob(session, upload(content))
+        for _ in range(1 - references):
+            release_blob(session, sha256)
+        session.commit()
+    return sha256
+
+
+def test_garbage_collection_removes_unreferenced_blobs():
+    stored_blob(b"unused", 0)
+    used = stored_blob(b"used", 1)
+
+    with Session(engine) as session:
+        assert collect_garbage(session) == 1
+        assert [blob.sha256 for blob in session.exec(select(Blob)).all()] == [used]
+    assert stored_files() == {blob_path(used)}
+
+
+def test_failed_garbage_collection_keeps_rows_and_files(monkeypatch):
+    unused = stored_blob(b"unused", 0)
+
+    def fail(session):
+        raise RuntimeError("connection lost")
+
+    with Session(engine) as session:
+        monkeypatch.setattr(session, "commit", fail.__get__(session))
+        with pytest.raises(RuntimeError):
+            collect_garbage(session)
+
+    with Session(engine) as session:
+        assert session.get(Blob, unused) is not None
+    assert stored_files() == {blob_path(unused)}
+
+
+def test_garbage_collection_keeps_file_of_blob_stored_again():
+    unused = stored_blob(b"unused", 0)
+
+    def store_again(session):
+        with Session(engine) as other:
+            other.add(Blob(sha256=unused, size=len(b"unused"), refcount=1))
+            other.commit()
+
+    with Session(engine) as session:
+        event.listen(session, "after_commit", store_again, once=True)
+        assert collect_garbage(session) == 1
+
+    with Session(engine) as session:
+        assert session.get(Blob, unused).refcount == 1
+    assert stored_files() == {blob_path(unused)}
@@ -0,0 +1,86 @@
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.repository import find_inconsistent_crystals, refresh_current_crystal_states
+from server.rdtsserver.db.tables import CrystalStatus, CurrentCrystalState
+from server.rdtsserver.dependencies import engine
+from server.tests.conftest import API, create_assembly
+
+
+def current_states() -> dict[str, tuple]:
+    with Session(engine) as session:
+        return {state.crystal_name: (state.assembly_name, state.status)
+                for state in session.exec(select(CurrentCrystalState)).all()}
+
+
+def assert_consistent():
+    with Session(engine) as session:
+        assert find_inconsistent_crystals(session) == []
+
+
+def test_new_assembly_sets_current_states(client):
+    create_assembly(client, "A", ["c1", "c2"])
+
+    assert current_states() == {"c1": ("A", CrystalStatus.USED), "c2": ("A", CrystalStatus.USED)}
+    assert_consistent()
+
+
+def test_crystal_moved_to_another_assembly(client):
+    create_assembly(client, "A", ["c1", "c2"], "2024-01-01 10:00:00")
+    create_assembly(client, "B", ["c2", "c3"], "2024-01-02 10:00:00")
+
+    states = current_states()
+    assert states["c2"] == ("B", CrystalStatus.USED)
+    assert states["c3"] == ("B", CrystalStatus.USED)
+    assert states["c1"] == ("A", CrystalStatus.USED)
+    assert_consistent()
+
+
+def test_reassembly_releases_removed_crystals(client):
+    create_assembly(client, "A", ["c1", "c2"], "2024-01-01 10:00:00")
+    response = client.post(f"{API}/assemblies", json={"name": "A", "crystals": ["c3", "c2"],
+                                                       "timestamp": "2024-01-02 10:00:00"})
+    assert response.status_code == 207
+
+    states = current_states()
+    assert states["c1"] == ("A", CrystalStatus.UNUSED)
+    assert states["c3"] == ("A", CrystalStatus.USED)
+    assert client.get(f"{API}/crystals/c1").json()["current_assembly"] is None
+    assert_consistent()
+
+
+def test_deleting_latest_assembly_restores_previous_state(client):
+    create_assembly(client, "A", ["c1", "c2"], "2024-01-01 10:00:00")
+    create_assembly(client, "B", ["c2", "c3"], "2024-01-02 10:00:00")
+
+    assert client.delete(f"{API}/assemblies/B/2024-01-0210:00:00").status_code == 200
+
+    states = current_states()
+    assert states["c1"] == ("A", CrystalStatus.USED)
+    assert states["c2"] == ("A", CrystalStatus.UNUSED)
+    assert "c3" not in states
+    assert_consistent()
+
+
+def test_list_endpoints_read_current_states(client):
+    create_assembly(client, "A", ["c1", "c2"], "2024-01-01 10:00:00")
+    create_assembly(client, "B", ["c2"], "2024-01-02 10:00:00")
+
+    crystals = {crystal["name"]: crystal["current_assembly"] for crystal in client.get(f"{API}/crystals").json()}
+    assert crystals == {"c1": "A", "c2": "B"}
+    assert client.get(f"{API}/crystals/c2").json()["current_assembly"] == "B"
+
+
+def test_refresh_rebuilds_table_from_history(client):
+    create_assembly(client, "A", ["c1", "c2"], "2024-01-01 10:00:00")
+    create_assembly(client, "B", ["c2"], "2024-01-02 10:00:00")
+    expected = current_states()
+    with Session(engine) as session:
+        session.delete(session.get(CurrentCrystalState, "c2"))
+        session.commit()
+        assert find_inconsistent_crystals(session) == ["c2"]
+
+        refresh_current_crystal_states(session)
+        session.commit()
+
+    assert current_states() == expected
+    assert_consistent()
@@ -0,0 +1,111 @@
+import hashlib
+
+import pytest
+
+from server.tests.conftest import API, create_assembly, create_testsuite, create_testsuiteresult
+
+ARCHIVE = b"0123456789"
+DOWNLOAD = f"{API}/testsuites/download/TS"
+
+
+@pytest.fixture
+def testsuite(client):
+    return create_testsuite(client, content=ARCHIVE)
+
+
+def test_download_has_validators(client, testsuite):
+    response = client.get(DOWNLOAD)
+
+    assert response.status_code == 200
+    assert response.content == ARCHIVE
+    assert response.headers["etag"].startswith('"')
+    assert response.headers["accept-ranges"] == "bytes"
+    assert "last-modified" in response.headers
+
+
+def test_matching_etag_gives_304(client, testsuite):
+    etag = client.get(DOWNLOAD).headers["etag"]
+
+    response = client.get(DOWNLOAD, headers={"if-none-match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_other_etag_gives_content(client, testsuite):
+    response = client.get(DOWNLOAD, headers={"if-none-match": '"other"'})
+
+    assert response.status_code == 200
+    assert response.content == ARCHIVE
+
+
+def test_not_modified_since(client, testsuite):
+    last_modified = client.get(DOWNLOAD).headers["last-modified"]
+
+    assert client.get(DOWNLOAD, headers={"if-modified-since": last_modified}).status_code == 304
+
+
+@pytest.mark.parametrize("byte_range, content_range, content", [
+    ("bytes=3-5", "bytes 3-5/10", b"345"),
+    ("bytes=-4", "bytes 6-9/10", b"6789"),
+    ("bytes=7-", "bytes 7-9/10", b"789"),
+])
+def test_range(client, testsuite, byte_range, content_range, content):
+    response = client.get(DOWNLOAD, headers={"range": byte_range})
+
+    assert response.status_code == 206
+    assert response.headers["content-range"] == content_range
+    assert response.content == content
+
+
+def test_unsatisfiable_range(client, testsuite):
+    response = client.get(DOWNLOAD, headers={"range": "bytes=30-"})
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */10"
+
+
+def test_stale_if_range_gives_whole_file(client, testsuite):
+    response = client.get(DOWNLOAD, headers={"range": "bytes=3-5", "if-range": '"stale"'})
+
+    assert response.status_code == 200
+    assert response.content == ARCHIVE
+
+
+def test_matching_if_range_gives_range(client, testsuite):
+    etag = client.get(DOWNLOAD).headers["etag"]
+
+    response = client.get(DOWNLOAD, headers={"range": "bytes=3-5", "if-range": etag})
+
+    assert response.status_code == 206
+    assert response.content == b"345"
+
+
+def test_result_file_conditional_and_range(client, testsuite):
+    create_assembly(client, "A", ["c1"])
+    body = b'{"x":"abcdefghij"}'
+    idx = create_testsuiteresult(client, testsuite, "A", result=body)
+    url = f"{API}/testsuiteresults{idx}/result"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == body
+    assert client.get(url, headers={"if-none-match": response.headers["etag"]}).status_code == 304
+
+    response = client.get(url, headers={"range": "bytes=6-15"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 6-15/{len(body)}"
+    assert response.content == body[6:16]
+
+
+def test_config_etag_is_content_hash(client, testsuite):
+    create_assembly(client, "A", ["c1"])
+    config = b'{"a":1}'
+    idx = create_testsuiteresult(client, testsuite, "A", config=config)
+
+    response = client.get(f"{API}/testsuiteresults/{idx}/config", headers={"accept-encoding": "identity"})
+
+    assert response.status_code == 200
+    assert response.content == config
+    assert response.headers["etag"] == f'"{hashlib.sha256(config).hexdigest()}"'
@@ -0,0 +1,135 @@
+import io
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import UploadFile
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from server.rdtsserver.db.tables import IngestionJob, IngestionStatus, TestSuiteResult as StoredResult
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.routers.testsuiteresults import add_testsuiteresult_of_job, ingestion_queue
+from server.rdtsserver.utils.ingestion import IngestionQueue
+from server.tests.conftest import API, create_assembly, create_testsuite, stored_files
+
+JOBS = f"{API}/testsuiteresults/jobs"
+
+
+@pytest.fixture
+def queue():
+    yield ingestion_queue
+    ingestion_queue.stop()
+
+
+def submit(client, testsuite_idx: int, assembly_name: str):
+    return client.post(JOBS,
+                       params={"testsuite_idx": testsuite_idx, "assembly_name": assembly_name,
+                               "timestamp": "2024-02-0110:00:00"},
+                       files={"config": ("config.json", b'{"threshold": 1}'), "result": ("result.json", b'{"ly": 1.0}')})
+
+
+def wait_for(client, job_idx: str, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"{JOBS}/{job_idx}").json()
+        if job["status"] in (IngestionStatus.DONE.value, IngestionStatus.FAILED.value):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Ingestion job {job_idx} did not finish in {timeout} seconds")
+
+
+def test_job_creates_testsuiteresult(client, queue):
+    testsuite_idx = create_testsuite(client)
+    create_assembly(client, "A", ["c1"])
+
+    response = submit(client, testsuite_idx, "A")
+    assert response.status_code == 202, response.text
+    job = wait_for(client, response.json()["idx"])
+
+    assert job["status"] == IngestionStatus.DONE.value
+    assert job["error"] is None
+    result = client.get(f"{API}/testsuiteresults/{job['testsuiteresult_idx']}")
+    assert result.status_code == 200
+    assert result.json()["assembly_name"] == "A"
+
+
+def test_job_reports_failure(client, queue):
+    testsuite_idx = create_testsuite(client)
+
+    job = wait_for(client, submit(client, testsuite_idx, "missing").json()["idx"])
+
+    assert job["status"] == IngestionStatus.FAILED.value
+    assert job["error"]
+    assert job["testsuiteresult_idx"] is None
+
+
+def test_full_queue_rejects_uploads(client, queue, monkeypatch):
+    testsuite_idx = create_testsuite(client)
+    monkeypatch.setattr(ingestion_queue, "max_pending", 0)
+
+    response = submit(client, testsuite_idx, "A")
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+
+def add_running_job(testsuite_idx: int, started: datetime) -> str:
+    with Session(engine) as session:
+        job = IngestionJob(idx=uuid.uuid4().hex, status=IngestionStatus.RUNNING, testsuite_idx=testsuite_idx,
+                           assembly_name="A", timestamp=datetime(2024, 2, 1, 10), created=started, started=started)
+        session.add(job)
+        session.commit()
+        return job.idx
+
+
+def test_jobs_outliving_their_lease_are_queued_again(client):
+    testsuite_idx = create_testsuite(client)
+    create_assembly(client, "A", ["c1"])
+    stale = add_running_job(testsuite_idx, datetime.now() - timedelta(hours=1))
+    fresh = add_running_job(testsuite_idx, datetime.now())
+
+    queue = IngestionQueue(add_testsuiteresult_of_job, workers=1, max_pending=10, lease=60)
+    queue.start()
+    try:
+        # Файлы задания не сохранены, поэтому перезапущенное задание завершается ошибкой
+        assert wait_for(client, stale)["status"] == IngestionStatus.FAILED.value
+    finally:
+        queue.stop()
+
+    assert client.get(f"{JOBS}/{fresh}").json()["status"] == IngestionStatus.RUNNING.value
+
+
+def test_job_queued_again_while_running_creates_one_result(client):
+    testsuite_idx = create_testsuite(client)
+    create_assembly(client, "A", ["c1"])
+    existing = stored_files()
+
+    def queue_again_and_add(session, job, config, result):
+        # Пока задание выполняется, его аренда истекает и задание снова ставится в очередь
+        with Session(engine) as other:
+            other.exec(update(IngestionJob)
+                       .where(IngestionJob.idx == job.idx)
+                       .values(status=IngestionStatus.QUEUED, started=None))
+            other.commit()
+        return add_testsuiteresult_of_job(session, job, config, result)
+
+    queue = IngestionQueue(queue_again_and_add, workers=0, max_pending=10, lease=60)
+    with Session(engine) as session:
+        job_idx = queue.submit(session, testsuite_idx, "A", UploadFile(file=io.BytesIO(b'{"threshold": 1}')),
+                               UploadFile(file=io.BytesIO(b'{"ly": 1.0}')), datetime(2024, 2, 1, 10)).idx
+    queue.process(job_idx)
+
+    assert client.get(f"{JOBS}/{job_idx}").json()["status"] == IngestionStatus.QUEUED.value
+    with Session(engine) as session:
+        assert session.exec(select(StoredResult)).all() == []
+    assert stored_files() == existing
+
+    queue.handler = add_testsuiteresult_of_job
+    queue.process(job_idx)
+
+    job = client.get(f"{JOBS}/{job_idx}").json()
+    assert job["status"] == IngestionStatus.DONE.value
+    with Session(engine) as session:
+        assert [result.idx for result in session.exec(select(StoredResult)).all()] == [job["testsuiteresult_idx"]]
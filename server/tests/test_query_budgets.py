@@ -0,0 +1,52 @@
+import pytest
+
+from server.rdtsserver.utils.querystats import assert_max_queries
+from server.rdtsserver.utils.responsecache import response_cache
+from server.tests.conftest import API, create_assembly, create_testsuite, create_testsuiteresult
+
+ASSEMBLIES = 12
+
+
+@pytest.fixture
+def populated(client):
+    testsuite_idx = create_testsuite(client)
+    for number in range(ASSEMBLIES):
+        create_assembly(client, f"A{number}", [f"c{number}a", f"c{number}b", f"c{number}c"])
+        testsuiteresult_idx = create_testsuiteresult(client, testsuite_idx, f"A{number}")
+    response_cache.entries.clear()
+    return {"testsuite": testsuite_idx, "testsuiteresult": testsuiteresult_idx}
+
+
+@pytest.mark.parametrize("path, budget", [
+    ("/assemblies", 3),
+    ("/assemblies/A0", 2),
+    ("/crystals", 2),
+    ("/crystals/c0a", 1),
+    ("/testsuites", 2),
+    ("/testsuiteresults", 1),
+    ("/testsuiteresults/{testsuiteresult}", 1),
+])
+def test_read_endpoints_stay_within_budget(client, populated, path, budget):
+    """The number of statements does not grow with the number of rows in the response."""
+    with assert_max_queries(budget):
+        response = client.get(API + path.format(**populated))
+    assert response.status_code == 200, response.text
+
+
+def test_list_pages_are_within_budget(client, populated):
+    first = client.get(f"{API}/assemblies", params={"limit": 5})
+    with assert_max_queries(3):
+        second = client.get(f"{API}/assemblies", params={"limit": 5, "after": first.headers["x-next-cursor"]})
+    assert len(second.json()) == 5
+
+
+def test_cached_list_needs_no_query_but_the_change_poll(client, populated):
+    client.get(f"{API}/assemblies")
+    with assert_max_queries(1):
+        client.get(f"{API}/assemblies")
+
+
+def test_budget_violation_is_reported(client, populated):
+    with pytest.raises(AssertionError, match="Expected at most 0 queries"):
+        with assert_max_queries(0):
+            client.get(f"{API}/crystals/c0a")
@@ -0,0 +1,70 @@
+import pytest
+from sqlmodel import Session
+
+from server.rdtsserver.dependencies import engine
+from server.rdtsserver.utils.changes import bump_change_counter
+from server.rdtsserver.utils.querystats import track_queries
+from server.rdtsserver.utils.responsecache import response_cache, invalidate_responses, counter_name
+from server.tests.conftest import API, create_assembly
+
+
+def test_list_is_served_from_cache(client):
+    create_assembly(client, "A", ["c1"])
+    first = client.get(f"{API}/assemblies")
+
+    with track_queries() as stats:
+        second = client.get(f"{API}/assemblies")
+
+    assert second.content == first.content
+    assert second.headers["etag"] == first.headers["etag"]
+    assert stats.queries <= 1
+
+
+def test_cached_list_answers_304(client):
+    create_assembly(client, "A", ["c1"])
+    etag = client.get(f"{API}/assemblies").headers["etag"]
+
+    assert client.get(f"{API}/assemblies", headers={"if-none-match": etag}).status_code == 304
+
+
+def test_write_invalidates_cached_lists(client):
+    create_assembly(client, "A", ["c1"])
+    before = client.get(f"{API}/assemblies")
+    crystals_before = client.get(f"{API}/crystals")
+
+    create_assembly(client, "B", ["c2"])
+
+    after = client.get(f"{API}/assemblies")
+    assert [assembly["name"] for assembly in after.json()] == ["A", "B"]
+    assert after.headers["etag"] != before.headers["etag"]
+    assert client.get(f"{API}/crystals").headers["etag"] != crystals_before.headers["etag"]
+    assert client.get(f"{API}/assemblies", headers={"if-none-match": before.headers["etag"]}).status_code == 200
+
+
+def test_write_in_another_process_invalidates_cached_lists(client):
+    create_assembly(client, "A", ["c1"])
+    client.get(f"{API}/assemblies")
+
+    with Session(engine) as session:
+        bump_change_counter(session, counter_name("assemblies"))
+        session.commit()
+
+    with track_queries() as stats:
+        client.get(f"{API}/assemblies")
+    assert stats.queries > 1
+
+
+@pytest.mark.parametrize("commit", [True, False])
+def test_responses_expire_only_on_commit(client, commit):
+    create_assembly(client, "A", ["c1"])
+    client.get(f"{API}/assemblies")
+    entries = len(response_cache.entries)
+
+    with Session(engine) as session:
+        invalidate_responses(session, "assemblies")
+        if commit:
+            session.commit()
+        else:
+            session.rollback()
+
+    assert (len(response_cache.entries) < entries) == commit